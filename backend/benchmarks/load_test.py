@@ -0,0 +1,419 @@
+"""Offline load test: boots main:app against local stand-ins and drives it over HTTP.
+
+The server runs in a subprocess (so the load generator doesn't share its CPU)
+with the fake OpenAI client and an in-memory SQLite stand-in for Supabase
+(benchmarks/sqlite_postgrest.py), seeded with doctors, patients, links and
+consultations. Run from the backend directory:
+    python -m benchmarks.load_test --duration 30 --concurrency 32 --out results.json
+    python -m benchmarks.load_test --compare results.json   # against a previous run
+
+Scenarios (weights set with --mix):
+  list_doctors        GET /api/doctors (first page)
+  list_patients       GET /api/patients (first page)
+  doctor_patients     GET /api/doctors/{id}/patients
+  worklist            GET /api/doctors/{id}/worklist
+  patient_history     GET /api/consultations/patient/{id}
+  patient_search      GET /api/patients/search
+  doctor_patient_search GET /api/doctors/{id}/patients/search
+  notes_search        GET /api/consultations/search
+  process_audio       POST /api/consultations/process-audio, then wait for the job
+  process_audio_stream POST /api/consultations/process-audio/stream, read to the done event
+
+Every recording is unique, so the AI result cache never answers for the models.
+Latencies are end to end as the client saw them; process_audio includes queueing.
+"""
+import argparse
+import asyncio
+import bisect
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import wave
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_PATH = os.path.join(os.path.dirname(BACKEND_DIR), "supabase_schema.sql")
+
+DEFAULT_MIX = ("list_doctors=1,list_patients=3,doctor_patients=2,worklist=3,patient_history=2,"
+               "patient_search=4,doctor_patient_search=2,notes_search=2,process_audio=1")
+COMPLAINTS = ["dry cough", "chest pain", "headache", "lower back pain", "fever", "sore throat", "rash",
+              "fatigue", "dizziness", "abdominal pain", "shortness of breath", "joint pain"]
+DIAGNOSES = ["viral upper respiratory infection", "migraine", "muscle strain", "hypertension", "gastritis",
+             "contact dermatitis", "iron deficiency anaemia", "benign positional vertigo", "asthma"]
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+               "Aarav", "Priya", "Wei", "Mei", "Mohammed", "Fatima", "Carlos", "Sofia", "Olusegun", "Amara"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Sharma", "Patel", "Wang", "Li", "Khan", "Hassan", "Silva", "Rossi", "Adeyemi", "Okafor"]
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99), "mean": statistics.fmean(ordered)}
+
+
+# --- server side -------------------------------------------------------------
+
+def seed(transport, args, rng: random.Random):
+    """Fill the stand-in database directly; the API is what gets measured, not seeding."""
+    import uuid
+    conn = transport.conn
+    doctors = [(str(uuid.uuid4()), f"Dr {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}", "General Practice")
+               for i in range(args.doctors)]
+    patients = []
+    for i in range(args.patients):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        patients.append((
+            str(uuid.uuid4()), f"{first} {last} {i}",
+            f"{rng.randrange(1940, 2020)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+            f"+1 ({rng.randrange(200, 999)}) {rng.randrange(100, 999)}-{rng.randrange(1000, 9999)}",
+            f"{first}.{last}{i}@example.com".lower(),
+        ))
+    links = [(str(uuid.uuid4()), rng.choice(doctors)[0], p[0]) for p in patients]
+    consultations = []
+    for _ in range(args.consultations):
+        _, doctor_id, patient_id = rng.choice(links)
+        complaint, diagnosis = rng.choice(COMPLAINTS), rng.choice(DIAGNOSES)
+        consultations.append((
+            str(uuid.uuid4()), doctor_id, patient_id, complaint.capitalize(), diagnosis,
+            f"Advised rest and review; consider tests for {diagnosis}",
+            f"## Subjective\n- {complaint}\n## Assessment\n- {diagnosis}",
+            f"20{rng.randrange(20, 26)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T10:00:00",
+        ))
+    with conn:
+        conn.executemany("INSERT INTO doctors (id, name, specialty) VALUES (?, ?, ?)", doctors)
+        conn.executemany("INSERT INTO patients (id, name, date_of_birth, phone, email) VALUES (?, ?, ?, ?, ?)", patients)
+        conn.executemany("INSERT INTO doctor_patients (id, doctor_id, patient_id) VALUES (?, ?, ?)", links)
+        conn.executemany(
+            "INSERT INTO consultations (id, doctor_id, patient_id, chief_complaint, diagnosis, treatment_plan, "
+            "formatted_notes, consultation_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", consultations)
+        # Same indexes the real schema has for these access paths
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_patients_name_id ON patients(name, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_doctor_patients_doctor ON doctor_patients(doctor_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_consultations_patient_date_id ON consultations(patient_id, consultation_date, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_consultations_doctor_date_id ON consultations(doctor_id, consultation_date, id)")
+
+
+def serve(args):
+    """Configure the stand-ins, seed, and run main:app under uvicorn (the --serve process)."""
+    os.environ.update({
+        "SUPABASE_URL": "http://stand-in",
+        "SUPABASE_KEY": "offline",
+        "OPENAI_API_KEY": "offline",
+        "OPENAI_FAKE": "true",
+        "AI_CACHE_DB_PATH": "",
+        "JOB_DB_PATH": ":memory:",
+        "OUTBOX_DB_PATH": ":memory:",
+        "TRACE_SAMPLE_RATE": os.environ.get("TRACE_SAMPLE_RATE", "0"),
+    })
+    sys.path.insert(0, BACKEND_DIR)
+    import httpx
+    import uvicorn
+    from postgrest import AsyncPostgrestClient
+    from benchmarks.sqlite_postgrest import SQLitePostgrest
+    from services import database, openai_service
+    from services.fake_openai import FAKE_NOTES, ModelProfile
+    import main
+
+    with open(SCHEMA_PATH) as f:
+        transport = SQLitePostgrest(f.read(), latency=args.db_latency_ms / 1000)
+    seed(transport, args, random.Random(args.seed))
+    db = AsyncPostgrestClient(f"{os.environ['SUPABASE_URL']}/rest/v1")
+    db.session = httpx.AsyncClient(base_url=db.session.base_url, headers=db.session.headers, transport=transport)
+    database._db = db
+
+    config = openai_service.client.config
+    config.models = {
+        openai_service.AUDIO_MODEL: ModelProfile(args.audio_median, args.audio_sigma, args.audio_failure_rate),
+        openai_service.TRANSCRIBE_MODEL: ModelProfile(args.transcribe_median, args.transcribe_sigma,
+                                                      args.transcribe_failure_rate),
+        openai_service.NOTES_MODEL: ModelProfile(args.notes_median, args.notes_sigma, args.notes_failure_rate),
+    }
+    # Token output: pad the notes to roughly --notes-tokens tokens (4 characters each)
+    notes = dict(FAKE_NOTES)
+    padding = max(0, args.notes_tokens * 4 - len(json.dumps(notes)))
+    notes["formatted_notes"] += "\n" + ("- Discussed and documented. " * (padding // 28 + 1))[:padding]
+    config.completion_text = json.dumps(notes)
+    config.truncation_rate = args.truncation_rate
+
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+# --- load generator ----------------------------------------------------------
+
+def make_wav(rng: random.Random, seconds: float, sample_rate: int = 16000) -> bytes:
+    """A unique recording: a few tones with pauses and noise, so preprocessing has work to do."""
+    import numpy as np
+    generator = np.random.default_rng(rng.randrange(2 ** 32))
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = sum(np.sin(2 * np.pi * f * t) for f in generator.uniform(120, 400, size=3)) / 3
+    gate = (np.sin(2 * np.pi * 0.3 * t) > -0.3).astype(np.float32)
+    samples = (signal * gate * 0.5 + generator.normal(0, 0.01, t.size)) * 32767
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(samples.astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+class Workload:
+    def __init__(self, client, ids: dict, args, rng: random.Random):
+        self.client = client
+        self.ids = ids
+        self.args = args
+        self.rng = rng
+
+    def _query(self) -> str:
+        kind = self.rng.randrange(4)
+        first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+        if kind == 0:
+            return first[:2]
+        if kind == 1:
+            return f"{first} {last[:3]}"
+        if kind == 2:
+            return str(self.rng.randrange(200, 999))
+        return f"{first}.{last}".lower()
+
+    async def _get(self, path, **params):
+        response = await self.client.get(path, params=params)
+        response.raise_for_status()
+
+    async def list_doctors(self):
+        await self._get("/api/doctors", limit=50)
+
+    async def list_patients(self):
+        await self._get("/api/patients", limit=50)
+
+    async def doctor_patients(self):
+        await self._get(f"/api/doctors/{self.rng.choice(self.ids['doctors'])}/patients", limit=50)
+
+    async def worklist(self):
+        await self._get(f"/api/doctors/{self.rng.choice(self.ids['doctors'])}/worklist", limit=50)
+
+    async def patient_history(self):
+        await self._get(f"/api/consultations/patient/{self.rng.choice(self.ids['patients'])}", limit=20)
+
+    async def patient_search(self):
+        await self._get("/api/patients/search", q=self._query())
+
+    async def doctor_patient_search(self):
+        await self._get(f"/api/doctors/{self.rng.choice(self.ids['doctors'])}/patients/search", q=self._query())
+
+    async def notes_search(self):
+        await self._get("/api/consultations/search", doctor_id=self.rng.choice(self.ids["doctors"]),
+                        q=self.rng.choice(COMPLAINTS + DIAGNOSES).split()[-1])
+
+    def _form(self):
+        doctor, patient = self.rng.choice(self.ids["doctors"]), self.rng.choice(self.ids["patients"])
+        data = {"doctor_id": doctor, "patient_id": patient, "doctor_name": "Dr Load", "patient_name": "Load Test"}
+        files = {"audio": ("recording.wav", make_wav(self.rng, self.args.audio_seconds), "audio/wav")}
+        return data, files
+
+    async def process_audio(self):
+        data, files = self._form()
+        response = await self.client.post("/api/consultations/process-audio", data=data, files=files)
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        async with self.client.stream("GET", f"/api/consultations/jobs/{job_id}/events", timeout=None) as events:
+            async for line in events.aiter_lines():
+                if line.startswith("data:"):
+                    job = json.loads(line[5:])
+                    if job["status"] == "failed":
+                        raise RuntimeError(job.get("error"))
+                    if job["status"] == "succeeded":
+                        return
+        raise RuntimeError("Job stream ended before the job finished")
+
+    async def process_audio_stream(self):
+        data, files = self._form()
+        async with self.client.stream("POST", "/api/consultations/process-audio/stream", data=data, files=files,
+                                      timeout=None) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("event: done"):
+                    return
+                if line.startswith("event: error"):
+                    raise RuntimeError("Stream reported an error")
+        raise RuntimeError("Stream ended without a done event")
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if not hasattr(Workload, name.strip()):
+            raise SystemExit(f"Unknown scenario '{name.strip()}'")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+async def discover_ids(client) -> dict:
+    doctors = (await client.get("/api/doctors", params={"limit": 200})).json()
+    patients = (await client.get("/api/patients", params={"limit": 200})).json()
+    return {"doctors": [d["id"] for d in doctors], "patients": [p["id"] for p in patients]}
+
+
+async def drive(args) -> dict:
+    import httpx
+    weights = parse_mix(args.mix)
+    names, cumulative = list(weights), []
+    total = 0.0
+    for name in names:
+        total += weights[name]
+        cumulative.append(total)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=120) as client:
+        ids = await discover_ids(client)
+        samples = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+        error_examples = {}
+        measuring = False
+
+        async def worker(seed: int, stop_at: float):
+            rng = random.Random(seed)
+            workload = Workload(client, ids, args, rng)
+            while time.perf_counter() < stop_at:
+                name = names[bisect.bisect(cumulative, rng.random() * total)]
+                started = time.perf_counter()
+                try:
+                    await getattr(workload, name)()
+                except Exception as e:
+                    if measuring:
+                        errors[name] += 1
+                        error_examples.setdefault(name, f"{type(e).__name__}: {e}"[:200])
+                    continue
+                if measuring:
+                    samples[name].append(time.perf_counter() - started)
+
+        if args.warmup:
+            await asyncio.gather(*(worker(args.seed * 1000 + i, time.perf_counter() + args.warmup)
+                                   for i in range(args.concurrency)))
+        measuring = True
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(args.seed * 2000 + i, started + args.duration) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ms = lambda values: {k: round(v * 1000, 1) for k, v in percentiles(values).items()} if values else {}
+    results = {
+        name: {
+            "requests": len(samples[name]),
+            "errors": errors[name],
+            "throughput_rps": round(len(samples[name]) / elapsed, 2),
+            **ms(samples[name]),
+            **({"first_error": error_examples[name]} if name in error_examples else {}),
+        }
+        for name in names
+    }
+    everything = [s for values in samples.values() for s in values]
+    results["overall"] = {
+        "requests": len(everything),
+        "errors": sum(errors.values()),
+        "throughput_rps": round(len(everything) / elapsed, 2),
+        **ms(everything),
+    }
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline_path: str):
+    """Print throughput and p95 changes per scenario against a saved run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline.get('commit', '?')} ({baseline_path}):")
+    print(f"{'scenario':<22}{'rps':>10}{'change':>9}{'p95 ms':>10}{'change':>9}")
+    for name, now in current.items():
+        before = baseline["results"].get(name)
+        if not before or not now.get("requests") or not before.get("requests"):
+            continue
+        rps_change = (now["throughput_rps"] / before["throughput_rps"] - 1) * 100 if before["throughput_rps"] else 0
+        p95_change = (now["p95"] / before["p95"] - 1) * 100 if before["p95"] else 0
+        print(f"{name:<22}{now['throughput_rps']:>10.1f}{rps_change:>+8.1f}%{now['p95']:>10.1f}{p95_change:>+8.1f}%")
+
+
+async def wait_until_up(port: int, server: subprocess.Popen, timeout: float = 120):
+    import httpx
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise SystemExit(f"Server exited with code {server.returncode}")
+            try:
+                if (await client.get(f"http://127.0.0.1:{port}/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit("Server did not come up in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before measuring")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent simulated clients (closed loop)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario=weight,... (see above)")
+    parser.add_argument("--seed", type=int, default=7)
+    # Stand-in database
+    parser.add_argument("--doctors", type=int, default=50)
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--consultations", type=int, default=50000)
+    parser.add_argument("--db-latency-ms", type=float, default=2, help="simulated round-trip to the database")
+    # Fake OpenAI: lognormal latency (median seconds, sigma), failure rate and output size per model
+    parser.add_argument("--audio-median", type=float, default=6)
+    parser.add_argument("--audio-sigma", type=float, default=0.5)
+    parser.add_argument("--audio-failure-rate", type=float, default=0.02)
+    parser.add_argument("--transcribe-median", type=float, default=3)
+    parser.add_argument("--transcribe-sigma", type=float, default=0.4)
+    parser.add_argument("--transcribe-failure-rate", type=float, default=0.01)
+    parser.add_argument("--notes-median", type=float, default=4)
+    parser.add_argument("--notes-sigma", type=float, default=0.4)
+    parser.add_argument("--notes-failure-rate", type=float, default=0.01)
+    parser.add_argument("--notes-tokens", type=int, default=600, help="approximate completion size")
+    parser.add_argument("--truncation-rate", type=float, default=0.0, help="share of replies cut off mid-JSON")
+    parser.add_argument("--audio-seconds", type=float, default=20, help="length of each uploaded recording")
+    parser.add_argument("--server-log", default=os.devnull, help="where the server's output goes")
+    parser.add_argument("--out", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="previous --out file to compare against")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    with open(args.server_log, "w") as log:
+        server = subprocess.Popen([sys.executable, "-m", "benchmarks.load_test", "--serve", *sys.argv[1:]],
+                                  cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            asyncio.run(wait_until_up(args.port, server))
+            results = asyncio.run(drive(args))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(results, indent=2))
+    report = {"commit": git_commit(), "args": vars(args), "results": results}
+    if args.compare:
+        compare(results, args.compare)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
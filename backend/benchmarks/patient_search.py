@@ -0,0 +1,130 @@
+"""Patient search latency against table size: ranked search_patients RPC vs the old ILIKE scan.
+
+Needs a scratch Supabase project with supabase_schema.sql applied; SUPABASE_URL and
+SUPABASE_KEY come from the environment as usual. Run from the backend directory:
+    python -m benchmarks.patient_search --sizes 1000,10000,100000 --queries 50
+
+Seeded patients are tagged with address "benchmark-seed" and deleted afterwards
+unless --keep is given, so reruns grow the table only as far as needed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.database import get_db, execute, close_db  # noqa: E402
+
+SEED_MARKER = "benchmark-seed"
+INSERT_BATCH = 1000
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+               "Aarav", "Priya", "Wei", "Mei", "Mohammed", "Fatima", "Carlos", "Sofia", "Olusegun", "Amara"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Sharma", "Patel", "Wang", "Li", "Khan", "Hassan", "Silva", "Rossi", "Adeyemi", "Okafor"]
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {"p50": pick(50), "p95": pick(95), "mean": statistics.fmean(ordered)}
+
+
+def fake_patient(rng: random.Random) -> dict:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {
+        "name": f"{first} {last}-{rng.randrange(10 ** 6)}",
+        "phone": f"+1 ({rng.randrange(200, 999)}) {rng.randrange(100, 999)}-{rng.randrange(1000, 9999)}",
+        "email": f"{first}.{last}{rng.randrange(10 ** 4)}@example.com".lower(),
+        "date_of_birth": f"{rng.randrange(1940, 2020)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+        "address": SEED_MARKER,
+    }
+
+
+def sample_queries(rng: random.Random, n: int):
+    """A typeahead mix: short prefixes, longer prefixes, misspellings, phone digits, emails."""
+    queries = []
+    for _ in range(n):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        kind = rng.randrange(5)
+        if kind == 0:
+            queries.append(first[:2])
+        elif kind == 1:
+            queries.append(f"{first} {last[:3]}")
+        elif kind == 2 and len(last) > 3:
+            i = rng.randrange(1, len(last) - 1)
+            queries.append(last[:i] + last[i + 1:])
+        elif kind in (2, 3):
+            queries.append(str(rng.randrange(100, 999)))
+        else:
+            queries.append(f"{first}.{last}".lower())
+    return queries
+
+
+async def seeded_count() -> int:
+    db = get_db()
+    response = await execute(db.table("patients").select("id", count="exact").eq("address", SEED_MARKER).limit(1))
+    return response.count or 0
+
+
+async def grow_to(size: int, rng: random.Random):
+    have = await seeded_count()
+    db = get_db()
+    while have < size:
+        batch = [fake_patient(rng) for _ in range(min(INSERT_BATCH, size - have))]
+        await execute(db.table("patients").insert(batch, returning="minimal"), timeout=120)
+        have += len(batch)
+
+
+async def timed(query) -> float:
+    started = time.perf_counter()
+    await execute(query, timeout=60)
+    return time.perf_counter() - started
+
+
+async def run(queries, limit: int) -> dict:
+    db = get_db()
+    ranked, scan = [], []
+    for q in queries:
+        ranked.append(await timed(db.rpc("search_patients", {"q": q, "max_results": limit})))
+        scan.append(await timed(db.table("patients").select("*").ilike("name", f"%{q}%").order("name").limit(limit)))
+    ms = lambda samples: {k: round(v * 1000, 1) for k, v in percentiles(samples).items()}
+    return {"search_patients_ms": ms(ranked), "ilike_scan_ms": ms(scan)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated seeded table sizes")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="leave the seeded patients in place")
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    queries = sample_queries(rng, args.queries)
+    results = {}
+    try:
+        for size in sorted(int(s) for s in args.sizes.split(",")):
+            await grow_to(size, rng)
+            # Warm-up so the first size doesn't pay for connection setup and plan caching
+            await run(queries[:5], args.limit)
+            results[size] = await run(queries, args.limit)
+            print(f"{size} rows: {json.dumps(results[size])}")
+    finally:
+        if not args.keep:
+            await execute(get_db().table("patients").delete().eq("address", SEED_MARKER), timeout=300)
+        await close_db()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,387 @@
+"""SQLite stand-in for the Supabase REST API, for offline load tests.
+
+An httpx transport that answers the PostgREST requests this app makes from
+an in-memory SQLite database. Tables come from the CREATE TABLE / ALTER
+TABLE ... ADD COLUMN statements in supabase_schema.sql, so the stand-in
+follows schema changes. The SQL functions called over /rpc are
+reimplemented in Python: same parameters, result columns and ordering,
+with simpler matching (no trigram similarity or stemming).
+
+Supported: select (columns, `*`, `table!inner()` embeds used as filters),
+eq/neq/gt/gte/lt/lte/like/ilike/is/in filters, or/and logic trees, order,
+limit/offset, count=exact, single-object responses, insert, upsert
+(on_conflict with ignore or merge duplicates), update and delete.
+"""
+import asyncio
+import json
+import re
+import sqlite3
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+import httpx
+
+OPERATORS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "like": "LIKE", "ilike": "LIKE"}
+NOW = "(strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))"
+
+
+class PostgrestError(Exception):
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+def schema_statements(schema_sql: str) -> List[str]:
+    """Translate the table definitions in supabase_schema.sql to SQLite DDL."""
+    statements = []
+    for match in re.finditer(r"CREATE TABLE IF NOT EXISTS (\w+) \((.*?)\n\);", schema_sql, re.S):
+        body = re.sub(r"\s+DEFAULT uuid_generate_v4\(\)", "", match.group(2))
+        body = re.sub(r"DEFAULT NOW\(\)", f"DEFAULT {NOW}", body, flags=re.I)
+        statements.append(f"CREATE TABLE {match.group(1)} ({body})")
+    for table, column, definition in re.findall(
+        r"ALTER TABLE (\w+) ADD COLUMN IF NOT EXISTS (\w+) ([^;]+);", schema_sql
+    ):
+        definition = re.sub(r"DEFAULT NOW\(\)", f"DEFAULT {NOW}", definition, flags=re.I)
+        statements.append(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return statements
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas outside parentheses and double quotes."""
+    parts, depth, quoted, escaped, current = [], 0, False, False, []
+    for ch in text:
+        if escaped:
+            escaped = False
+        elif ch == "\\" and quoted:
+            escaped = True
+        elif ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(ch)
+    if current:
+        parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return re.sub(r"\\(.)", r"\1", value[1:-1])
+    return value
+
+
+class SQLitePostgrest(httpx.AsyncBaseTransport):
+    """Serves /rest/v1/<table> and /rest/v1/rpc/<function> from SQLite."""
+
+    def __init__(self, schema_sql: str, latency: float = 0.0):
+        self.latency = latency
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        for statement in schema_statements(schema_sql):
+            self.conn.execute(statement)
+        self.columns = {
+            table: [row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            for (table,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        }
+        self.functions: Dict[str, Callable[[dict], List[dict]]] = {
+            "search_patients": self._search_patients,
+            "search_doctor_patients": self._search_doctor_patients,
+            "search_consultations": self._search_consultations,
+            "doctor_worklist": self._doctor_worklist,
+        }
+
+    # --- transport -------------------------------------------------------
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            # Network round-trip to the database
+            await asyncio.sleep(self.latency)
+        try:
+            status, body, headers = self._handle(request)
+        except PostgrestError as e:
+            status, body, headers = e.status, {"code": e.code, "message": str(e), "details": None, "hint": None}, {}
+        except sqlite3.IntegrityError as e:
+            code = "23505" if "UNIQUE" in str(e) else "23503" if "FOREIGN KEY" in str(e) else "23502"
+            status, body, headers = 409, {"code": code, "message": str(e), "details": None, "hint": None}, {}
+        content = b"" if body is None else json.dumps(body).encode()
+        return httpx.Response(status, content=content, headers={"content-type": "application/json", **headers})
+
+    def _handle(self, request: httpx.Request) -> Tuple[int, object, dict]:
+        path = request.url.path.split("/rest/v1/", 1)[-1]
+        params = parse_qsl(request.url.query.decode(), keep_blank_values=True)
+        prefer = {p.strip() for p in request.headers.get("prefer", "").split(",") if p.strip()}
+        payload = json.loads(request.content) if request.content else None
+
+        if path.startswith("rpc/"):
+            function = self.functions.get(path[4:])
+            if function is None:
+                raise PostgrestError(404, "PGRST202", f"Could not find the function public.{path[4:]}")
+            return 200, function(payload or {}), {}
+
+        table = path
+        if table not in self.columns:
+            raise PostgrestError(404, "42P01", f'relation "public.{table}" does not exist')
+        method = request.method
+        if method == "GET":
+            rows, total = self._select(table, params, "count=exact" in prefer)
+            headers = {"content-range": f"0-{max(len(rows) - 1, 0)}/{total if total is not None else '*'}"}
+            if request.headers.get("accept") == "application/vnd.pgrst.object+json":
+                if len(rows) != 1:
+                    raise PostgrestError(406, "PGRST116", f"The result contains {len(rows)} rows")
+                return 200, rows[0], headers
+            return 200, rows, headers
+
+        minimal = "return=minimal" in prefer
+        if method == "POST":
+            rows = payload if isinstance(payload, list) else [payload]
+            on_conflict = dict(params).get("on_conflict")
+            resolution = next((p.split("=", 1)[1] for p in prefer if p.startswith("resolution=")), None)
+            result = self._insert(table, rows, on_conflict, resolution)
+            return 201, None if minimal else result, {}
+        where, args = self._where(table, params)
+        if method == "PATCH":
+            sets = ", ".join(f"{self._name(table, k)} = ?" for k in payload)
+            sql = f"UPDATE {table} SET {sets} WHERE {where} RETURNING *"
+            result = self._run(sql, list(payload.values()) + args)
+        elif method == "DELETE":
+            result = self._run(f"DELETE FROM {table} WHERE {where} RETURNING *", args)
+        else:
+            raise PostgrestError(405, "PGRST000", f"Unsupported method {method}")
+        return 200, None if minimal else result, {}
+
+    def _run(self, sql: str, args: list) -> List[dict]:
+        with self.conn:
+            return [dict(row) for row in self.conn.execute(sql, args).fetchall()]
+
+    # --- tables ----------------------------------------------------------
+
+    def _name(self, table: str, name: str) -> str:
+        if name not in self.columns[table]:
+            raise PostgrestError(400, "42703", f"column {table}.{name} does not exist")
+        return f'"{name}"'
+
+    def _column(self, table: str, name: str) -> str:
+        return f"{table}.{self._name(table, name)}"
+
+    def _condition(self, table: str, column: str, expression: str) -> Tuple[str, list]:
+        negate = expression.startswith("not.")
+        if negate:
+            expression = expression[4:]
+        op, _, value = expression.partition(".")
+        target = self._column(table, column)
+        if op in OPERATORS:
+            value = _unquote(value)
+            if op in ("like", "ilike"):
+                value = value.replace("*", "%")
+            sql, args = f"{target} {OPERATORS[op]} ?", [value]
+        elif op == "is":
+            sql, args = f"{target} IS {dict(null='NULL', true='1', false='0')[value.lower()]}", []
+        elif op == "in":
+            values = [_unquote(v) for v in _split_top_level(value.strip("()"))]
+            sql, args = f"{target} IN ({', '.join('?' * len(values))})", values
+        else:
+            raise PostgrestError(400, "PGRST100", f"Unsupported operator {op}")
+        return (f"NOT ({sql})" if negate else sql), args
+
+    def _logic(self, table: str, joiner: str, tree: str) -> Tuple[str, list]:
+        """`(a.eq.1,and(b.gt.2,c.lt.3))` -> SQL."""
+        clauses, args = [], []
+        for item in _split_top_level(tree.strip()[1:-1]):
+            nested = re.match(r"(not\.)?(and|or)(\(.*\))$", item, re.S)
+            if nested:
+                sql, item_args = self._logic(table, nested.group(2).upper(), nested.group(3))
+                sql = f"NOT ({sql})" if nested.group(1) else sql
+            else:
+                column, _, expression = item.partition(".")
+                sql, item_args = self._condition(table, column, expression)
+            clauses.append(sql)
+            args.extend(item_args)
+        return "(" + f" {joiner} ".join(clauses or ["1"]) + ")", args
+
+    def _embeds(self, table: str, params: list) -> Dict[str, Tuple[str, str]]:
+        """`other!inner()` in select -> {other: (join column in other, key in table)}."""
+        select = dict(params).get("select", "*")
+        embeds = {}
+        for item in _split_top_level(select):
+            match = re.match(r"(\w+)(?:!inner)?\(.*\)$", item)
+            if match:
+                other = match.group(1)
+                if other not in self.columns:
+                    raise PostgrestError(400, "PGRST200", f"No relationship between {table} and {other}")
+                embeds[other] = (f"{table[:-1] if table.endswith('s') else table}_id", "id")
+        return embeds
+
+    def _where(self, table: str, params: list) -> Tuple[str, list]:
+        clauses, args = [], []
+        embeds = self._embeds(table, params)
+        embedded_filters: Dict[str, list] = {name: [] for name in embeds}
+        for key, value in params:
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            if key in ("or", "and"):
+                sql, item_args = self._logic(table, key.upper(), value)
+            elif "." in key:
+                other, column = key.split(".", 1)
+                if other not in embeds:
+                    raise PostgrestError(400, "PGRST108", f"'{other}' is not an embedded resource")
+                embedded_filters[other].append(self._condition(other, column, value))
+                continue
+            else:
+                sql, item_args = self._condition(table, key, value)
+            clauses.append(sql)
+            args.extend(item_args)
+        # An !inner embed keeps only rows with a matching related row
+        for other, (foreign_key, key) in embeds.items():
+            conditions = [f"{other}.{foreign_key} = {table}.{key}"] + [sql for sql, _ in embedded_filters[other]]
+            clauses.append(f"EXISTS (SELECT 1 FROM {other} WHERE {' AND '.join(conditions)})")
+            for _, item_args in embedded_filters[other]:
+                args.extend(item_args)
+        return " AND ".join(clauses) or "1", args
+
+    def _select(self, table: str, params: list, count: bool) -> Tuple[List[dict], Optional[int]]:
+        options = dict(params)
+        columns = []
+        for item in _split_top_level(options.get("select", "*")):
+            if item == "*":
+                columns.append(f"{table}.*")
+            elif "(" not in item:
+                columns.append(self._column(table, item))
+        where, args = self._where(table, params)
+        sql = f"SELECT {', '.join(columns) or '1'} FROM {table} WHERE {where}"
+        if options.get("order"):
+            terms = []
+            for term in options["order"].split(","):
+                column, *modifiers = term.split(".")
+                direction = "DESC" if "desc" in modifiers else "ASC"
+                # Postgres puts NULLs last ascending and first descending
+                nulls = "FIRST" if "nullsfirst" in modifiers or ("desc" in modifiers and "nullslast" not in modifiers) else "LAST"
+                terms.append(f"{self._column(table, column)} {direction} NULLS {nulls}")
+            sql += " ORDER BY " + ", ".join(terms)
+        sql += f" LIMIT {int(options.get('limit', -1))} OFFSET {int(options.get('offset', 0))}"
+        rows = self._run(sql, args)
+        total = self.conn.execute(f"SELECT count(*) FROM {table} WHERE {where}", args).fetchone()[0] if count else None
+        return rows, total
+
+    def _insert(self, table: str, rows: List[dict], on_conflict: Optional[str], resolution: Optional[str]) -> List[dict]:
+        inserted = []
+        with self.conn:
+            for row in rows:
+                row = dict(row)
+                if "id" in self.columns[table]:
+                    row.setdefault("id", str(uuid.uuid4()))
+                names = ", ".join(self._name(table, k) for k in row)
+                sql = f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(row))})"
+                if on_conflict:
+                    target = ", ".join(self._name(table, c) for c in on_conflict.split(","))
+                    if resolution == "ignore-duplicates":
+                        sql += f" ON CONFLICT ({target}) DO NOTHING"
+                    else:
+                        updates = ", ".join(f'"{k}" = excluded."{k}"' for k in row if k != "id")
+                        sql += f" ON CONFLICT ({target}) DO UPDATE SET {updates}"
+                result = self.conn.execute(sql + " RETURNING *", list(row.values())).fetchone()
+                if result is not None:
+                    inserted.append(dict(result))
+        return inserted
+
+    # --- functions -------------------------------------------------------
+
+    def _search_patients(self, params: dict) -> List[dict]:
+        term = (params.get("q") or "").strip().lower()
+        limit = min(max(int(params.get("max_results", 20)), 1), 50)
+        if not term:
+            return []
+        pattern = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        if len(term) < 3:
+            return self._run(
+                "SELECT * FROM patients WHERE lower(name) LIKE ? ESCAPE '\\' ORDER BY lower(name), id LIMIT ?",
+                [pattern + "%", limit],
+            )
+        digits = re.sub(r"\D", "", term)
+        return self._run(
+            """
+            SELECT * FROM patients
+            WHERE lower(name) LIKE ? ESCAPE '\\' OR lower(email) LIKE ? ESCAPE '\\' OR date_of_birth = ?
+               OR (? AND replace(replace(replace(replace(replace(phone, ' ', ''), '-', ''), '(', ''), ')', ''), '+', '') LIKE ?)
+            ORDER BY lower(name) LIKE ? ESCAPE '\\' DESC, name, id
+            LIMIT ?
+            """,
+            [f"%{pattern}%", f"{pattern}%", term, len(digits) >= 3, f"%{digits}%", f"{pattern}%", limit],
+        )
+
+    def _search_doctor_patients(self, params: dict) -> List[dict]:
+        matches = self._search_patients(params)
+        linked = {
+            row["patient_id"] for row in self._run(
+                f"SELECT patient_id FROM doctor_patients WHERE doctor_id = ? AND patient_id IN "
+                f"({', '.join('?' * len(matches))})",
+                [params["doctor"]] + [m["id"] for m in matches],
+            )
+        } if matches else set()
+        fields = ("id", "name", "date_of_birth", "gender", "phone", "email", "allergies")
+        return [{**{f: m[f] for f in fields}, "linked": m["id"] in linked} for m in matches]
+
+    def _search_consultations(self, params: dict) -> List[dict]:
+        words = [w for w in re.findall(r"\w+", (params.get("q") or "").lower()) if len(w) > 1]
+        if not words:
+            return []
+        weighted = (("chief_complaint", 1.0), ("diagnosis", 1.0), ("treatment_plan", 0.4), ("formatted_notes", 0.1))
+        # Cheap prefilter in SQL, ranking in Python
+        prefilter = " OR ".join(f"lower({column}) LIKE ?" for column, _ in weighted for _ in words)
+        rows = self._run(
+            f"""
+            SELECT c.id, c.patient_id, p.name AS patient_name, c.consultation_date, c.chief_complaint, c.diagnosis,
+                   c.treatment_plan, c.formatted_notes
+            FROM consultations c LEFT JOIN patients p ON p.id = c.patient_id
+            WHERE c.doctor_id = ? AND ({prefilter})
+            """,
+            [params["doctor"]] + [f"%{w}%" for _ in weighted for w in words],
+        )
+        hits = []
+        for row in rows:
+            rank = sum(weight for column, weight in weighted for w in words if w in (row[column] or "").lower())
+            text = " ... ".join(row[column] for column, _ in weighted if row[column])
+            snippet = re.sub("(" + "|".join(map(re.escape, words)) + ")", r"<mark>\1</mark>", text[:200], flags=re.I)
+            hits.append({
+                "id": row["id"], "patient_id": row["patient_id"], "patient_name": row["patient_name"],
+                "consultation_date": row["consultation_date"], "chief_complaint": row["chief_complaint"],
+                "diagnosis": row["diagnosis"], "rank": round(rank / 10, 6), "snippet": snippet,
+            })
+        after_rank, after_id = params.get("after_rank"), params.get("after_id")
+        if after_rank is not None:
+            hits = [h for h in hits if (h["rank"], h["id"]) < (after_rank, after_id)]
+        hits.sort(key=lambda h: (h["rank"], h["id"]), reverse=True)
+        return hits[:int(params.get("max_results", 20))]
+
+    def _doctor_worklist(self, params: dict) -> List[dict]:
+        return self._run(
+            """
+            SELECT p.id, p.name, p.date_of_birth, p.gender, p.phone, p.allergies,
+                   latest.id AS last_consultation_id, latest.consultation_date AS last_visit,
+                   latest.chief_complaint AS last_chief_complaint, latest.diagnosis AS last_diagnosis,
+                   (SELECT min(c.follow_up_date) FROM consultations c
+                    WHERE c.patient_id = p.id AND c.doctor_id = dp.doctor_id
+                      AND c.follow_up_date >= date('now')) AS next_follow_up,
+                   (SELECT count(*) FROM consultations c
+                    WHERE c.patient_id = p.id AND c.doctor_id = dp.doctor_id) AS consultation_count
+            FROM doctor_patients dp
+            JOIN patients p ON p.id = dp.patient_id
+            LEFT JOIN consultations latest ON latest.id = (
+                SELECT c.id FROM consultations c
+                WHERE c.patient_id = p.id AND c.doctor_id = dp.doctor_id
+                ORDER BY c.consultation_date DESC, c.id DESC LIMIT 1
+            )
+            WHERE dp.doctor_id = ? AND (? IS NULL OR (p.name, p.id) > (?, ?))
+            ORDER BY p.name, p.id
+            LIMIT ?
+            """,
+            [params["doctor"], params.get("after_name"), params.get("after_name"), params.get("after_id"),
+             int(params.get("max_results", 50))],
+        )
@@ -0,0 +1,107 @@
+"""Tail latency of the GPT-4o audio -> Whisper path against the fake OpenAI client.
+
+Run from the backend directory:
+    python -m benchmarks.tail_latency --requests 400 --concurrency 16 --scale 0.01
+
+Compares three strategies on the same latency/failure profile:
+  fallback-only  primary first, Whisper only after it fails (the old behaviour)
+  hedged         Whisper also starts once the primary passes its observed p95
+  breaker+hedged as above, with the circuit breaker allowed to open
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.offline")
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+os.environ["OPENAI_FAKE"] = "true"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import openai_service  # noqa: E402
+from services.fake_openai import ModelProfile  # noqa: E402
+from services.resilience import CircuitBreaker, LatencyTracker, RetryBudget  # noqa: E402
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99), "mean": statistics.fmean(ordered)}
+
+
+def configure(args):
+    scale = args.scale
+    config = openai_service.client.config
+    config.models = {
+        openai_service.AUDIO_MODEL: ModelProfile(20 * scale, args.audio_sigma, args.audio_failure_rate),
+        openai_service.TRANSCRIBE_MODEL: ModelProfile(6 * scale, 0.4, 0.01),
+        openai_service.NOTES_MODEL: ModelProfile(8 * scale, 0.4, 0.01),
+    }
+    openai_service.HEDGE_DEFAULT_SECONDS = 45 * scale
+    openai_service.RETRY_BASE_DELAY_SECONDS = 0.5 * scale
+    # Measure model latency, not queueing behind the per-process call cap
+    openai_service._call_slots = asyncio.Semaphore(4 * args.concurrency)
+
+
+def reset(hedge: bool, breaker: bool, scale: float):
+    openai_service.HEDGE_ENABLED = hedge
+    openai_service.audio_latency = LatencyTracker()
+    openai_service.retry_budget = RetryBudget()
+    # A threshold nobody reaches keeps the breaker closed for the non-breaker runs
+    openai_service.audio_breaker = CircuitBreaker(
+        "gpt-4o-audio", 3 if breaker else 10 ** 9, 60 * scale
+    )
+
+
+async def run(args, hedge: bool, breaker: bool) -> dict:
+    reset(hedge, breaker, args.scale)
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one():
+        nonlocal failures
+        async with slots:
+            started = time.perf_counter()
+            try:
+                await openai_service.process_audio_resilient(b"\0" * 1024, "Patient", "Doctor")
+            except Exception:
+                failures += 1
+                return
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    # Report in unscaled seconds so runs with different --scale compare directly
+    stats = {k: round(v / args.scale, 2) for k, v in percentiles(latencies).items()} if latencies else {}
+    return {"ok": len(latencies), "failed": failures, "wall_seconds": round(elapsed, 2), **stats}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scale", type=float, default=0.01, help="multiply all simulated latencies")
+    parser.add_argument("--audio-sigma", type=float, default=0.8, help="spread of GPT-4o audio latency")
+    parser.add_argument("--audio-failure-rate", type=float, default=0.05)
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    configure(args)
+    results = {
+        "fallback-only": await run(args, hedge=False, breaker=False),
+        "hedged": await run(args, hedge=True, breaker=False),
+        "breaker+hedged": await run(args, hedge=True, breaker=True),
+    }
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
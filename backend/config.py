@@ -13,3 +13,107 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 if not OPENAI_API_KEY:
     raise ValueError("Missing OpenAI API key - set OPENAI_API_KEY")
+
+# OpenAI client tuning
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+OPENAI_AUDIO_TIMEOUT = float(os.getenv("OPENAI_AUDIO_TIMEOUT", "120"))
+OPENAI_TRANSCRIBE_TIMEOUT = float(os.getenv("OPENAI_TRANSCRIBE_TIMEOUT", "90"))
+OPENAI_CHAT_TIMEOUT = float(os.getenv("OPENAI_CHAT_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0"))
+
+# Background consultation jobs
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "100"))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+
+# Consultation saves are committed to a local SQLite outbox and written to Supabase in the background
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", "outbox.db")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_FLUSH_INTERVAL_SECONDS = float(os.getenv("OUTBOX_FLUSH_INTERVAL_SECONDS", "1"))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "60"))
+
+# Long recordings are split into overlapping chunks and transcribed in parallel
+CHUNKING_THRESHOLD_SECONDS = float(os.getenv("CHUNKING_THRESHOLD_SECONDS", "120"))
+CHUNK_SECONDS = float(os.getenv("CHUNK_SECONDS", "60"))
+CHUNK_OVERLAP_SECONDS = float(os.getenv("CHUNK_OVERLAP_SECONDS", "2"))
+# How far either side of each chunk boundary to look for a pause; at most half a chunk
+CHUNK_SEARCH_SECONDS = min(float(os.getenv("CHUNK_SEARCH_SECONDS", "8")), CHUNK_SECONDS / 2)
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+
+# Upload size cap and per-request ceiling on buffered audio
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+REQUEST_MEMORY_BUDGET_BYTES = int(float(os.getenv("REQUEST_MEMORY_BUDGET_MB", "256")) * 1024 * 1024)
+
+# Audio preprocessing before model calls
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "true").lower() in ("1", "true", "yes")
+AUDIO_TARGET_SAMPLE_RATE = int(os.getenv("AUDIO_TARGET_SAMPLE_RATE", "16000"))
+AUDIO_SILENCE_THRESHOLD_DB = float(os.getenv("AUDIO_SILENCE_THRESHOLD_DB", "-45"))
+AUDIO_MAX_PAUSE_SECONDS = float(os.getenv("AUDIO_MAX_PAUSE_SECONDS", "1.5"))
+AUDIO_CODEC = os.getenv("AUDIO_CODEC", "wav").lower()
+AUDIO_MP3_BITRATE = int(os.getenv("AUDIO_MP3_BITRATE", "32"))
+
+# AI result cache (memory LRU + SQLite); set AI_CACHE_DB_PATH empty to keep it in memory only
+AI_CACHE_MAX_BYTES = int(float(os.getenv("AI_CACHE_MAX_MB", "32")) * 1024 * 1024)
+AI_CACHE_DB_PATH = os.getenv("AI_CACHE_DB_PATH", "ai_cache.db")
+AI_CACHE_TTL_HOURS = float(os.getenv("AI_CACHE_TTL_HOURS", "168"))
+
+# Resilience for the GPT-4o audio -> Whisper fallback
+AUDIO_BREAKER_FAILURES = int(os.getenv("AUDIO_BREAKER_FAILURES", "3"))
+AUDIO_BREAKER_RESET_SECONDS = float(os.getenv("AUDIO_BREAKER_RESET_SECONDS", "60"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_DEFAULT_SECONDS = float(os.getenv("HEDGE_DEFAULT_SECONDS", "45"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.5"))
+
+# Token limits per notes request; longer transcripts are cut (truncate) or condensed (summarize) in the middle
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "16000"))
+TRANSCRIPT_OVERFLOW = os.getenv("TRANSCRIPT_OVERFLOW", "truncate").lower()
+OPENAI_MAX_COMPLETION_TOKENS = int(os.getenv("OPENAI_MAX_COMPLETION_TOKENS", "4096"))
+
+# Consultations re-noted at once by a batch regenerate (model calls are also capped by OPENAI_MAX_CONCURRENCY)
+REGENERATE_CONCURRENCY = int(os.getenv("REGENERATE_CONCURRENCY", "4"))
+
+# Also send the strict notes schema to GPT-4o audio (only if the audio model accepts structured outputs)
+AUDIO_RESPONSE_SCHEMA = os.getenv("AUDIO_RESPONSE_SCHEMA", "false").lower() in ("1", "true", "yes")
+
+# Offline stand-in for OpenAI (benchmarks and load tests)
+OPENAI_FAKE = os.getenv("OPENAI_FAKE", "false").lower() in ("1", "true", "yes")
+FAKE_OPENAI_MEDIAN_SECONDS = float(os.getenv("FAKE_OPENAI_MEDIAN_SECONDS", "2"))
+FAKE_OPENAI_SIGMA = float(os.getenv("FAKE_OPENAI_SIGMA", "0.5"))
+FAKE_OPENAI_FAILURE_RATE = float(os.getenv("FAKE_OPENAI_FAILURE_RATE", "0"))
+FAKE_OPENAI_TRUNCATION_RATE = float(os.getenv("FAKE_OPENAI_TRUNCATION_RATE", "0"))
+
+# Supabase (PostgREST) connection pool and query timeouts
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+DB_MAX_KEEPALIVE = int(os.getenv("DB_MAX_KEEPALIVE", "10"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_QUERY_TIMEOUT = float(os.getenv("DB_QUERY_TIMEOUT", "10"))
+
+# List endpoints (keyset pagination)
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "200"))
+
+# Patient typeahead search
+PATIENT_SEARCH_MAX_RESULTS = int(os.getenv("PATIENT_SEARCH_MAX_RESULTS", "20"))
+
+# Read-through cache for doctor/patient reads
+READ_CACHE_TTL_SECONDS = float(os.getenv("READ_CACHE_TTL_SECONDS", "60"))
+READ_CACHE_MAX_BYTES = int(float(os.getenv("READ_CACHE_MAX_MB", "16")) * 1024 * 1024)
+# e.g. redis://localhost:6379/0 to share the cache between uvicorn workers
+READ_CACHE_URL = os.getenv("READ_CACHE_URL", "")
+
+# Responses at least this large are gzip/brotli compressed when the client accepts it
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+# Bulk CSV/NDJSON imports
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "100000"))
+
+# Share of requests traced (Server-Timing header + JSON timing log); X-Debug-Timing: 1 forces one
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
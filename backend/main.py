@@ -1,11 +1,35 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from routers import doctors, patients, consultations
+from services import openai_service
+from services.database import close_db, read_cache, DatabaseTimeoutError
+from services.pagination import InvalidCursorError, NEXT_CURSOR_HEADER
+from services.http_cache import ConditionalCompressionMiddleware
+from services.tracing import ServerTimingMiddleware
+from services.metrics import MetricsMiddleware, registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from services.consultation_pipeline import consultation_jobs, consultation_outbox, ai_result_cache
+from config import COMPRESS_MIN_BYTES, TRACE_SAMPLE_RATE
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await consultation_outbox.start()
+    await consultation_jobs.start()
+    yield
+    await consultation_jobs.stop()
+    # Jobs may have just saved results; give them one last chance to reach Supabase
+    await consultation_outbox.stop()
+    await openai_service.close_client()
+    await close_db()
+
 
 app = FastAPI(
     title="Medical Consultation API",
     description="API for medical consultation recording and AI-powered note generation",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -14,7 +38,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+app.add_middleware(ConditionalCompressionMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+# Outside compression so 304s keep the header too
+app.add_middleware(ServerTimingMiddleware, sample_rate=TRACE_SAMPLE_RATE)
+# Outermost, so latency includes compression and CORS
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(DatabaseTimeoutError)
+async def database_timeout_handler(request: Request, exc: DatabaseTimeoutError):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursorError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
 
 app.include_router(doctors.router)
 app.include_router(patients.router)
@@ -24,7 +65,24 @@ app.include_router(consultations.router)
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "code": 200}
+    return {
+        "status": "healthy",
+        "code": 200,
+        "ai_audio_circuit": openai_service.audio_breaker.report(),
+        "consultation_outbox": consultation_outbox.report()
+    }
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit rates of this worker's read-through cache and AI result cache."""
+    return {"read_cache": read_cache.report(), "ai_results": ai_result_cache.report()}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """This worker's metrics in Prometheus text format."""
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
 
 
 @app.get("/")
@@ -1,13 +1,62 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, UploadFile, File, Form
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
-import re
-from services.supabase_client import get_supabase
-from services.openai_service import process_audio_with_gpt4o, process_audio_with_whisper_and_gpt4
+from datetime import date, timedelta
+import asyncio
+import json
+from fastapi.responses import StreamingResponse
+from services.database import get_db, execute
+from services.pagination import page_params, keyset, page, decode_cursor, merge_rows
+from services.consultation_pipeline import (
+    consultation_jobs,
+    consultation_outbox,
+    save_consultation,
+    update_consultation_row,
+    regenerate_notes,
+    is_long_recording,
+    transcribe_in_chunks,
+    prepare_audio,
+    encode_for_upload,
+    ai_result_cache,
+    ai_cache_key,
+)
+from services.openai_service import (
+    stream_notes_from_audio,
+    stream_notes_from_transcript,
+    transcribe_with_whisper,
+    complete_notes,
+    track_usage,
+    AUDIO_MODEL,
+    NOTES_MODEL,
+)
+from services.notes_schema import ALL_FIELDS, NOTE_FIELDS, validate_notes
+from services.resilience import CircuitOpenError
+from services.metrics import audio_path
+from services import tracing
+from services.tracing import span
+from services.json_stream import IncrementalJSONParser
+from services.audio_buffer import (
+    UploadTooLargeError,
+    read_upload,
+    estimate_peak_bytes,
+    memory_budget,
+    hold_memory,
+)
+from config import MAX_UPLOAD_BYTES, REQUEST_MEMORY_BUDGET_BYTES
+from services.jobs import QueueFullError, FINISHED_STATES
 
 router = APIRouter(prefix="/api/consultations", tags=["consultations"])
 
+# Keep proxies from buffering event streams
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Everything but search_vector, which is only used inside the database
+CONSULTATION_COLUMNS = (
+    "id, doctor_id, patient_id, raw_transcript, formatted_notes, chief_complaint, "
+    "diagnosis, treatment_plan, follow_up_date, consultation_date, created_at, "
+    "prompt_tokens, cached_tokens, completion_tokens"
+)
+
 
 class ConsultationUpdate(BaseModel):
     formatted_notes: Optional[str] = None
@@ -29,9 +78,48 @@ class ConsultationResponse(BaseModel):
     follow_up_date: Optional[str]
     consultation_date: str
     created_at: str
+    prompt_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+
+class RegenerateBatch(BaseModel):
+    start: date
+    end: date
+    doctor_id: Optional[str] = None
+
+
+class RegenerateResult(BaseModel):
+    id: str
+    status: str
+    detail: Optional[str] = None
+    consultation: Optional[ConsultationResponse] = None
+
 
+class ConsultationSearchHit(BaseModel):
+    id: str
+    patient_id: Optional[str]
+    patient_name: Optional[str]
+    consultation_date: str
+    chief_complaint: Optional[str]
+    diagnosis: Optional[str]
+    rank: float
+    snippet: str
+
+
+async def _read_audio(audio: UploadFile) -> bytes:
+    """Read an upload within the size cap and check it fits the memory budget."""
+    try:
+        with span("upload_read"):
+            audio_bytes = await read_upload(audio, MAX_UPLOAD_BYTES)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if estimate_peak_bytes(len(audio_bytes)) > REQUEST_MEMORY_BUDGET_BYTES:
+        raise HTTPException(status_code=413, detail="Recording is too large to process within the memory budget")
+    return audio_bytes
 
-@router.post("/process-audio")
+
+@router.post("/process-audio", status_code=202)
 async def process_consultation_audio(
     audio: UploadFile = File(...),
     doctor_id: str = Form(...),
@@ -39,79 +127,245 @@ async def process_consultation_audio(
     doctor_name: str = Form(...),
     patient_name: str = Form(...)
 ):
-    """Process audio recording and generate medical notes."""
-    
-    audio_bytes = await audio.read()
-    
-    try:
-        result = await process_audio_with_gpt4o(audio_bytes, patient_name, doctor_name)
-    except Exception as e:
-        print(f"GPT-4o audio failed, falling back to Whisper: {e}")
-        result = await process_audio_with_whisper_and_gpt4(audio_bytes, patient_name, doctor_name)
+    """Queue an audio recording for transcription and note generation."""
     
-    supabase = get_supabase()
-    consultation_data = {
+    audio_bytes = await _read_audio(audio)
+    payload = {
         "doctor_id": doctor_id,
         "patient_id": patient_id,
-        "raw_transcript": result.get("transcript", ""),
-        "formatted_notes": result.get("formatted_notes", ""),
-        "chief_complaint": result.get("chief_complaint", ""),
-        "diagnosis": result.get("diagnosis", ""),
-        "treatment_plan": result.get("treatment_plan", ""),
-        "consultation_date": datetime.now().isoformat()
+        "doctor_name": doctor_name,
+        "patient_name": patient_name,
+        # The job traces itself if this request is traced
+        "trace": tracing.current() is not None
     }
     
-    # Only set follow_up_date if it looks like a valid date
-    follow_up = result.get("follow_up", "")
-    if follow_up and follow_up.lower() not in ["not discussed", "n/a", "none", ""]:
-        # Check if it matches a date pattern (YYYY-MM-DD or similar)
-        if re.match(r'\d{4}-\d{2}-\d{2}', follow_up):
-            consultation_data["follow_up_date"] = follow_up
+    try:
+        job = await consultation_jobs.submit(payload, audio_bytes)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     
-    response = supabase.table("consultations").insert(consultation_data).execute()
+    return {"job_id": job["id"], "status": job["status"]}
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _changed_fields(parser: IncrementalJSONParser, notes: dict):
+    """`field` events for values the stream didn't deliver as-is (repaired fields)."""
+    for key, value in notes.items():
+        if parser.fields.get(key) != value:
+            yield _sse("field", {"field": key, "value": value})
+
+
+async def _stream_ai_result(audio_bytes: bytes, patient_name: str, doctor_name: str, outcome: dict):
+    """Yield SSE events while the models produce notes; fills `outcome` with the final result."""
+    parser = IncrementalJSONParser()
+    notes = None
+    prepared = await prepare_audio(audio_bytes)
+    long_recording = is_long_recording(prepared)
+    if not long_recording:
+        data, audio_format = await encode_for_upload(prepared.wav_bytes)
+        try:
+            try:
+                async for text in stream_notes_from_audio(data, patient_name, doctor_name, audio_format):
+                    for kind, key, value in parser.feed(text):
+                        yield _sse(kind, {"field": key, "value": value})
+            except ValueError as e:
+                # Malformed JSON: keep the fields completed so far and repair the rest
+                print(f"GPT-4o audio stream produced malformed JSON: {e}")
+            # Raises ValueError if even the transcript is unusable
+            notes = await complete_notes(parser.fields, AUDIO_MODEL, ALL_FIELDS, patient_name, doctor_name)
+            for event in _changed_fields(parser, notes):
+                yield event
+            audio_path.inc("primary")
+        except Exception as e:
+            print(f"GPT-4o audio stream failed, falling back to Whisper: {e}")
+            audio_path.inc("circuit_open" if isinstance(e, CircuitOpenError) else "fallback")
+            yield _sse("reset", {"reason": "fallback"})
+            parser = IncrementalJSONParser()
+    else:
+        audio_path.inc("chunked")
     
-    if not response.data:
-        raise HTTPException(status_code=500, detail="Failed to save consultation")
+    if notes is None:
+        if long_recording:
+            transcript = await transcribe_in_chunks(prepared.wav_bytes)
+        else:
+            transcript = await transcribe_with_whisper(data, audio_format)
+        yield _sse("field", {"field": "transcript", "value": transcript})
+        try:
+            async for text in stream_notes_from_transcript(transcript, patient_name, doctor_name):
+                for kind, key, value in parser.feed(text):
+                    if key != "transcript":
+                        yield _sse(kind, {"field": key, "value": value})
+        except ValueError as e:
+            print(f"Notes stream produced malformed JSON: {e}")
+        except Exception as e:
+            # The transcript is already paid for; repair (or save) from what arrived
+            print(f"Notes stream failed: {e}")
+        try:
+            notes = await complete_notes(parser.fields, NOTES_MODEL, NOTE_FIELDS, patient_name, doctor_name,
+                                         transcript)
+            for event in _changed_fields(parser, notes):
+                yield event
+        except Exception as e:
+            # Keep what was written rather than lose the consultation
+            print(f"Notes repair failed, saving the fields received: {e}")
+            notes, _ = validate_notes(parser.fields, NOTE_FIELDS)
+        notes = {"transcript": transcript, **notes}
     
-    return {
-        "consultation": response.data[0],
-        "ai_result": result
-    }
+    outcome["result"] = notes
+    outcome["preprocessing"] = prepared.stats
+
+
+@router.post("/process-audio/stream")
+async def stream_consultation_audio(
+    audio: UploadFile = File(...),
+    doctor_id: str = Form(...),
+    patient_id: str = Form(...),
+    doctor_name: str = Form(...),
+    patient_name: str = Form(...)
+):
+    """Process audio and stream the notes back as server-sent events.
+
+    Events: `partial` (new text of the field being written), `field` (a completed
+    field), `reset` (discard partial output, the fallback model is starting),
+    `done` (saved consultation and full result) and `error`.
+    """
+    
+    audio_bytes = await _read_audio(audio)
+    
+    async def events():
+        key = ai_cache_key(audio_bytes, patient_name, doctor_name)
+        try:
+            with memory_budget(REQUEST_MEMORY_BUDGET_BYTES) as budget, hold_memory(len(audio_bytes), "upload"), \
+                    track_usage() as tokens:
+                # A double submit of the same audio waits here for the first one's result
+                with span("cache_lookup"):
+                    result, lead = await ai_result_cache.claim(key)
+                preprocessing = {}
+                if lead is None:
+                    for field, value in result.items():
+                        yield _sse("field", {"field": field, "value": value})
+                else:
+                    outcome = {}
+                    try:
+                        async for event in _stream_ai_result(audio_bytes, patient_name, doctor_name, outcome):
+                            yield event
+                    except BaseException as e:
+                        lead.fail(e)
+                        raise
+                    result, preprocessing = outcome["result"], outcome["preprocessing"]
+                    # Notes saved incomplete are regenerated from the transcript, not served again
+                    await lead.finish(result, store=not validate_notes(result, ALL_FIELDS)[1])
+            consultation = await save_consultation(doctor_id, patient_id, result, tokens.columns())
+            done = {
+                "consultation": consultation,
+                "ai_result": result,
+                "memory": budget.report(),
+                "preprocessing": preprocessing
+            }
+            # Sent after the headers, so the breakdown can't go in Server-Timing
+            request_trace = tracing.current()
+            if request_trace is not None:
+                done["timings"] = request_trace.report()
+            yield _sse("done", done)
+        except Exception as e:
+            print(f"Streaming consultation failed: {e}")
+            yield _sse("error", {"detail": str(e)})
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.get("/cache/stats")
+async def get_ai_cache_stats():
+    """Hit, miss and coalescing counters for the AI result cache."""
+    return ai_result_cache.report()
+
+
+@router.get("/jobs/{job_id}")
+async def get_consultation_job(job_id: str):
+    """Get the status (and result, once finished) of a processing job."""
+    job = await consultation_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_consultation_job(job_id: str):
+    """Stream job status changes as server-sent events until the job finishes."""
+    job = await consultation_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def events():
+        updates = consultation_jobs.subscribe(job_id)
+        try:
+            # Re-read after subscribing so a transition in between isn't missed
+            current = await consultation_jobs.get(job_id)
+            yield f"data: {json.dumps(current)}\n\n"
+            while current["status"] not in FINISHED_STATES:
+                try:
+                    current = await asyncio.wait_for(updates.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(current)}\n\n"
+        finally:
+            consultation_jobs.unsubscribe(job_id, updates)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.get("/search", response_model=List[ConsultationSearchHit])
+async def search_consultations(response: Response, doctor_id: str, q: str = Query(..., min_length=1, max_length=200),
+                               paging: dict = Depends(page_params)):
+    """Full-text search over a doctor's consultations, best matches first, with highlighted snippets."""
+    params = {"doctor": doctor_id, "q": q, "max_results": paging["limit"] + 1}
+    if paging["cursor"]:
+        params["after_rank"], params["after_id"] = decode_cursor(paging["cursor"])
+    db = get_db()
+    result = await execute(db.rpc("search_consultations", params))
+    return page(result.data, "rank", paging["limit"], response)
+
+
+async def _consultation_page(column: str, value: str, response: Response, paging: dict) -> list:
+    """One page of consultations where `column` = `value`, newest first, including unsynced saves."""
+    # Outbox first: a row flushed in between is then in the query result instead
+    pending = await consultation_outbox.pending(column, value)
+    db = get_db()
+    query = db.table("consultations").select(CONSULTATION_COLUMNS).eq(column, value)
+    result = await execute(keyset(query, "consultation_date", desc=True, **paging))
+    rows = merge_rows(result.data, pending, "consultation_date", paging["cursor"], paging["limit"], desc=True)
+    return page(rows, "consultation_date", paging["limit"], response)
 
 
 @router.get("/patient/{patient_id}", response_model=List[ConsultationResponse])
-async def get_patient_consultations(patient_id: str):
-    """Get all consultations for a patient."""
-    supabase = get_supabase()
-    response = supabase.table("consultations")\
-        .select("*")\
-        .eq("patient_id", patient_id)\
-        .order("consultation_date", desc=True)\
-        .execute()
-    return response.data
+async def get_patient_consultations(patient_id: str, response: Response, paging: dict = Depends(page_params)):
+    """Get consultations for a patient, newest first, one page at a time."""
+    return await _consultation_page("patient_id", patient_id, response, paging)
 
 
 @router.get("/doctor/{doctor_id}", response_model=List[ConsultationResponse])
-async def get_doctor_consultations(doctor_id: str):
-    """Get all consultations by a doctor."""
-    supabase = get_supabase()
-    response = supabase.table("consultations")\
-        .select("*")\
-        .eq("doctor_id", doctor_id)\
-        .order("consultation_date", desc=True)\
-        .execute()
-    return response.data
+async def get_doctor_consultations(doctor_id: str, response: Response, paging: dict = Depends(page_params)):
+    """Get consultations by a doctor, newest first, one page at a time."""
+    return await _consultation_page("doctor_id", doctor_id, response, paging)
 
 
 @router.get("/{consultation_id}", response_model=ConsultationResponse)
 async def get_consultation(consultation_id: str):
     """Get a consultation by ID."""
-    supabase = get_supabase()
-    response = supabase.table("consultations")\
-        .select("*")\
-        .eq("id", consultation_id)\
-        .single()\
-        .execute()
+    pending = await consultation_outbox.get(consultation_id)
+    if pending:
+        return pending
+    db = get_db()
+    response = await execute(
+        db.table("consultations")
+        .select(CONSULTATION_COLUMNS)
+        .eq("id", consultation_id)
+        .single()
+    )
     if not response.data:
         raise HTTPException(status_code=404, detail="Consultation not found")
     return response.data
@@ -120,24 +374,51 @@ async def get_consultation(consultation_id: str):
 @router.put("/{consultation_id}", response_model=ConsultationResponse)
 async def update_consultation(consultation_id: str, update: ConsultationUpdate):
     """Update consultation notes (for doctor edits)."""
-    supabase = get_supabase()
     update_data = update.model_dump(exclude_none=True)
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    response = supabase.table("consultations")\
-        .update(update_data)\
-        .eq("id", consultation_id)\
-        .execute()
-    
-    if not response.data:
+    consultation = await update_consultation_row(consultation_id, update_data)
+    if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found")
-    return response.data[0]
+    return consultation
+
+
+@router.post("/regenerate", response_model=List[RegenerateResult])
+async def regenerate_consultations(batch: RegenerateBatch, response: Response, paging: dict = Depends(page_params)):
+    """Regenerate the notes of one page of consultations dated start..end (inclusive), oldest first.
+
+    Call again with the `X-Next-Cursor` header's cursor for the next page.
+    """
+    if batch.end < batch.start:
+        raise HTTPException(status_code=400, detail="end is before start")
+    db = get_db()
+    query = db.table("consultations")\
+        .select(CONSULTATION_COLUMNS)\
+        .gte("consultation_date", batch.start.isoformat())\
+        .lt("consultation_date", (batch.end + timedelta(days=1)).isoformat())
+    if batch.doctor_id:
+        query = query.eq("doctor_id", batch.doctor_id)
+    result = await execute(keyset(query, "consultation_date", **paging))
+    return await regenerate_notes(page(result.data, "consultation_date", paging["limit"], response))
+
+
+@router.post("/{consultation_id}/regenerate", response_model=ConsultationResponse)
+async def regenerate_consultation(consultation_id: str):
+    """Regenerate a consultation's notes from its stored transcript, without the audio."""
+    consultation = await get_consultation(consultation_id)
+    outcome = (await regenerate_notes([consultation]))[0]
+    if outcome["status"] == "skipped":
+        raise HTTPException(status_code=409, detail=outcome["detail"])
+    if outcome["status"] == "failed":
+        raise HTTPException(status_code=502, detail=outcome["detail"])
+    return outcome["consultation"]
 
 
 @router.delete("/{consultation_id}")
 async def delete_consultation(consultation_id: str):
     """Delete a consultation."""
-    supabase = get_supabase()
-    supabase.table("consultations").delete().eq("id", consultation_id).execute()
+    await consultation_outbox.discard(consultation_id)
+    db = get_db()
+    await execute(db.table("consultations").delete().eq("id", consultation_id))
     return {"message": "Consultation deleted successfully"}
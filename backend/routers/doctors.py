@@ -1,7 +1,18 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List
-from services.supabase_client import get_supabase
+from datetime import date
+from uuid import UUID
+from services.database import get_db, execute, read_cache
+from services.pagination import page_params, keyset, page, decode_cursor, sort_value
+from services.consultation_pipeline import consultation_outbox
+from services.bulk_import import (
+    UnsupportedImportFormat,
+    import_format,
+    iter_rows,
+    run_import,
+)
+from config import IMPORT_BATCH_SIZE, IMPORT_MAX_ROWS, PATIENT_SEARCH_MAX_RESULTS
 
 router = APIRouter(prefix="/api/doctors", tags=["doctors"])
 
@@ -13,6 +24,37 @@ class DoctorCreate(BaseModel):
     phone: Optional[str] = None
 
 
+class DoctorPatientLink(BaseModel):
+    doctor_id: UUID
+    patient_id: UUID
+
+
+class WorklistEntry(BaseModel):
+    id: str
+    name: str
+    date_of_birth: Optional[str]
+    gender: Optional[str]
+    phone: Optional[str]
+    allergies: Optional[str]
+    last_consultation_id: Optional[str]
+    last_visit: Optional[str]
+    last_chief_complaint: Optional[str]
+    last_diagnosis: Optional[str]
+    next_follow_up: Optional[str]
+    consultation_count: int
+
+
+class DoctorPatientMatch(BaseModel):
+    id: str
+    name: str
+    date_of_birth: Optional[str]
+    gender: Optional[str]
+    phone: Optional[str]
+    email: Optional[str]
+    allergies: Optional[str]
+    linked: bool
+
+
 class DoctorResponse(BaseModel):
     id: str
     name: str
@@ -23,77 +65,177 @@ class DoctorResponse(BaseModel):
 
 
 @router.get("", response_model=List[DoctorResponse])
-async def list_doctors():
-    """Get all doctors."""
-    supabase = get_supabase()
-    response = supabase.table("doctors").select("*").order("name").execute()
-    return response.data
+async def list_doctors(response: Response, paging: dict = Depends(page_params)):
+    """Get doctors by name, one page at a time."""
+    async def load():
+        db = get_db()
+        result = await execute(keyset(db.table("doctors").select("*"), "name", **paging))
+        return result.data
+
+    rows = await read_cache.get_or_load(("doctors",), f"list:{paging['cursor']}:{paging['limit']}", load)
+    return page(rows, "name", paging["limit"], response)
 
 
 @router.post("", response_model=DoctorResponse)
 async def create_doctor(doctor: DoctorCreate):
     """Create a new doctor."""
-    supabase = get_supabase()
-    response = supabase.table("doctors").insert(doctor.model_dump()).execute()
+    db = get_db()
+    response = await execute(db.table("doctors").insert(doctor.model_dump()))
     if not response.data:
         raise HTTPException(status_code=400, detail="Failed to create doctor")
+    await read_cache.invalidate("doctors")
     return response.data[0]
 
 
 @router.get("/{doctor_id}", response_model=DoctorResponse)
 async def get_doctor(doctor_id: str):
     """Get a doctor by ID."""
-    supabase = get_supabase()
-    response = supabase.table("doctors").select("*").eq("id", doctor_id).single().execute()
-    if not response.data:
+    async def load():
+        db = get_db()
+        response = await execute(db.table("doctors").select("*").eq("id", doctor_id).single())
+        return response.data
+
+    doctor = await read_cache.get_or_load(("doctors",), f"id:{doctor_id}", load)
+    if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
-    return response.data
+    return doctor
 
 
 @router.get("/{doctor_id}/patients")
-async def get_doctor_patients(doctor_id: str):
-    """Get all patients linked to a doctor."""
-    supabase = get_supabase()
-    response = supabase.table("doctor_patients")\
-        .select("patient_id, patients(*)")\
-        .eq("doctor_id", doctor_id)\
-        .execute()
-    
-    patients = [item["patients"] for item in response.data if item.get("patients")]
-    return patients
+async def get_doctor_patients(doctor_id: str, response: Response, paging: dict = Depends(page_params)):
+    """Get the patients linked to a doctor by name, one page at a time."""
+    async def load():
+        db = get_db()
+        # Query patients through an inner join so the page is ordered and cut on patients.name
+        query = db.table("patients")\
+            .select("*, doctor_patients!inner()")\
+            .eq("doctor_patients.doctor_id", doctor_id)
+        result = await execute(keyset(query, "name", **paging))
+        return result.data
+
+    # Depends on patient rows as well as this doctor's links
+    namespaces = ("patients", f"doctor_patients:{doctor_id}")
+    rows = await read_cache.get_or_load(namespaces, f"list:{paging['cursor']}:{paging['limit']}", load)
+    return page(rows, "name", paging["limit"], response)
+
+
+@router.get("/{doctor_id}/patients/search", response_model=List[DoctorPatientMatch])
+async def search_doctor_patients(doctor_id: str, q: str = Query(..., min_length=1, max_length=100),
+                                 limit: int = Query(PATIENT_SEARCH_MAX_RESULTS, ge=1, le=50)):
+    """Ranked patient matches, each flagged with whether it is linked to this doctor."""
+    async def load():
+        db = get_db()
+        response = await execute(db.rpc("search_doctor_patients", {"doctor": doctor_id, "q": q, "max_results": limit}))
+        return response.data
+
+    namespaces = ("patients", f"doctor_patients:{doctor_id}")
+    return await read_cache.get_or_load(namespaces, f"search:{q}:{limit}", load)
+
+
+@router.get("/{doctor_id}/worklist", response_model=List[WorklistEntry])
+async def get_doctor_worklist(doctor_id: str, response: Response, paging: dict = Depends(page_params)):
+    """A doctor's patients by name with their last visit, diagnosis and next follow-up, in one query."""
+    params = {"doctor": doctor_id, "max_results": paging["limit"] + 1}
+    if paging["cursor"]:
+        params["after_name"], params["after_id"] = decode_cursor(paging["cursor"])
+    pending = await consultation_outbox.pending("doctor_id", doctor_id)
+    db = get_db()
+    result = await execute(db.rpc("doctor_worklist", params))
+    return page(_with_pending_visits(result.data, pending), "name", paging["limit"], response)
+
+
+def _with_pending_visits(entries: list, pending: list) -> list:
+    """Fold consultations still in the outbox into the worklist's last-visit columns."""
+    today = date.today().isoformat()
+    for entry in entries:
+        visits = [c for c in pending if c["patient_id"] == entry["id"] and c["id"] != entry["last_consultation_id"]]
+        if not visits:
+            continue
+        latest = max(visits, key=lambda c: sort_value(c["consultation_date"]))
+        if entry["last_visit"] is None or sort_value(latest["consultation_date"]) > sort_value(entry["last_visit"]):
+            entry.update(last_consultation_id=latest["id"], last_visit=latest["consultation_date"],
+                         last_chief_complaint=latest["chief_complaint"], last_diagnosis=latest["diagnosis"])
+        follow_ups = [c["follow_up_date"] for c in visits if c["follow_up_date"] and c["follow_up_date"] >= today]
+        if entry["next_follow_up"]:
+            follow_ups.append(entry["next_follow_up"])
+        entry["next_follow_up"] = min(follow_ups, default=None)
+        entry["consultation_count"] += len(visits)
+    return entries
+
+
+@router.post("/links/import")
+async def import_links(request: Request):
+    """Link patients to doctors from a CSV (doctor_id,patient_id header) or NDJSON body.
+
+    Existing links are left alone; returns a result per row and the import throughput.
+    """
+    try:
+        fmt = import_format(request.headers.get("content-type", ""))
+    except UnsupportedImportFormat as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    db = get_db()
+    doctors = set()
+
+    def validate(row: dict) -> dict:
+        link = DoctorPatientLink(**row)
+        return {"doctor_id": str(link.doctor_id), "patient_id": str(link.patient_id)}
+
+    async def write_batch(batch):
+        # A batch may repeat a pair; Postgres rejects that within one upsert
+        unique = list({(l["doctor_id"], l["patient_id"]): l for _, l in batch}.values())
+        response = await execute(db.table("doctor_patients").upsert(
+            unique, on_conflict="doctor_id,patient_id", ignore_duplicates=True
+        ))
+        # Only newly inserted rows come back
+        inserted = {(r["doctor_id"], r["patient_id"]) for r in response.data}
+        results = []
+        for number, link in batch:
+            key = (link["doctor_id"], link["patient_id"])
+            results.append({"row": number, "status": "linked" if key in inserted else "already_linked"})
+            inserted.discard(key)
+            doctors.add(link["doctor_id"])
+        return results
+
+    try:
+        summary = await run_import(iter_rows(request.stream(), fmt), validate, write_batch,
+                                   IMPORT_BATCH_SIZE, IMPORT_MAX_ROWS)
+    finally:
+        for doctor_id in doctors:
+            await read_cache.invalidate(f"doctor_patients:{doctor_id}")
+    if summary["truncated"]:
+        print(f"Import stopped at the {IMPORT_MAX_ROWS}-row limit")
+    if summary["stopped"]:
+        print(summary["stopped"])
+    print(f"Imported {summary['succeeded']}/{summary['rows']} links at {summary['rows_per_second']} rows/s")
+    return summary
 
 
 @router.post("/{doctor_id}/patients/{patient_id}")
 async def link_patient_to_doctor(doctor_id: str, patient_id: str):
     """Link a patient to a doctor."""
-    supabase = get_supabase()
-    
-    existing = supabase.table("doctor_patients")\
-        .select("id")\
-        .eq("doctor_id", doctor_id)\
-        .eq("patient_id", patient_id)\
-        .execute()
-    
-    if existing.data:
-        return {"message": "Patient already linked to doctor"}
-    
-    response = supabase.table("doctor_patients").insert({
-        "doctor_id": doctor_id,
-        "patient_id": patient_id
-    }).execute()
+    db = get_db()
+    # One round-trip: an existing link is ignored and nothing comes back
+    response = await execute(db.table("doctor_patients").upsert(
+        {"doctor_id": doctor_id, "patient_id": patient_id},
+        on_conflict="doctor_id,patient_id",
+        ignore_duplicates=True,
+    ))
     
     if not response.data:
-        raise HTTPException(status_code=400, detail="Failed to link patient")
+        return {"message": "Patient already linked to doctor"}
+    await read_cache.invalidate(f"doctor_patients:{doctor_id}")
     return {"message": "Patient linked successfully"}
 
 
 @router.delete("/{doctor_id}/patients/{patient_id}")
 async def unlink_patient_from_doctor(doctor_id: str, patient_id: str):
     """Unlink a patient from a doctor."""
-    supabase = get_supabase()
-    supabase.table("doctor_patients")\
-        .delete()\
-        .eq("doctor_id", doctor_id)\
-        .eq("patient_id", patient_id)\
-        .execute()
+    db = get_db()
+    await execute(
+        db.table("doctor_patients")
+        .delete()
+        .eq("doctor_id", doctor_id)
+        .eq("patient_id", patient_id)
+    )
+    await read_cache.invalidate(f"doctor_patients:{doctor_id}")
     return {"message": "Patient unlinked successfully"}
@@ -1,7 +1,16 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List
-from services.supabase_client import get_supabase
+from uuid import UUID
+from services.database import get_db, execute, read_cache
+from services.pagination import page_params, keyset, page
+from services.bulk_import import (
+    UnsupportedImportFormat,
+    import_format,
+    iter_rows,
+    run_import,
+)
+from config import PATIENT_SEARCH_MAX_RESULTS, IMPORT_BATCH_SIZE, IMPORT_MAX_ROWS
 
 router = APIRouter(prefix="/api/patients", tags=["patients"])
 
@@ -51,55 +60,131 @@ class PatientResponse(BaseModel):
 
 
 @router.get("", response_model=List[PatientResponse])
-async def list_patients(search: Optional[str] = Query(None)):
-    """Get all patients, optionally filtered by search term."""
-    supabase = get_supabase()
-    query = supabase.table("patients").select("*")
-    
-    if search:
-        query = query.ilike("name", f"%{search}%")
-    
-    response = query.order("name").execute()
-    return response.data
+async def list_patients(response: Response, search: Optional[str] = Query(None),
+                        paging: dict = Depends(page_params)):
+    """Get patients by name, optionally filtered by search term, one page at a time."""
+    async def load():
+        db = get_db()
+        query = db.table("patients").select("*")
+        
+        if search:
+            query = query.ilike("name", f"%{search}%")
+        
+        result = await execute(keyset(query, "name", **paging))
+        return result.data
+
+    key = f"list:{search or ''}:{paging['cursor']}:{paging['limit']}"
+    rows = await read_cache.get_or_load(("patients",), key, load)
+    return page(rows, "name", paging["limit"], response)
+
+
+@router.get("/search", response_model=List[PatientResponse])
+async def search_patients(q: str = Query(..., min_length=1, max_length=100),
+                          limit: int = Query(PATIENT_SEARCH_MAX_RESULTS, ge=1, le=50)):
+    """Typeahead: best matches on name (prefix, then fuzzy), phone, email or date of birth."""
+    async def load():
+        db = get_db()
+        response = await execute(db.rpc("search_patients", {"q": q, "max_results": limit}))
+        return response.data
+
+    return await read_cache.get_or_load(("patients",), f"search:{q}:{limit}", load)
 
 
 @router.post("", response_model=PatientResponse)
 async def create_patient(patient: PatientCreate):
     """Create a new patient."""
-    supabase = get_supabase()
-    response = supabase.table("patients").insert(patient.model_dump(exclude_none=True)).execute()
+    db = get_db()
+    response = await execute(db.table("patients").insert(patient.model_dump(exclude_none=True)))
     if not response.data:
         raise HTTPException(status_code=400, detail="Failed to create patient")
+    await read_cache.invalidate("patients")
     return response.data[0]
 
 
+@router.post("/import")
+async def import_patients(request: Request, doctor_id: Optional[UUID] = Query(None)):
+    """Create patients from a CSV (with header) or NDJSON body, optionally linking them to a doctor.
+
+    Returns a result per row (created id or error) and the import throughput.
+    """
+    try:
+        fmt = import_format(request.headers.get("content-type", ""))
+    except UnsupportedImportFormat as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    db = get_db()
+    if doctor_id:
+        doctor = await execute(db.table("doctors").select("id").eq("id", str(doctor_id)))
+        if not doctor.data:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+
+    def validate(row: dict) -> dict:
+        return PatientCreate(**row).model_dump(exclude_none=True)
+
+    async def write_batch(batch):
+        response = await execute(db.table("patients").insert([p for _, p in batch], default_to_null=False))
+        # PostgREST returns inserted rows in request order
+        created = [{"row": number, "status": "created", "id": row["id"]}
+                   for (number, _), row in zip(batch, response.data)]
+        if doctor_id:
+            links = [{"doctor_id": str(doctor_id), "patient_id": r["id"]} for r in created]
+            try:
+                await execute(db.table("doctor_patients").upsert(
+                    links, on_conflict="doctor_id,patient_id", ignore_duplicates=True, returning="minimal"
+                ))
+            except Exception as e:
+                # The patients exist now; report the link failure rather than retrying the insert
+                for r in created:
+                    r["error"] = f"Created but not linked: {e}"
+        return created
+
+    try:
+        summary = await run_import(iter_rows(request.stream(), fmt), validate, write_batch,
+                                   IMPORT_BATCH_SIZE, IMPORT_MAX_ROWS)
+    finally:
+        await read_cache.invalidate("patients")
+        if doctor_id:
+            await read_cache.invalidate(f"doctor_patients:{doctor_id}")
+    if summary["truncated"]:
+        print(f"Import stopped at the {IMPORT_MAX_ROWS}-row limit")
+    if summary["stopped"]:
+        print(summary["stopped"])
+    print(f"Imported {summary['succeeded']}/{summary['rows']} patients at {summary['rows_per_second']} rows/s")
+    return summary
+
+
 @router.get("/{patient_id}", response_model=PatientResponse)
 async def get_patient(patient_id: str):
     """Get a patient by ID."""
-    supabase = get_supabase()
-    response = supabase.table("patients").select("*").eq("id", patient_id).single().execute()
-    if not response.data:
+    async def load():
+        db = get_db()
+        response = await execute(db.table("patients").select("*").eq("id", patient_id).single())
+        return response.data
+
+    patient = await read_cache.get_or_load(("patients",), f"id:{patient_id}", load)
+    if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
-    return response.data
+    return patient
 
 
 @router.put("/{patient_id}", response_model=PatientResponse)
 async def update_patient(patient_id: str, patient: PatientUpdate):
     """Update a patient."""
-    supabase = get_supabase()
+    db = get_db()
     update_data = patient.model_dump(exclude_none=True)
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    response = supabase.table("patients").update(update_data).eq("id", patient_id).execute()
+    response = await execute(db.table("patients").update(update_data).eq("id", patient_id))
     if not response.data:
         raise HTTPException(status_code=404, detail="Patient not found")
+    await read_cache.invalidate("patients")
     return response.data[0]
 
 
 @router.delete("/{patient_id}")
 async def delete_patient(patient_id: str):
     """Delete a patient."""
-    supabase = get_supabase()
-    supabase.table("patients").delete().eq("id", patient_id).execute()
+    db = get_db()
+    await execute(db.table("patients").delete().eq("id", patient_id))
+    await read_cache.invalidate("patients")
     return {"message": "Patient deleted successfully"}
@@ -0,0 +1,108 @@
+import base64
+import io
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import UploadFile
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size cap."""
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a request would hold more audio buffers than its budget allows."""
+
+
+class MemoryBudget:
+    """Tracks the audio buffers a single request holds and enforces a ceiling."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+
+    def charge(self, nbytes: int, label: str):
+        if self.in_use + nbytes > self.limit:
+            raise MemoryBudgetExceeded(
+                f"{label} needs {nbytes} bytes, {self.limit - self.in_use} of {self.limit} left"
+            )
+        self.in_use += nbytes
+        self.peak = max(self.peak, self.in_use)
+
+    def release(self, nbytes: int):
+        self.in_use = max(0, self.in_use - nbytes)
+
+    def report(self) -> dict:
+        return {"peak_bytes": self.peak, "budget_bytes": self.limit}
+
+
+_current_budget: ContextVar[Optional[MemoryBudget]] = ContextVar("memory_budget", default=None)
+
+
+@contextmanager
+def memory_budget(limit: int):
+    """Install a budget for everything running in this context (and tasks it spawns)."""
+    budget = MemoryBudget(limit)
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+@contextmanager
+def hold_memory(nbytes: int, label: str):
+    """Charge `nbytes` to the current budget for the duration of the block."""
+    budget = _current_budget.get()
+    if budget is None:
+        yield
+        return
+    budget.charge(nbytes, label)
+    try:
+        yield
+    finally:
+        budget.release(nbytes)
+
+
+def b64_size(nbytes: int) -> int:
+    return 4 * ((nbytes + 2) // 3)
+
+
+def estimate_peak_bytes(nbytes: int) -> int:
+    """Upper bound on the buffers processing an upload of `nbytes` will hold at once.
+
+    The raw upload, plus either the base64 text and the JSON request body built
+    from it (GPT-4o audio), or float32 samples and re-encoded chunks (chunked Whisper).
+    """
+    audio_path = 2 * b64_size(nbytes)
+    chunked_path = 3 * nbytes
+    return nbytes + max(audio_path, chunked_path)
+
+
+async def read_upload(upload: UploadFile, max_bytes: int) -> bytes:
+    """Read an upload once, rejecting it before buffering if it is over the cap."""
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLargeError(f"Upload is {upload.size} bytes, limit is {max_bytes}")
+    # Starlette keeps the body in a spooled temp file; read at most one byte past the cap
+    data = await upload.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit")
+    return data
+
+
+def b64encode_text(data: bytes) -> str:
+    """Base64 text for audio sent inline in a JSON request body.
+
+    The SDK serializes that body in one piece, so the encoding can't be
+    streamed: the raw bytes, this str and the JSON body all exist at once
+    (see estimate_peak_bytes).
+    """
+    return base64.b64encode(data).decode("ascii")
+
+
+def as_named_file(data: bytes, name: str = "recording.wav") -> io.BytesIO:
+    """Wrap bytes in a named in-memory file for multipart uploads (no copy, no disk)."""
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    return buffer
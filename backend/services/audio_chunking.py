@@ -0,0 +1,156 @@
+import asyncio
+import io
+import re
+import wave
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List
+import numpy as np
+
+FRAME_SECONDS = 0.03
+
+
+@dataclass
+class AudioChunk:
+    start: float
+    end: float
+    wav_bytes: bytes
+
+
+def read_wav(wav_bytes: bytes):
+    """Decode a PCM WAV into (mono float32 samples in [-1, 1], sample rate)."""
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        ints = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8)
+                | (raw[:, 2].astype(np.int32) << 16))
+        ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+        samples = ints.astype(np.float32) / (1 << 23)
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / (1 << 31)
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width}")
+
+    if channels > 1:
+        samples = samples[: len(samples) - len(samples) % channels]
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def write_wav(samples: np.ndarray, rate: int) -> bytes:
+    """Encode mono float samples as a 16-bit PCM WAV."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def wav_duration(wav_bytes: bytes) -> float:
+    """Duration of a WAV in seconds, read from the header only."""
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wav:
+        return wav.getnframes() / float(wav.getframerate())
+
+
+def frame_rms(samples: np.ndarray, frame_len: int) -> np.ndarray:
+    """RMS energy of consecutive frames of `frame_len` samples."""
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = samples[: n_frames * frame_len].reshape(n_frames, frame_len)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+def find_cut_points(rms: np.ndarray, target_frames: int, search_frames: int) -> List[int]:
+    """Pick chunk boundaries (in frames) at the quietest frame near each target length."""
+    cuts = []
+    position = 0
+    total = len(rms)
+    while total - position > target_frames + search_frames:
+        # Never at or before the last cut, so every chunk moves forward
+        lo = max(position + 1, position + target_frames - search_frames)
+        hi = position + target_frames + search_frames
+        if hi > lo:
+            # Smooth over ~0.3 s so a single quiet frame inside a word doesn't win
+            kernel = max(1, min(10, hi - lo))
+            window = np.convolve(rms[lo:hi], np.ones(kernel) / kernel, mode="same")
+            cut = lo + int(np.argmin(window))
+        else:
+            # No search window (CHUNK_SEARCH_SECONDS=0): cut at the target length
+            cut = max(position + 1, position + target_frames)
+        cuts.append(cut)
+        position = cut
+    return cuts
+
+
+def split_wav(wav_bytes: bytes, chunk_seconds: float, overlap_seconds: float,
+              search_seconds: float) -> List[AudioChunk]:
+    """Split a recording at silence boundaries into overlapping WAV windows."""
+    samples, rate = read_wav(wav_bytes)
+    frame_len = max(1, int(rate * FRAME_SECONDS))
+    rms = frame_rms(samples, frame_len)
+    cuts = find_cut_points(
+        rms,
+        target_frames=int(chunk_seconds / FRAME_SECONDS),
+        search_frames=int(search_seconds / FRAME_SECONDS),
+    )
+
+    boundaries = [0] + [cut * frame_len for cut in cuts] + [len(samples)]
+    overlap = int(overlap_seconds * rate)
+    chunks = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        # Each window reaches back into the previous one so words cut at the
+        # boundary appear whole in at least one transcript
+        padded_start = max(0, start - overlap)
+        chunks.append(AudioChunk(
+            start=padded_start / rate,
+            end=end / rate,
+            wav_bytes=write_wav(samples[padded_start:end], rate),
+        ))
+    return chunks
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def stitch_transcripts(transcripts: List[str], max_overlap_words: int = 40) -> str:
+    """Join chunk transcripts, dropping words repeated across the overlap."""
+    words: List[str] = []
+    for transcript in transcripts:
+        new_words = transcript.split()
+        if not new_words:
+            continue
+        tail = [_normalize(w) for w in words[-max_overlap_words:]]
+        head = [_normalize(w) for w in new_words[:max_overlap_words]]
+        # Longest suffix of what we have that matches a prefix of the new chunk
+        skip = 0
+        for size in range(min(len(tail), len(head)), 0, -1):
+            if tail[-size:] == head[:size]:
+                skip = size
+                break
+        words.extend(new_words[skip:])
+    return " ".join(words)
+
+
+async def transcribe_chunks(chunks: List[AudioChunk], transcribe: Callable[[bytes], Awaitable[str]],
+                            concurrency: int) -> List[str]:
+    """Transcribe chunks concurrently with at most `concurrency` in flight, keeping order."""
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(chunk: AudioChunk) -> str:
+        async with slots:
+            return await transcribe(chunk.wav_bytes)
+
+    return await asyncio.gather(*(run(chunk) for chunk in chunks))
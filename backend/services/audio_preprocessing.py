@@ -0,0 +1,105 @@
+from dataclasses import dataclass, field
+import numpy as np
+from services.audio_chunking import FRAME_SECONDS, frame_rms, read_wav, write_wav
+
+try:
+    import lameenc
+except ImportError:  # optional: only needed for AUDIO_CODEC=mp3
+    lameenc = None
+
+# Speech kept either side of the first/last loud frame so words aren't clipped
+EDGE_MARGIN_SECONDS = 0.2
+
+
+@dataclass
+class PreprocessedAudio:
+    wav_bytes: bytes
+    sample_rate: int
+    duration: float
+    stats: dict = field(default_factory=dict)
+
+
+def resample(samples: np.ndarray, rate: int, target: int) -> np.ndarray:
+    """Resample mono audio to `target` Hz."""
+    if rate == target or len(samples) == 0:
+        return samples
+    if rate > target and rate % target == 0:
+        # Integer decimation: block-average, which doubles as a crude low-pass
+        factor = rate // target
+        n = len(samples) // factor
+        return samples[: n * factor].reshape(n, factor).mean(axis=1)
+    n_out = int(round(len(samples) * target / rate))
+    positions = np.arange(n_out) * (rate / target)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def remove_silence(samples: np.ndarray, rate: int, threshold_db: float,
+                   max_pause_seconds: float) -> np.ndarray:
+    """Trim leading/trailing silence and shorten pauses longer than `max_pause_seconds`."""
+    frame_len = max(1, int(rate * FRAME_SECONDS))
+    rms = frame_rms(samples, frame_len)
+    loud = rms > 10 ** (threshold_db / 20)
+    if not loud.any():
+        # All quiet: leave it to the model rather than sending empty audio
+        return samples
+
+    margin = int(EDGE_MARGIN_SECONDS / FRAME_SECONDS)
+    first = max(0, int(np.argmax(loud)) - margin)
+    last = min(len(loud), len(loud) - int(np.argmax(loud[::-1])) + margin)
+    keep = np.zeros(len(loud), dtype=bool)
+    keep[first:last] = True
+
+    # Runs of quiet frames inside the kept span
+    quiet = keep & ~loud
+    edges = np.diff(np.concatenate(([0], quiet.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    max_frames = max(1, int(max_pause_seconds / FRAME_SECONDS))
+    long_runs = (ends - starts) > max_frames
+    head = max_frames // 2
+    for start, end in zip(starts[long_runs], ends[long_runs]):
+        keep[start + head:end - (max_frames - head)] = False
+
+    sample_keep = np.repeat(keep, frame_len)
+    return samples[: len(sample_keep)][sample_keep]
+
+
+def preprocess_wav(wav_bytes: bytes, target_rate: int, threshold_db: float,
+                   max_pause_seconds: float) -> PreprocessedAudio:
+    """Downmix, resample and strip silence from a WAV; report what was removed."""
+    samples, rate = read_wav(wav_bytes)
+    original_seconds = len(samples) / rate
+    samples = resample(samples, rate, target_rate)
+    samples = remove_silence(samples, target_rate, threshold_db, max_pause_seconds)
+    output = write_wav(samples, target_rate)
+    duration = len(samples) / target_rate
+    return PreprocessedAudio(
+        wav_bytes=output,
+        sample_rate=target_rate,
+        duration=duration,
+        stats={
+            "input_bytes": len(wav_bytes),
+            "output_bytes": len(output),
+            "bytes_removed": len(wav_bytes) - len(output),
+            "input_seconds": round(original_seconds, 2),
+            "output_seconds": round(duration, 2),
+            "seconds_removed": round(original_seconds - duration, 2),
+        },
+    )
+
+
+def encode_audio(wav_bytes: bytes, codec: str, bitrate_kbps: int = 32):
+    """Encode a mono 16-bit WAV for upload; returns (bytes, format)."""
+    if codec != "mp3":
+        return wav_bytes, "wav"
+    if lameenc is None:
+        print("AUDIO_CODEC=mp3 but lameenc is not installed, sending WAV")
+        return wav_bytes, "wav"
+    samples, rate = read_wav(wav_bytes)
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    encoder = lameenc.Encoder()
+    encoder.set_bit_rate(bitrate_kbps)
+    encoder.set_in_sample_rate(rate)
+    encoder.set_channels(1)
+    encoder.set_quality(2)
+    return bytes(encoder.encode(pcm) + encoder.flush()), "mp3"
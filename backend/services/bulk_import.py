@@ -0,0 +1,178 @@
+import codecs
+import csv
+import io
+import json
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Tuple
+from pydantic import ValidationError
+from services.outbox import is_rejection
+
+CSV_TYPES = ("text/csv",)
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+class UnsupportedImportFormat(Exception):
+    """Raised for an import body that is neither CSV nor NDJSON."""
+
+
+def import_format(content_type: str) -> str:
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in CSV_TYPES:
+        return "csv"
+    if media_type in NDJSON_TYPES:
+        return "ndjson"
+    raise UnsupportedImportFormat(
+        f"Unsupported content type '{media_type}'; send text/csv or application/x-ndjson"
+    )
+
+
+async def _text_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream and yield it line by line."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def _csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Group lines into complete CSV records (a quoted field may span lines)."""
+    record = ""
+    async for line in _text_lines(chunks):
+        record = f"{record}\n{line}" if record else line
+        # Doubled quotes inside a field keep the count even, so odd means still inside one
+        if record.count('"') % 2 == 0:
+            yield record
+            record = ""
+    if record:
+        yield record
+
+
+async def iter_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, object]]:
+    """Yield (row_number, dict or parse error) from a CSV (with header) or NDJSON body."""
+    if fmt == "ndjson":
+        number = 0
+        async for line in _text_lines(chunks):
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+                yield number, row if isinstance(row, dict) else ValueError("Expected a JSON object")
+            except ValueError as e:
+                yield number, e
+        return
+
+    header = None
+    number = 0
+    async for record in _csv_records(chunks):
+        if not record.strip():
+            continue
+        values = next(csv.reader(io.StringIO(record)))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        number += 1
+        if len(values) != len(header):
+            yield number, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+            continue
+        # Empty cells mean "not provided"
+        yield number, {name: value for name, value in zip(header, values) if value.strip() != ""}
+
+
+def _error(number: int, error: Exception) -> dict:
+    if isinstance(error, ValidationError):
+        message = "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+    else:
+        message = str(error)
+    return {"row": number, "status": "error", "error": message}
+
+
+async def run_import(
+    rows: AsyncIterator[Tuple[int, object]],
+    validate: Callable[[dict], object],
+    write_batch: Callable[[List[Tuple[int, object]]], Awaitable[List[dict]]],
+    batch_size: int,
+    max_rows: int,
+) -> dict:
+    """Validate rows and write them in batches; return per-row results and throughput.
+
+    A batch the database rejects (a 22xxx/23xxx error) is retried row by row,
+    so one bad row only fails itself. Any other error (timeout, connection,
+    gateway) stops the import: the batch may or may not have landed, and
+    retrying rows could duplicate it, so that batch and every row after it
+    are reported failed and the summary's `stopped` carries the error. Rows
+    past `max_rows` are not read; the summary then has `truncated` set, and
+    its results say which rows were written.
+    """
+    started = time.perf_counter()
+    results: List[dict] = []
+    batch: List[Tuple[int, object]] = []
+    seen = 0
+    truncated = False
+    stopped = None
+
+    def stop(error: Exception, items: List[Tuple[int, object]]):
+        nonlocal stopped
+        stopped = f"Import stopped, rows not confirmed written: {error}"
+        print(f"Import batch of {len(items)} failed ({error}), stopping the import")
+        results.extend({"row": number, "status": "error", "error": stopped} for number, _ in items)
+
+    async def flush():
+        try:
+            results.extend(await write_batch(batch))
+        except Exception as e:
+            if not is_rejection(e):
+                stop(e, batch)
+                batch.clear()
+                return
+            print(f"Import batch of {len(batch)} rejected ({e}), retrying rows one by one")
+            for i, item in enumerate(batch):
+                try:
+                    results.extend(await write_batch([item]))
+                except Exception as row_error:
+                    if not is_rejection(row_error):
+                        stop(row_error, batch[i:])
+                        break
+                    results.append(_error(item[0], row_error))
+        batch.clear()
+
+    async for number, row in rows:
+        seen += 1
+        if seen > max_rows:
+            truncated = True
+            break
+        if stopped:
+            results.append({"row": number, "status": "error", "error": stopped})
+            continue
+        if isinstance(row, Exception):
+            results.append(_error(number, row))
+            continue
+        try:
+            batch.append((number, validate(row)))
+        except ValueError as e:  # includes pydantic's ValidationError
+            results.append(_error(number, e))
+            continue
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+
+    elapsed = time.perf_counter() - started
+    results.sort(key=lambda r: r["row"])
+    failed = sum(1 for r in results if r["status"] == "error")
+    return {
+        "rows": len(results),
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(len(results) / elapsed, 1) if elapsed > 0 else None,
+        "truncated": truncated,
+        "stopped": stopped,
+        "results": results,
+    }
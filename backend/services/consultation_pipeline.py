@@ -0,0 +1,333 @@
+import asyncio
+import re
+import uuid
+import wave
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from postgrest.types import ReturnMethod
+from services.database import get_db, execute
+from services.openai_service import (
+    process_audio_resilient,
+    transcribe_with_whisper,
+    track_usage,
+    generate_notes_from_transcript,
+    NotesGenerationError,
+    AUDIO_MODEL,
+    TRANSCRIBE_MODEL,
+    NOTES_MODEL,
+    PROMPT_VERSION,
+)
+from services.result_cache import ResultCache, MemoryTier, SQLiteTier, cache_key
+from services.audio_chunking import split_wav, stitch_transcripts, transcribe_chunks, wav_duration
+from services.audio_preprocessing import PreprocessedAudio, preprocess_wav, encode_audio
+from services.audio_buffer import hold_memory, memory_budget
+from services import tracing
+from services.tracing import span
+from services.metrics import registry, audio_bytes as audio_bytes_metric, audio_seconds, audio_path
+from services.jobs import JobQueue, SQLiteJobStore
+from services.outbox import SQLiteOutbox, WriteBehind, PENDING, FAILED
+from config import (
+    JOB_DB_PATH,
+    JOB_WORKERS,
+    JOB_MAX_PENDING,
+    JOB_RETENTION_HOURS,
+    CHUNKING_THRESHOLD_SECONDS,
+    CHUNK_SECONDS,
+    CHUNK_OVERLAP_SECONDS,
+    CHUNK_SEARCH_SECONDS,
+    CHUNK_CONCURRENCY,
+    REQUEST_MEMORY_BUDGET_BYTES,
+    AUDIO_PREPROCESS,
+    AUDIO_TARGET_SAMPLE_RATE,
+    AUDIO_SILENCE_THRESHOLD_DB,
+    AUDIO_MAX_PAUSE_SECONDS,
+    AUDIO_CODEC,
+    AUDIO_MP3_BITRATE,
+    AI_CACHE_MAX_BYTES,
+    AI_CACHE_DB_PATH,
+    AI_CACHE_TTL_HOURS,
+    OUTBOX_DB_PATH,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_FLUSH_INTERVAL_SECONDS,
+    OUTBOX_MAX_BACKOFF_SECONDS,
+    REGENERATE_CONCURRENCY,
+)
+
+
+ai_result_cache = ResultCache(
+    memory=MemoryTier(AI_CACHE_MAX_BYTES),
+    disk=SQLiteTier(AI_CACHE_DB_PATH, AI_CACHE_TTL_HOURS * 3600) if AI_CACHE_DB_PATH else None,
+)
+
+
+def ai_cache_key(audio_bytes: bytes, patient_name: str, doctor_name: str) -> str:
+    """Cache key covering the audio, models, prompt version, audio settings and names."""
+    return cache_key(
+        audio_bytes,
+        AUDIO_MODEL, TRANSCRIBE_MODEL, NOTES_MODEL, PROMPT_VERSION,
+        f"{AUDIO_PREPROCESS}:{AUDIO_TARGET_SAMPLE_RATE}:{AUDIO_SILENCE_THRESHOLD_DB}:"
+        f"{AUDIO_MAX_PAUSE_SECONDS}:{AUDIO_CODEC}:{AUDIO_MP3_BITRATE}",
+        patient_name, doctor_name,
+    )
+
+
+def build_consultation_row(doctor_id: str, patient_id: str, result: dict, usage: Optional[dict] = None) -> dict:
+    """Map an AI result (and the tokens it cost, see TokenUsage.columns) onto a complete consultations row.
+
+    The id and timestamps are set here rather than by the database, so the row
+    can be shown before it is written and resent without creating a duplicate.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    consultation_data = {
+        "id": str(uuid.uuid4()),
+        "doctor_id": doctor_id,
+        "patient_id": patient_id,
+        "raw_transcript": result.get("transcript", ""),
+        "formatted_notes": result.get("formatted_notes", ""),
+        "chief_complaint": result.get("chief_complaint", ""),
+        "diagnosis": result.get("diagnosis", ""),
+        "treatment_plan": result.get("treatment_plan", ""),
+        "follow_up_date": None,
+        "consultation_date": now,
+        "created_at": now,
+        "prompt_tokens": None,
+        "cached_tokens": None,
+        "completion_tokens": None,
+        **(usage or {})
+    }
+    
+    # Only set follow_up_date if it looks like a valid date
+    follow_up = result.get("follow_up", "")
+    if follow_up and follow_up.lower() not in ["not discussed", "n/a", "none", ""]:
+        # Check if it matches a date pattern (YYYY-MM-DD or similar)
+        if re.match(r'\d{4}-\d{2}-\d{2}', follow_up):
+            consultation_data["follow_up_date"] = follow_up
+    return consultation_data
+
+
+# What regeneration rewrites (follow_up_date only if the new notes give one)
+REGENERATED_COLUMNS = (
+    "formatted_notes", "chief_complaint", "diagnosis", "treatment_plan", "follow_up_date",
+    "prompt_tokens", "cached_tokens", "completion_tokens",
+)
+
+
+async def prepare_audio(audio_bytes: bytes) -> PreprocessedAudio:
+    """Normalize an upload before any model call; non-WAV input passes through unchanged."""
+    with span("preprocess"):
+        prepared = await _prepare_audio(audio_bytes)
+    audio_bytes_metric.inc(amount=len(audio_bytes))
+    audio_seconds.inc(amount=prepared.stats.get("input_seconds", prepared.duration))
+    return prepared
+
+
+async def _prepare_audio(audio_bytes: bytes) -> PreprocessedAudio:
+    if AUDIO_PREPROCESS:
+        try:
+            with hold_memory(3 * len(audio_bytes), "preprocessing"):
+                prepared = await asyncio.to_thread(
+                    preprocess_wav, audio_bytes, AUDIO_TARGET_SAMPLE_RATE,
+                    AUDIO_SILENCE_THRESHOLD_DB, AUDIO_MAX_PAUSE_SECONDS
+                )
+            print(f"Audio preprocessing removed {prepared.stats['bytes_removed']} bytes, "
+                  f"{prepared.stats['seconds_removed']} s")
+            return prepared
+        except (wave.Error, EOFError, ValueError) as e:
+            print(f"Audio preprocessing skipped: {e}")
+    try:
+        duration = wav_duration(audio_bytes)
+    except (wave.Error, EOFError):
+        duration = 0.0
+    return PreprocessedAudio(wav_bytes=audio_bytes, sample_rate=0, duration=duration)
+
+
+async def encode_for_upload(wav_bytes: bytes):
+    """Encode audio with the configured codec; returns (bytes, format)."""
+    with span("encode"):
+        return await asyncio.to_thread(encode_audio, wav_bytes, AUDIO_CODEC, AUDIO_MP3_BITRATE)
+
+
+def is_long_recording(prepared: PreprocessedAudio) -> bool:
+    """True if the recording should go through chunked transcription."""
+    return prepared.duration > CHUNKING_THRESHOLD_SECONDS
+
+
+async def _transcribe_chunk(wav_bytes: bytes) -> str:
+    data, audio_format = await encode_for_upload(wav_bytes)
+    return await transcribe_with_whisper(data, audio_format)
+
+
+async def transcribe_in_chunks(audio_bytes: bytes) -> str:
+    """Split a long recording at pauses, transcribe the pieces in parallel and stitch them."""
+    # Decoded float32 samples (~2x a 16-bit WAV) plus the re-encoded chunk WAVs
+    with hold_memory(3 * len(audio_bytes), "chunked transcription"):
+        chunks = await asyncio.to_thread(
+            split_wav, audio_bytes, CHUNK_SECONDS, CHUNK_OVERLAP_SECONDS, CHUNK_SEARCH_SECONDS
+        )
+        transcripts = await transcribe_chunks(chunks, _transcribe_chunk, CHUNK_CONCURRENCY)
+        del chunks
+    return stitch_transcripts(transcripts)
+
+
+async def process_consultation(payload: dict, audio_bytes: bytes) -> dict:
+    """Transcribe the audio, generate notes and save the consultation.
+
+    Traced when the submitting request was (payload["trace"]); the breakdown
+    is returned under "timings".
+    """
+    with tracing.trace("consultation job", enabled=payload.get("trace", False)) as job_trace:
+        result = await _process_consultation(payload, audio_bytes)
+    if job_trace is not None:
+        job_trace.log(doctor_id=payload["doctor_id"])
+        result["timings"] = job_trace.report()
+    return result
+
+
+async def _process_consultation(payload: dict, audio_bytes: bytes) -> dict:
+    patient_name = payload["patient_name"]
+    doctor_name = payload["doctor_name"]
+    
+    preprocessing = {}
+    
+    async def compute():
+        prepared = await prepare_audio(audio_bytes)
+        preprocessing.update(prepared.stats)
+        return await generate_ai_result(prepared, patient_name, doctor_name)
+    
+    notes_error = None
+    with memory_budget(REQUEST_MEMORY_BUDGET_BYTES) as budget, track_usage() as tokens:
+        with hold_memory(len(audio_bytes), "upload"):
+            # Retries and double submits of the same audio share one model call
+            try:
+                result = await ai_result_cache.get_or_compute(
+                    ai_cache_key(audio_bytes, patient_name, doctor_name), compute
+                )
+            except NotesGenerationError as e:
+                # The transcript is the expensive part; save it so the notes can be regenerated
+                print(f"Saving the transcript without notes: {e}")
+                result, notes_error = {"transcript": e.transcript}, str(e)
+    print(f"Consultation audio: {len(audio_bytes)} bytes, peak buffers {budget.peak} bytes")
+    
+    consultation = await save_consultation(payload["doctor_id"], payload["patient_id"], result, tokens.columns())
+    outcome = {
+        "consultation": consultation,
+        "ai_result": result,
+        "memory": budget.report(),
+        "preprocessing": preprocessing
+    }
+    if notes_error:
+        outcome["notes_error"] = notes_error
+    return outcome
+
+
+async def generate_ai_result(prepared: PreprocessedAudio, patient_name: str, doctor_name: str) -> dict:
+    """Run the audio through the models, picking the path by recording length."""
+    if is_long_recording(prepared):
+        audio_path.inc("chunked")
+        transcript = await transcribe_in_chunks(prepared.wav_bytes)
+        return await generate_notes_from_transcript(transcript, patient_name, doctor_name)
+    data, audio_format = await encode_for_upload(prepared.wav_bytes)
+    return await process_audio_resilient(data, patient_name, doctor_name, audio_format)
+
+
+async def save_consultation(doctor_id: str, patient_id: str, result: dict, usage: Optional[dict] = None) -> dict:
+    """Commit the consultation row for an AI result locally and return it.
+
+    The outbox writes it to Supabase in the background; reads merge it in until then.
+    """
+    consultation_data = build_consultation_row(doctor_id, patient_id, result, usage)
+    with span("save"):
+        return await consultation_outbox.add(consultation_data)
+
+
+async def update_consultation_row(consultation_id: str, changes: dict) -> Optional[dict]:
+    """Apply `changes` to a consultation wherever it is (outbox or Supabase); None if it doesn't exist."""
+    # Not in Supabase yet: edit the copy waiting to be written
+    pending = await consultation_outbox.update(consultation_id, changes)
+    if pending:
+        return pending
+    db = get_db()
+    response = await execute(db.table("consultations").update(changes).eq("id", consultation_id))
+    return response.data[0] if response.data else None
+
+
+async def _names(table: str, ids: set) -> dict:
+    if not ids:
+        return {}
+    db = get_db()
+    response = await execute(db.table(table).select("id, name").in_("id", list(ids)))
+    return {row["id"]: row["name"] for row in response.data}
+
+
+async def regenerate_notes(consultations: List[dict]) -> List[dict]:
+    """Rewrite the notes of stored consultations from their raw_transcript, REGENERATE_CONCURRENCY at a time.
+
+    Only the text stage runs: no audio, no transcription. Returns a result per
+    consultation: `regenerated` (with the updated row), `skipped` (no
+    transcript) or `failed` (with the error); the old notes stay on failure.
+    """
+    patients = await _names("patients", {c["patient_id"] for c in consultations if c["patient_id"]})
+    doctors = await _names("doctors", {c["doctor_id"] for c in consultations if c["doctor_id"]})
+    slots = asyncio.Semaphore(REGENERATE_CONCURRENCY)
+    
+    async def regenerate(consultation: dict) -> dict:
+        outcome = {"id": consultation["id"]}
+        transcript = consultation.get("raw_transcript")
+        if not transcript:
+            return {**outcome, "status": "skipped", "detail": "No stored transcript"}
+        async with slots:
+            try:
+                with track_usage() as tokens:
+                    result = await generate_notes_from_transcript(
+                        transcript,
+                        patients.get(consultation["patient_id"], ""),
+                        doctors.get(consultation["doctor_id"], "")
+                    )
+                row = build_consultation_row(consultation["doctor_id"], consultation["patient_id"], result,
+                                             tokens.columns())
+                changes = {column: row[column] for column in REGENERATED_COLUMNS}
+                # Keep a follow-up date the doctor set unless the new notes give one
+                if changes["follow_up_date"] is None:
+                    del changes["follow_up_date"]
+                updated = await update_consultation_row(consultation["id"], changes)
+            except Exception as e:
+                print(f"Regenerating consultation {consultation['id']} failed: {e}")
+                return {**outcome, "status": "failed", "detail": str(e)}
+        if updated is None:
+            return {**outcome, "status": "failed", "detail": "Consultation was deleted"}
+        return {**outcome, "status": "regenerated", "consultation": updated}
+    
+    return await asyncio.gather(*(regenerate(c) for c in consultations))
+
+
+async def _write_consultations(rows: list):
+    """Upsert on id, so a batch resent after a timeout doesn't duplicate rows."""
+    db = get_db()
+    await execute(db.table("consultations").upsert(rows, on_conflict="id", returning=ReturnMethod.minimal))
+
+
+consultation_outbox = WriteBehind(
+    store=SQLiteOutbox(OUTBOX_DB_PATH),
+    writer=_write_consultations,
+    batch_size=OUTBOX_BATCH_SIZE,
+    interval=OUTBOX_FLUSH_INTERVAL_SECONDS,
+    max_backoff=OUTBOX_MAX_BACKOFF_SECONDS,
+)
+
+
+def _outbox_rows():
+    counts = consultation_outbox.store.counts()
+    return {(status,): counts.get(status, {}).get("rows", 0) for status in (PENDING, FAILED)}
+
+
+registry.gauge("consultation_outbox_rows", "Consultations saved locally and not yet in Supabase, by status",
+               ("status",), collect=_outbox_rows)
+
+
+consultation_jobs = JobQueue(
+    store=SQLiteJobStore(JOB_DB_PATH),
+    handler=process_consultation,
+    workers=JOB_WORKERS,
+    max_pending=JOB_MAX_PENDING,
+    retention=timedelta(hours=JOB_RETENTION_HOURS),
+)
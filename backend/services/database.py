@@ -0,0 +1,96 @@
+import asyncio
+import time
+from typing import Optional
+import httpx
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+from config import (
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    DB_MAX_CONNECTIONS,
+    DB_MAX_KEEPALIVE,
+    DB_CONNECT_TIMEOUT,
+    DB_QUERY_TIMEOUT,
+    READ_CACHE_TTL_SECONDS,
+    READ_CACHE_MAX_BYTES,
+    READ_CACHE_URL,
+)
+from services.read_cache import ReadCache, MemoryBackend, RedisBackend, redis
+from services.metrics import db_duration
+from services.tracing import span
+
+
+class DatabaseTimeoutError(Exception):
+    """Raised when a query takes longer than its timeout."""
+
+
+class _PooledPostgrestClient(AsyncPostgrestClient):
+    """PostgREST client whose HTTP session uses our keep-alive pool limits."""
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=verify,
+            proxy=proxy,
+            follow_redirects=True,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=DB_MAX_CONNECTIONS,
+                max_keepalive_connections=DB_MAX_KEEPALIVE,
+            ),
+        )
+
+
+def _read_cache_backend():
+    if READ_CACHE_URL:
+        if redis is not None:
+            return RedisBackend(READ_CACHE_URL)
+        print("READ_CACHE_URL is set but redis is not installed, using a per-process cache")
+    return MemoryBackend(READ_CACHE_MAX_BYTES)
+
+
+read_cache = ReadCache(_read_cache_backend(), READ_CACHE_TTL_SECONDS)
+
+_db: Optional[AsyncPostgrestClient] = None
+
+
+def get_db() -> AsyncPostgrestClient:
+    """Shared async PostgREST client; created on first use, closed by `close_db`."""
+    global _db
+    if _db is None:
+        _db = _PooledPostgrestClient(
+            f"{SUPABASE_URL}/rest/v1",
+            headers={
+                **DEFAULT_POSTGREST_CLIENT_HEADERS,
+                "apikey": SUPABASE_KEY,
+                "Authorization": f"Bearer {SUPABASE_KEY}",
+            },
+            timeout=httpx.Timeout(DB_QUERY_TIMEOUT, connect=DB_CONNECT_TIMEOUT),
+        )
+    return _db
+
+
+async def close_db():
+    global _db
+    if _db is not None:
+        await _db.aclose()
+        _db = None
+    await read_cache.close()
+
+
+async def execute(query, timeout: float = DB_QUERY_TIMEOUT):
+    """Run a query builder with a deadline covering the whole round-trip."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with span("db"):
+            result = await asyncio.wait_for(query.execute(), timeout)
+        outcome = "ok"
+        return result
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        raise DatabaseTimeoutError(f"Query {query.path} timed out after {timeout}s")
+    finally:
+        db_duration.observe(time.perf_counter() - started, query.path.lstrip("/"), query.http_method, outcome)
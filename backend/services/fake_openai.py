@@ -0,0 +1,154 @@
+"""In-process stand-in for the AsyncOpenAI client, for offline latency benchmarks.
+
+Only the calls this app makes are implemented: chat completions (plain and
+streaming) and audio transcriptions. Latency is drawn from a per-model
+lognormal distribution and calls fail at a configurable rate, so tail
+behaviour (hedging, circuit breaking, retries) can be measured without
+network access or API spend.
+"""
+import asyncio
+import json
+import math
+import random
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Dict, Optional
+import httpx
+import openai
+
+FAKE_NOTES = {
+    "transcript": "Doctor: What brings you in today? Patient: I've had a dry cough for two weeks.",
+    "formatted_notes": "## Subjective\n- Dry cough for two weeks\n\n## Objective\n- Not discussed\n\n"
+                       "## Assessment\n- Likely post-viral cough\n\n## Plan\n- Honey, fluids\n- Follow-up",
+    "chief_complaint": "Dry cough for two weeks",
+    "diagnosis": "Post-viral cough",
+    "treatment_plan": "Supportive care; return if fever or shortness of breath",
+    "follow_up": "2 weeks",
+}
+
+
+@dataclass
+class ModelProfile:
+    median_seconds: float = 2.0
+    sigma: float = 0.5
+    failure_rate: float = 0.0
+
+    def sample_latency(self) -> float:
+        return random.lognormvariate(math.log(self.median_seconds), self.sigma)
+
+
+@dataclass
+class FakeOpenAIConfig:
+    default: ModelProfile = field(default_factory=ModelProfile)
+    models: Dict[str, ModelProfile] = field(default_factory=dict)
+    completion_text: str = json.dumps(FAKE_NOTES)
+    stream_chunk_chars: int = 24
+    # Share of completions cut off at a random point, to exercise the notes repair path
+    truncation_rate: float = 0.0
+
+    def profile(self, model: str) -> ModelProfile:
+        return self.models.get(model, self.default)
+
+    def completion(self) -> str:
+        if random.random() < self.truncation_rate:
+            return self.completion_text[:random.randrange(len(self.completion_text))]
+        return self.completion_text
+
+
+_REQUEST = httpx.Request("POST", "https://fake-openai.local/v1")
+
+
+async def _simulate(profile: ModelProfile, timeout: Optional[float]) -> float:
+    latency = profile.sample_latency()
+    if timeout is not None and latency > timeout:
+        await asyncio.sleep(timeout)
+        raise openai.APITimeoutError(request=_REQUEST)
+    if random.random() < profile.failure_rate:
+        # Failures tend to surface early rather than at the full latency
+        await asyncio.sleep(latency * random.random())
+        raise openai.APIConnectionError(message="Simulated upstream failure", request=_REQUEST)
+    return latency
+
+
+def _usage(prompt_chars: int, completion_chars: int):
+    return SimpleNamespace(
+        prompt_tokens=max(1, prompt_chars // 4),
+        completion_tokens=max(1, completion_chars // 4),
+        total_tokens=max(1, prompt_chars // 4) + max(1, completion_chars // 4),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+    )
+
+
+def _prompt_chars(messages) -> int:
+    total = 0
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += len(content)
+        elif isinstance(content, list):
+            total += sum(len(part.get("text", "")) for part in content)
+    return total
+
+
+class _FakeStream:
+    def __init__(self, text: str, latency: float, chunk_chars: int, usage=None):
+        self._pieces = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+        self._delay = latency / len(self._pieces)
+        self._usage = usage
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for piece in self._pieces:
+            await asyncio.sleep(self._delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+        if self._usage is not None:
+            yield SimpleNamespace(choices=[], usage=self._usage)
+
+
+class _FakeCompletions:
+    def __init__(self, config: FakeOpenAIConfig):
+        self._config = config
+
+    async def create(self, model: str, messages=None, stream: bool = False, timeout: Optional[float] = None, **kwargs):
+        profile = self._config.profile(model)
+        text = self._config.completion()
+        if kwargs.get("max_completion_tokens"):
+            # ~4 characters per token, like _usage
+            text = text[:kwargs["max_completion_tokens"] * 4]
+        if stream:
+            # Time to first token is small; the rest of the latency is spread over the chunks
+            latency = await _simulate(ModelProfile(profile.median_seconds * 0.1, profile.sigma, profile.failure_rate), timeout)
+            await asyncio.sleep(latency)
+            usage = _usage(_prompt_chars(messages), len(text)) if (kwargs.get("stream_options") or {}).get("include_usage") else None
+            return _FakeStream(text, profile.sample_latency(), self._config.stream_chunk_chars, usage)
+        latency = await _simulate(profile, timeout)
+        await asyncio.sleep(latency)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text), finish_reason="stop")],
+            usage=_usage(_prompt_chars(messages), len(text)),
+        )
+
+
+class _FakeTranscriptions:
+    def __init__(self, config: FakeOpenAIConfig):
+        self._config = config
+
+    async def create(self, model: str, file=None, timeout: Optional[float] = None, **kwargs):
+        latency = await _simulate(self._config.profile(model), timeout)
+        await asyncio.sleep(latency)
+        return SimpleNamespace(text=FAKE_NOTES["transcript"])
+
+
+class FakeAsyncOpenAI:
+    """Drop-in for the subset of AsyncOpenAI used by services/openai_service.py."""
+
+    def __init__(self, config: Optional[FakeOpenAIConfig] = None):
+        self.config = config or FakeOpenAIConfig()
+        self.chat = SimpleNamespace(completions=_FakeCompletions(self.config))
+        self.audio = SimpleNamespace(transcriptions=_FakeTranscriptions(self.config))
+
+    async def close(self):
+        pass
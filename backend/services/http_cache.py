@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is used when brotli isn't installed
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+# Headers a 304 keeps from the full response (RFC 9110 15.4.5)
+NOT_MODIFIED_HEADERS = ("cache-control", "content-location", "date", "etag", "expires", "vary", "x-next-cursor")
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """Pick br or gzip from an Accept-Encoding header, '' for identity."""
+    offered = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip().lower()] = q
+    for encoding in (("br",) if brotli is not None else ()) + ("gzip",):
+        if offered.get(encoding, offered.get("*", 0)) > 0:
+            return encoding
+    return ""
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def etag_matches(if_none_match: str, base_tag: str) -> bool:
+    """Compare If-None-Match against a body hash, ignoring the content-coding suffix."""
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        if tag.split("-", 1)[0] == base_tag:
+            return True
+    return False
+
+
+class ConditionalCompressionMiddleware:
+    """Strong ETags and 304s for GETs, plus gzip/brotli for bodies over `minimum_size`.
+
+    Only complete bodies are touched: anything sent in several chunks (event
+    streams, files) passes through unchanged. Each content-coding gets its own
+    ETag suffix so a compressed and an identity body never share a validator.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        start = None
+        body_parts = []
+        passthrough = False
+
+        async def wrapped_send(message: Message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                if not body_parts and message.get("more_body", False):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                body_parts.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await self._send_complete(scope, request_headers, start, b"".join(body_parts), send)
+            else:
+                await send(message)
+
+        await self.app(scope, receive, wrapped_send)
+
+    async def _send_complete(self, scope: Scope, request_headers: Headers, start: Message, body: bytes, send: Send):
+        headers = MutableHeaders(raw=list(start["headers"]))
+        status = start["status"]
+        content_type = headers.get("content-type", "")
+        eligible = (
+            len(body) >= self.minimum_size
+            and "content-encoding" not in headers
+            and content_type.startswith(COMPRESSIBLE_TYPES)
+        )
+        encoding = choose_encoding(request_headers.get("accept-encoding", "")) if eligible else ""
+        if eligible:
+            headers.add_vary_header("Accept-Encoding")
+
+        if scope["method"] == "GET" and status == 200 and "etag" not in headers:
+            base_tag = hashlib.sha256(body).hexdigest()[:32]
+            headers["ETag"] = f'"{base_tag}-{encoding}"' if encoding else f'"{base_tag}"'
+            headers.setdefault("Cache-Control", "private, no-cache")
+            if_none_match = request_headers.get("if-none-match")
+            if if_none_match and etag_matches(if_none_match, base_tag):
+                kept = [(k, v) for k, v in headers.raw if k.decode("latin-1").lower() in NOT_MODIFIED_HEADERS]
+                await send({"type": "http.response.start", "status": 304, "headers": kept})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        if encoding:
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+        headers["Content-Length"] = str(len(body))
+        await send({**start, "headers": headers.raw})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job."""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class SQLiteJobStore:
+    """Job records in SQLite. Use a file path to survive restarts, ":memory:" for tests."""
+
+    def __init__(self, path: str = ":memory:"):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                audio BLOB,
+                result TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+            return rows
+
+    def create(self, payload: dict, audio: bytes) -> dict:
+        job_id = str(uuid.uuid4())
+        now = _now()
+        self._execute(
+            "INSERT INTO jobs (id, status, payload, audio, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, json.dumps(payload), audio, now, now),
+        )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        rows = self._execute(
+            "SELECT id, status, payload, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        if not rows:
+            return None
+        row = dict(rows[0])
+        row["payload"] = json.loads(row["payload"])
+        row["result"] = json.loads(row["result"]) if row["result"] else None
+        return row
+
+    def get_audio(self, job_id: str) -> Optional[bytes]:
+        rows = self._execute("SELECT audio FROM jobs WHERE id = ?", (job_id,))
+        return rows[0]["audio"] if rows else None
+
+    def update(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        # The audio is only needed until the job finishes
+        if status in FINISHED_STATES:
+            self._execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, audio = NULL, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, _now(), job_id),
+            )
+        else:
+            self._execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                (status, _now(), job_id),
+            )
+
+    def unfinished_ids(self) -> list:
+        rows = self._execute(
+            "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+            (QUEUED, RUNNING),
+        )
+        return [row["id"] for row in rows]
+
+    def purge_finished(self, older_than: timedelta):
+        cutoff = (datetime.now(timezone.utc) - older_than).isoformat()
+        self._execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (SUCCEEDED, FAILED, cutoff),
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+JobHandler = Callable[[dict, bytes], Awaitable[dict]]
+
+
+class JobQueue:
+    """Bounded worker pool that runs persisted jobs in the background."""
+
+    def __init__(self, store: SQLiteJobStore, handler: JobHandler, workers: int = 2,
+                 max_pending: int = 100, retention: timedelta = timedelta(hours=24),
+                 purge_interval: timedelta = timedelta(hours=1)):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        # Jobs that were queued or mid-flight when the process stopped run again
+        for job_id in await asyncio.to_thread(self.store.unfinished_ids):
+            await asyncio.to_thread(self.store.update, job_id, QUEUED)
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payload: dict, audio: bytes) -> dict:
+        if self._queue is None:
+            raise RuntimeError("Job queue has not been started")
+        if self._queue.qsize() >= self.max_pending:
+            raise QueueFullError("Too many jobs waiting, try again shortly")
+        job = await asyncio.to_thread(self.store.create, payload, audio)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        updates: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(updates)
+        return updates
+
+    def unsubscribe(self, job_id: str, updates: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers:
+            subscribers.discard(updates)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    async def _set_status(self, job_id: str, status: str, result: Optional[dict] = None,
+                          error: Optional[str] = None):
+        await asyncio.to_thread(self.store.update, job_id, status, result, error)
+        job = await self.get(job_id)
+        for updates in self._subscribers.get(job_id, ()):
+            updates.put_nowait(job)
+
+    async def _purge(self):
+        """Delete finished jobs past the retention period, at start and then every `purge_interval`."""
+        while True:
+            try:
+                await asyncio.to_thread(self.store.purge_finished, self.retention)
+            except Exception as e:
+                print(f"Purging finished jobs failed: {e}")
+            await asyncio.sleep(self.purge_interval.total_seconds())
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = await self.get(job_id)
+                audio = await asyncio.to_thread(self.store.get_audio, job_id)
+                if job is None or audio is None:
+                    continue
+                await self._set_status(job_id, RUNNING)
+                try:
+                    result = await self.handler(job["payload"], audio)
+                except Exception as e:
+                    print(f"Job {job_id} failed: {e}")
+                    await self._set_status(job_id, FAILED, error=str(e))
+                else:
+                    await self._set_status(job_id, SUCCEEDED, result=result)
+            finally:
+                self._queue.task_done()
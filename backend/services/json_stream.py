@@ -0,0 +1,147 @@
+import json
+from typing import Iterator, Optional, Tuple
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class IncrementalJSONParser:
+    """Parses a streamed JSON object and reports top-level fields as they arrive.
+
+    Feed it text chunks from a model stream. Each call to `feed` yields:
+      ("partial", key, text) - newly decoded characters of a string value still being written
+      ("field", key, value)  - a top-level field whose value is complete
+    Anything before the opening brace (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self._state = "start"
+        self._key_chars: list = []
+        self._key: Optional[str] = None
+        self._value_chars: list = []
+        self._escape: Optional[str] = None
+        self._raw: list = []
+        self._depth = 0
+        self._raw_in_string = False
+        self._raw_escape = False
+        self.fields: dict = {}
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> Iterator[Tuple[str, str, object]]:
+        partial_start = len(self._value_chars)
+        for ch in chunk:
+            state = self._state
+            if state == "start":
+                if ch == "{":
+                    self._state = "before_key"
+            elif state == "before_key":
+                if ch == '"':
+                    self._key_chars = []
+                    self._state = "key"
+                elif ch == "}":
+                    self._state = "done"
+            elif state == "key":
+                if self._escape is not None:
+                    self._key_chars.append(self._decode_escape(ch) or "")
+                elif ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    self._key = "".join(self._key_chars)
+                    self._state = "colon"
+                else:
+                    self._key_chars.append(ch)
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "before_value"
+            elif state == "before_value":
+                if ch == '"':
+                    self._value_chars = []
+                    partial_start = 0
+                    self._state = "string"
+                elif not ch.isspace():
+                    self._raw = [ch]
+                    self._depth = 1 if ch in "{[" else 0
+                    self._raw_in_string = False
+                    self._raw_escape = False
+                    self._state = "raw"
+            elif state == "string":
+                if self._escape is not None:
+                    decoded = self._decode_escape(ch)
+                    if decoded is not None:
+                        self._value_chars.append(decoded)
+                elif ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    value = "".join(self._value_chars)
+                    if len(self._value_chars) > partial_start:
+                        yield ("partial", self._key, "".join(self._value_chars[partial_start:]))
+                    yield from self._finish_field(value)
+                else:
+                    self._value_chars.append(ch)
+            elif state == "raw":
+                yield from self._feed_raw(ch)
+            elif state == "after_value":
+                if ch == ",":
+                    self._state = "before_key"
+                elif ch == "}":
+                    self._state = "done"
+        if self._state == "string" and len(self._value_chars) > partial_start:
+            yield ("partial", self._key, "".join(self._value_chars[partial_start:]))
+
+    def _decode_escape(self, ch: str) -> Optional[str]:
+        """Consume one character of an escape sequence; return text once it is complete."""
+        if self._escape == "":
+            if ch == "u":
+                self._escape = "u"
+                return None
+            self._escape = None
+            return _ESCAPES.get(ch, ch)
+        self._escape += ch
+        # \uXXXX, optionally followed by a \uXXXX low surrogate
+        if len(self._escape) == 5:
+            code = int(self._escape[1:], 16)
+            if 0xD800 <= code < 0xDC00:
+                return None
+            self._escape = None
+            return chr(code)
+        if len(self._escape) == 11:
+            high = int(self._escape[1:5], 16)
+            low = int(self._escape[7:11], 16)
+            self._escape = None
+            return chr(0x10000 + ((high - 0xD800) << 10) + (low - 0xDC00))
+        return None
+
+    def _feed_raw(self, ch: str):
+        """Collect a non-string value (number, literal, object or array)."""
+        if self._raw_in_string:
+            self._raw.append(ch)
+            if self._raw_escape:
+                self._raw_escape = False
+            elif ch == "\\":
+                self._raw_escape = True
+            elif ch == '"':
+                self._raw_in_string = False
+            return
+        if self._depth == 0 and (ch in ",}" or ch.isspace()):
+            yield from self._finish_field(json.loads("".join(self._raw)))
+            if ch == ",":
+                self._state = "before_key"
+            elif ch == "}":
+                self._state = "done"
+            return
+        self._raw.append(ch)
+        if ch == '"':
+            self._raw_in_string = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                yield from self._finish_field(json.loads("".join(self._raw)))
+
+    def _finish_field(self, value):
+        self.fields[self._key] = value
+        self._state = "after_value"
+        yield ("field", self._key, value)
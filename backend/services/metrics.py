@@ -0,0 +1,208 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MODEL_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_BUCKETS = (500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    """Value that goes up and down, optionally read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 collect: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, help, labels)
+        self._collect = collect
+
+    def dec(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, *labels: str, value: float):
+        self._values[labels] = value
+
+    def samples(self) -> List[str]:
+        if self._collect is not None:
+            self._values = dict(self._collect())
+        return super().samples()
+
+
+class Histogram:
+    """Bucketed observations per label set; buckets are cumulative only when rendered."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = HTTP_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> [per-bucket counts..., sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * len(self.buckets) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, series in self._values.items():
+            total = 0
+            for bound, count in zip(self.buckets, series):
+                total += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = (), collect=None) -> Gauge:
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=HTTP_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route template, method and status", ("method", "route", "status"))
+http_duration = registry.histogram(
+    "http_request_duration_seconds", "Time to the last response byte", ("method", "route"))
+http_in_flight = registry.gauge(
+    "http_requests_in_flight", "Requests currently being handled", ("method", "route"))
+
+db_duration = registry.histogram(
+    "db_query_duration_seconds", "Supabase round-trips by table (rpc/<name> for functions)",
+    ("table", "method", "outcome"), DB_BUCKETS)
+
+openai_duration = registry.histogram(
+    "openai_request_duration_seconds", "OpenAI calls, including retries, by model",
+    ("model", "operation", "outcome"), MODEL_BUCKETS)
+openai_tokens = registry.counter(
+    "openai_tokens_total", "Tokens reported by OpenAI usage, by model and kind (prompt includes cached)",
+    ("model", "kind"))
+openai_prompt_tokens = registry.histogram(
+    "openai_prompt_tokens", "Prompt size per OpenAI call, in tokens", ("model",), TOKEN_BUCKETS)
+transcript_overflows = registry.counter(
+    "ai_transcript_overflow_total", "Transcripts over PROMPT_TOKEN_BUDGET, by how they were shortened", ("mode",))
+
+audio_bytes = registry.counter("audio_bytes_total", "Uploaded consultation audio processed, in bytes")
+audio_seconds = registry.counter("audio_seconds_total", "Uploaded consultation audio processed, in seconds")
+audio_path = registry.counter(
+    "consultation_audio_path_total",
+    "Consultations by notes path: primary (GPT-4o audio), fallback or circuit_open (Whisper + GPT-4o), chunked",
+    ("path",))
+json_parse_failures = registry.counter(
+    "ai_json_parse_failures_total", "Model output that could not be parsed as complete notes JSON", ("model",))
+notes_outputs = registry.counter(
+    "ai_notes_outputs_total",
+    "Notes replies by model and outcome: clean, repaired (only the bad fields re-asked) or unusable",
+    ("model", "outcome"))
+
+
+def _route_template(scope: Scope) -> str:
+    """Path template of the matching route, so UUIDs don't each become a series."""
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Counts, latency and in-flight requests per route template."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _route_template(scope)
+        status = "500"
+
+        async def wrapped_send(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        http_in_flight.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, wrapped_send)
+        finally:
+            http_in_flight.dec(method, route)
+            http_duration.observe(time.perf_counter() - started, method, route)
+            http_requests.inc(method, route, status)
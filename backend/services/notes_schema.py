@@ -0,0 +1,72 @@
+import json
+from typing import Iterable, List, Tuple
+from pydantic import BaseModel, Field, ValidationError
+from services.json_stream import IncrementalJSONParser
+
+
+class ConsultationNotes(BaseModel):
+    """The notes payload. Its JSON schema is sent to the models and written into the prompt."""
+
+    transcript: str = Field(description="Full transcription of the audio")
+    formatted_notes: str = Field(description="Structured SOAP notes in markdown format")
+    chief_complaint: str = Field(description="Primary reason for visit (brief)")
+    diagnosis: str = Field(description="Working diagnosis or differential diagnoses")
+    treatment_plan: str = Field(description="Recommended treatment and next steps")
+    follow_up: str = Field(description="Recommended follow-up timeframe if mentioned")
+
+
+ALL_FIELDS = tuple(ConsultationNotes.model_fields)
+# What the notes model writes when it is given the transcript rather than producing it
+NOTE_FIELDS = tuple(name for name in ALL_FIELDS if name != "transcript")
+
+_BLANK = {name: "" for name in ALL_FIELDS}
+
+
+def _ordered(fields: Iterable[str]) -> list:
+    wanted = set(fields)
+    return [name for name in ALL_FIELDS if name in wanted]
+
+
+def json_schema(fields: Iterable[str] = ALL_FIELDS) -> dict:
+    """Strict JSON schema (OpenAI structured outputs) for some of the ConsultationNotes fields."""
+    properties = ConsultationNotes.model_json_schema()["properties"]
+    selected = {name: {"type": "string", "description": properties[name]["description"]} for name in _ordered(fields)}
+    return {"type": "object", "properties": selected, "required": list(selected), "additionalProperties": False}
+
+
+def response_format(fields: Iterable[str] = ALL_FIELDS, name: str = "consultation_notes") -> dict:
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": json_schema(fields)}}
+
+
+def prompt_format(fields: Iterable[str] = ALL_FIELDS) -> str:
+    """The JSON shape as shown in a prompt: each field with its description."""
+    properties = json_schema(fields)["properties"]
+    return json.dumps({name: spec["description"] for name, spec in properties.items()}, indent=4)
+
+
+def parse_json_object(content: str) -> dict:
+    """Top-level fields of the first JSON object in `content`, tolerating damage.
+
+    Text around the object (a ```json fence, a preamble) is skipped, and a
+    truncated or malformed reply keeps every field completed before the break.
+    """
+    parser = IncrementalJSONParser()
+    try:
+        for _ in parser.feed(content):
+            pass
+    except ValueError:
+        pass
+    return parser.fields
+
+
+def validate_notes(values: dict, fields: Iterable[str] = ALL_FIELDS) -> Tuple[dict, List[str]]:
+    """Split parsed output into valid notes fields and the names of those missing or invalid."""
+    fields = _ordered(fields)
+    present = {name: values[name] for name in fields if name in values}
+    try:
+        ConsultationNotes.model_validate({**_BLANK, **present})
+        invalid = set()
+    except ValidationError as e:
+        invalid = {error["loc"][0] for error in e.errors()}
+    notes = {name: value for name, value in present.items() if name not in invalid}
+    return notes, [name for name in fields if name not in notes]
@@ -1,129 +1,458 @@
-import base64
-from openai import OpenAI
-from config import OPENAI_API_KEY
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Optional
+import httpx
+import openai
+from openai import AsyncOpenAI
+from services.tracing import span
+from services.metrics import (
+    registry,
+    openai_duration,
+    openai_tokens,
+    openai_prompt_tokens,
+    audio_path,
+    json_parse_failures,
+    notes_outputs,
+    transcript_overflows,
+)
+from services.notes_schema import ALL_FIELDS, NOTE_FIELDS, parse_json_object, response_format, validate_notes
+from services.prompts import (
+    PROMPT_VERSION,
+    audio_messages,
+    transcript_messages,
+    repair_messages,
+    summary_messages,
+    count_tokens,
+    transcript_overhead_tokens,
+    split_to_fit,
+    split_tokens,
+)
+from services.audio_buffer import b64encode_text, b64_size, hold_memory, as_named_file
+from services.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    LatencyTracker,
+    RetryBudget,
+    call_with_retries,
+    hedged,
+)
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_AUDIO_TIMEOUT,
+    OPENAI_TRANSCRIBE_TIMEOUT,
+    OPENAI_CHAT_TIMEOUT,
+    OPENAI_MAX_RETRIES,
+    AUDIO_BREAKER_FAILURES,
+    AUDIO_BREAKER_RESET_SECONDS,
+    HEDGE_ENABLED,
+    HEDGE_PERCENTILE,
+    HEDGE_DEFAULT_SECONDS,
+    RETRY_BUDGET_RATIO,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_BASE_DELAY_SECONDS,
+    AUDIO_RESPONSE_SCHEMA,
+    OPENAI_MAX_COMPLETION_TOKENS,
+    PROMPT_TOKEN_BUDGET,
+    TRANSCRIPT_OVERFLOW,
+    OPENAI_FAKE,
+    FAKE_OPENAI_MEDIAN_SECONDS,
+    FAKE_OPENAI_SIGMA,
+    FAKE_OPENAI_FAILURE_RATE,
+    FAKE_OPENAI_TRUNCATION_RATE,
+)
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# One shared async client so every request reuses the same keep-alive pool.
+_http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+    ),
+    timeout=httpx.Timeout(OPENAI_CHAT_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+)
+if OPENAI_FAKE:
+    from services.fake_openai import FakeAsyncOpenAI, FakeOpenAIConfig, ModelProfile
+    client = FakeAsyncOpenAI(FakeOpenAIConfig(
+        default=ModelProfile(FAKE_OPENAI_MEDIAN_SECONDS, FAKE_OPENAI_SIGMA, FAKE_OPENAI_FAILURE_RATE),
+        truncation_rate=FAKE_OPENAI_TRUNCATION_RATE,
+    ))
+else:
+    client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_http_client, max_retries=OPENAI_MAX_RETRIES)
 
-MEDICAL_SYSTEM_PROMPT = """You are a medical documentation assistant. Your task is to process audio recordings of doctor-patient consultations and generate professional medical notes.
+# Caps how many model calls this process has in flight at once.
+_call_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
 
-When processing the audio, you must:
-1. Transcribe the conversation accurately
-2. Generate structured medical notes in SOAP format (Subjective, Objective, Assessment, Plan)
+# Errors worth retrying; timeouts are a subclass of APIConnectionError
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
 
-Respond in the following JSON format:
-{
-    "transcript": "Full transcription of the audio",
-    "formatted_notes": "Structured SOAP notes in markdown format",
-    "chief_complaint": "Primary reason for visit (brief)",
-    "diagnosis": "Working diagnosis or differential diagnoses",
-    "treatment_plan": "Recommended treatment and next steps",
-    "follow_up": "Recommended follow-up timeframe if mentioned"
-}
+retry_budget = RetryBudget(ratio=RETRY_BUDGET_RATIO)
+audio_breaker = CircuitBreaker("gpt-4o-audio", AUDIO_BREAKER_FAILURES, AUDIO_BREAKER_RESET_SECONDS)
+audio_latency = LatencyTracker()
+registry.gauge("openai_audio_circuit_open", "1 while the GPT-4o audio circuit breaker is open",
+               collect=lambda: {(): int(audio_breaker.state == "open")})
 
-SOAP Notes Format:
-## Subjective
-- Chief Complaint
-- History of Present Illness
-- Review of Systems (if mentioned)
 
-## Objective
-- Vital Signs (if mentioned)
-- Physical Exam Findings (if mentioned)
+async def close_client():
+    """Close the shared HTTP pool (called on app shutdown)."""
+    await client.close()
+    await _http_client.aclose()
 
-## Assessment
-- Diagnosis/Differential Diagnoses
-- Clinical Reasoning
 
-## Plan
-- Medications
-- Tests/Procedures
-- Patient Education
-- Follow-up
+class NotesGenerationError(Exception):
+    """Raised when notes can't be written for a transcript; the transcript is kept on the error."""
 
-Be concise but thorough. If information is not mentioned in the audio, note it as "Not discussed" rather than making assumptions."""
+    def __init__(self, transcript: str, cause: Exception):
+        super().__init__(f"Notes generation failed: {cause}")
+        self.transcript = transcript
 
 
-async def process_audio_with_gpt4o(audio_bytes: bytes, patient_name: str, doctor_name: str) -> dict:
-    """Process audio using GPT-4o's native audio capabilities."""
+class TokenUsage:
+    """Tokens spent on one consultation, summed over every model call made for it."""
+
+    def __init__(self):
+        self.prompt = 0
+        self.cached = 0
+        self.completion = 0
+
+    def add(self, prompt: int, cached: int, completion: int):
+        self.prompt += prompt
+        self.cached += cached
+        self.completion += completion
+
+    def columns(self) -> dict:
+        """Consultation row columns; prompt_tokens includes the cached ones."""
+        return {"prompt_tokens": self.prompt, "cached_tokens": self.cached, "completion_tokens": self.completion}
+
+
+_usage: contextvars.ContextVar[Optional[TokenUsage]] = contextvars.ContextVar("token_usage", default=None)
+
+
+@contextmanager
+def track_usage():
+    """Collect the tokens of every model call made inside the block (including spawned tasks)."""
+    usage = TokenUsage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def _record_usage(model: str, usage):
+    # Chat completions report tokens; Whisper doesn't
+    prompt = getattr(usage, "prompt_tokens", None)
+    if prompt is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    openai_tokens.inc(model, "prompt", amount=prompt)
+    openai_tokens.inc(model, "cached", amount=cached)
+    openai_tokens.inc(model, "completion", amount=usage.completion_tokens)
+    openai_prompt_tokens.observe(prompt, model)
+    consultation_usage = _usage.get()
+    if consultation_usage is not None:
+        consultation_usage.add(prompt, cached, usage.completion_tokens)
+
+
+async def _call_model(create, operation: str, **kwargs):
+    """Call an SDK method under the concurrency cap, retrying transient errors within budget."""
+    async def attempt():
+        async with _call_slots:
+            return await create(**kwargs)
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(f"openai.{kwargs['model']}"):
+            response = await call_with_retries(
+                attempt, retry_budget, TRANSIENT_ERRORS,
+                max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY_SECONDS
+            )
+        outcome = "ok"
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        openai_duration.observe(time.perf_counter() - started, kwargs["model"], operation, outcome)
+    _record_usage(kwargs["model"], getattr(response, "usage", None))
+    return response
+
+
+AUDIO_MODEL = "gpt-4o-audio-preview"
+TRANSCRIBE_MODEL = "whisper-1"
+NOTES_MODEL = "gpt-4o"
+
+def _audio_messages(audio_bytes: bytes, patient_name: str, doctor_name: str, audio_format: str) -> list:
+    with span("base64"):
+        audio_base64 = b64encode_text(audio_bytes)
+    return audio_messages(audio_base64, patient_name, doctor_name, audio_format)
+
+
+async def _summarize(excerpt: str, max_tokens: int) -> str:
+    """Condense part of a transcript to about `max_tokens`, in budget-sized pieces summarized in parallel."""
+    pieces = split_tokens(excerpt, PROMPT_TOKEN_BUDGET // 2)
+    per_piece = max(64, max_tokens // len(pieces))
     
-    audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
+    async def summarize(piece: str) -> str:
+        response = await _call_model(
+            client.chat.completions.create, "summarize",
+            model=NOTES_MODEL,
+            messages=summary_messages(piece),
+            max_completion_tokens=per_piece,
+            timeout=OPENAI_CHAT_TIMEOUT
+        )
+        return response.choices[0].message.content.strip()
     
-    context_prompt = f"""Process this medical consultation audio.
-Patient: {patient_name}
-Doctor: {doctor_name}
-
-Generate comprehensive medical documentation."""
-
-    response = client.chat.completions.create(
-        model="gpt-4o-audio-preview",
-        modalities=["text"],
-        messages=[
-            {"role": "system", "content": MEDICAL_SYSTEM_PROMPT},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": context_prompt},
-                    {
-                        "type": "input_audio",
-                        "input_audio": {
-                            "data": audio_base64,
-                            "format": "wav"
-                        }
-                    }
-                ]
-            }
-        ]
+    return "\n".join(await asyncio.gather(*(summarize(piece) for piece in pieces)))
+
+
+async def fit_transcript(transcript: str, patient_name: str, doctor_name: str) -> str:
+    """Shorten a transcript that would take the notes prompt over PROMPT_TOKEN_BUDGET.
+
+    Keeps the start and the (larger) end of the conversation; the middle is
+    dropped or, with TRANSCRIPT_OVERFLOW=summarize, condensed by the notes model.
+    """
+    room = PROMPT_TOKEN_BUDGET - transcript_overhead_tokens(patient_name, doctor_name)
+    tokens = count_tokens(transcript)
+    if tokens <= room:
+        return transcript
+    with span("transcript_fit"):
+        if TRANSCRIPT_OVERFLOW == "summarize":
+            summary_room = room // 4
+            head, middle, tail = split_to_fit(transcript, room - summary_room)
+            summary = await _summarize(middle, summary_room)
+            bridge = f"\n[Condensed middle of the consultation]\n{summary}\n[Transcript resumes]\n"
+        else:
+            head, middle, tail = split_to_fit(transcript, room)
+            bridge = f"\n[... about {count_tokens(middle)} tokens of the conversation omitted ...]\n"
+    transcript_overflows.inc(TRANSCRIPT_OVERFLOW)
+    print(f"Transcript of {tokens} tokens is over the {room}-token budget; "
+          f"{TRANSCRIPT_OVERFLOW} applied to {count_tokens(middle)} tokens from the middle")
+    return head + bridge + tail
+
+
+def _audio_response_format() -> dict:
+    return {"response_format": response_format(ALL_FIELDS)} if AUDIO_RESPONSE_SCHEMA else {}
+
+
+async def repair_notes(notes: dict, missing: list, transcript: str, patient_name: str, doctor_name: str) -> dict:
+    """Ask the notes model for just the `missing` fields; returns them (raises ValueError if still bad)."""
+    transcript = await fit_transcript(transcript, patient_name, doctor_name)
+    response = await _call_model(
+        client.chat.completions.create, "repair",
+        model=NOTES_MODEL,
+        messages=repair_messages(notes, missing, transcript, patient_name, doctor_name),
+        response_format=response_format(missing, "notes_repair"),
+        max_completion_tokens=OPENAI_MAX_COMPLETION_TOKENS,
+        timeout=OPENAI_CHAT_TIMEOUT
     )
+    repaired, still_missing = validate_notes(parse_json_object(response.choices[0].message.content), missing)
+    if still_missing:
+        raise ValueError(f"Repair did not produce {', '.join(still_missing)}")
+    return repaired
+
+
+async def complete_notes(values: dict, model: str, fields: tuple, patient_name: str, doctor_name: str,
+                         transcript: Optional[str] = None) -> dict:
+    """Validate a model's parsed reply against ConsultationNotes, repairing only what is missing.
+
+    Without a transcript to repair from (the audio model lost its own), raises
+    ValueError so the caller falls back to Whisper.
+    """
+    notes, missing = validate_notes(values, fields)
+    if not missing:
+        notes_outputs.inc(model, "clean")
+        return notes
+    json_parse_failures.inc(model)
+    transcript = transcript or notes.get("transcript")
+    if not transcript:
+        notes_outputs.inc(model, "unusable")
+        raise ValueError(f"{model} reply has no usable transcript")
+    print(f"{model} reply missing or invalid: {', '.join(missing)}; repairing those fields")
+    try:
+        notes.update(await repair_notes(notes, missing, transcript, patient_name, doctor_name))
+    except Exception:
+        notes_outputs.inc(model, "unusable")
+        raise
+    notes_outputs.inc(model, "repaired")
+    return notes
+
+
+async def process_audio_with_gpt4o(audio_bytes: bytes, patient_name: str, doctor_name: str,
+                                   audio_format: str = "wav") -> dict:
+    """Process audio using GPT-4o's native audio capabilities."""
     
-    import json
-    import re
-    content = response.choices[0].message.content
-    # Extract JSON from markdown code blocks if present
-    json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', content)
-    if json_match:
-        content = json_match.group(1)
-    result = json.loads(content)
-    return result
+    # The base64 text plus the JSON request body the SDK serializes from it
+    with hold_memory(2 * b64_size(len(audio_bytes)), "GPT-4o audio request"):
+        messages = _audio_messages(audio_bytes, patient_name, doctor_name, audio_format)
+        response = await _call_model(
+            client.chat.completions.create, "chat",
+            model=AUDIO_MODEL,
+            modalities=["text"],
+            messages=messages,
+            max_completion_tokens=OPENAI_MAX_COMPLETION_TOKENS,
+            timeout=OPENAI_AUDIO_TIMEOUT,
+            **_audio_response_format()
+        )
+        del messages
+    
+    with span("json_extract"):
+        # Skips a markdown code fence if the model added one
+        values = parse_json_object(response.choices[0].message.content)
+    return await complete_notes(values, AUDIO_MODEL, ALL_FIELDS, patient_name, doctor_name)
+
+
+async def transcribe_with_whisper(audio_bytes: bytes, audio_format: str = "wav") -> str:
+    """Transcribe audio with Whisper."""
+    transcription = await _call_model(
+        client.audio.transcriptions.create, "transcription",
+        model=TRANSCRIBE_MODEL,
+        file=as_named_file(audio_bytes, f"recording.{audio_format}"),
+        timeout=OPENAI_TRANSCRIBE_TIMEOUT
+    )
+    return transcription.text
+
 
+async def generate_notes_from_transcript(transcript: str, patient_name: str, doctor_name: str) -> dict:
+    """Generate structured notes from an existing transcript with GPT-4o.
 
-async def process_audio_with_whisper_and_gpt4(audio_bytes: bytes, patient_name: str, doctor_name: str) -> dict:
+    Raises NotesGenerationError, carrying the transcript, if no usable notes come back.
+    """
+    try:
+        response = await _call_model(
+            client.chat.completions.create, "chat",
+            model=NOTES_MODEL,
+            messages=transcript_messages(await fit_transcript(transcript, patient_name, doctor_name),
+                                         patient_name, doctor_name),
+            response_format=response_format(NOTE_FIELDS),
+            max_completion_tokens=OPENAI_MAX_COMPLETION_TOKENS,
+            timeout=OPENAI_CHAT_TIMEOUT
+        )
+        
+        with span("json_extract"):
+            values = parse_json_object(response.choices[0].message.content)
+        result = await complete_notes(values, NOTES_MODEL, NOTE_FIELDS, patient_name, doctor_name, transcript)
+    except Exception as e:
+        raise NotesGenerationError(transcript, e) from e
+    return {"transcript": transcript, **result}
+
+
+async def process_audio_with_whisper_and_gpt4(audio_bytes: bytes, patient_name: str, doctor_name: str,
+                                              audio_format: str = "wav") -> dict:
     """Fallback: Use Whisper for transcription + GPT-4 for notes."""
-    import tempfile
-    import os
+    transcript = await transcribe_with_whisper(audio_bytes, audio_format)
+    return await generate_notes_from_transcript(transcript, patient_name, doctor_name)
+
+
+def hedge_delay():
+    """Seconds to give GPT-4o audio before also starting the Whisper path (None: never hedge)."""
+    if not HEDGE_ENABLED:
+        return None
+    observed = audio_latency.percentile(HEDGE_PERCENTILE)
+    return observed if observed is not None else HEDGE_DEFAULT_SECONDS
+
+
+async def process_audio_resilient(audio_bytes: bytes, patient_name: str, doctor_name: str,
+                                  audio_format: str = "wav") -> dict:
+    """GPT-4o audio behind a circuit breaker, hedged with the Whisper path once it runs slow."""
     
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-        f.write(audio_bytes)
-        temp_path = f.name
+    async def primary():
+        started = time.monotonic()
+        try:
+            result = await process_audio_with_gpt4o(audio_bytes, patient_name, doctor_name, audio_format)
+        except asyncio.CancelledError:
+            audio_breaker.abandon()
+            raise
+        except Exception:
+            audio_breaker.record_failure()
+            raise
+        audio_breaker.record_success()
+        audio_latency.record(time.monotonic() - started)
+        return result
     
-    try:
-        with open(temp_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
-            )
-        transcript = transcription.text
-    finally:
-        os.unlink(temp_path)
+    async def fallback():
+        return await process_audio_with_whisper_and_gpt4(audio_bytes, patient_name, doctor_name, audio_format)
     
-    context_prompt = f"""Process this medical consultation transcript.
-Patient: {patient_name}
-Doctor: {doctor_name}
-
-Transcript:
-{transcript}
-
-Generate comprehensive medical documentation."""
-
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": MEDICAL_SYSTEM_PROMPT},
-            {"role": "user", "content": context_prompt}
-        ],
-        response_format={"type": "json_object"}
-    )
+    if not audio_breaker.allow():
+        print("GPT-4o audio circuit is open, using Whisper")
+        audio_path.inc("circuit_open")
+        return await fallback()
     
-    import json
-    result = json.loads(response.choices[0].message.content)
-    result["transcript"] = transcript
+    result, source = await hedged(primary, fallback, hedge_delay())
+    audio_path.inc(source)
+    if source == "fallback":
+        print("Consultation served by the Whisper path")
     return result
+
+
+async def _stream_text(**kwargs) -> AsyncIterator[str]:
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(f"openai.{kwargs['model']}"):
+            async with _call_slots:
+                stream = await call_with_retries(
+                    lambda: client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs),
+                    retry_budget, TRANSIENT_ERRORS,
+                    max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY_SECONDS
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    # With include_usage the last chunk carries the totals and no choices
+                    _record_usage(kwargs["model"], chunk.usage)
+        outcome = "ok"
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    finally:
+        openai_duration.observe(time.perf_counter() - started, kwargs["model"], "chat_stream", outcome)
+
+
+async def _stream_audio_notes(audio_bytes: bytes, patient_name: str, doctor_name: str,
+                             audio_format: str) -> AsyncIterator[str]:
+    if not audio_breaker.allow():
+        raise CircuitOpenError("GPT-4o audio circuit is open")
+    try:
+        with hold_memory(2 * b64_size(len(audio_bytes)), "GPT-4o audio request"):
+            stream = _stream_text(
+                model=AUDIO_MODEL,
+                modalities=["text"],
+                messages=_audio_messages(audio_bytes, patient_name, doctor_name, audio_format),
+                max_completion_tokens=OPENAI_MAX_COMPLETION_TOKENS,
+                timeout=OPENAI_AUDIO_TIMEOUT,
+                **_audio_response_format()
+            )
+            async for text in stream:
+                yield text
+    except (asyncio.CancelledError, GeneratorExit):
+        audio_breaker.abandon()
+        raise
+    except Exception:
+        audio_breaker.record_failure()
+        raise
+    audio_breaker.record_success()
+
+
+def stream_notes_from_audio(audio_bytes: bytes, patient_name: str, doctor_name: str,
+                            audio_format: str = "wav") -> AsyncIterator[str]:
+    """Stream the raw JSON notes text from GPT-4o audio as it is generated."""
+    return _stream_audio_notes(audio_bytes, patient_name, doctor_name, audio_format)
+
+
+async def stream_notes_from_transcript(transcript: str, patient_name: str, doctor_name: str) -> AsyncIterator[str]:
+    """Stream the raw JSON notes text generated from a transcript."""
+    stream = _stream_text(
+        model=NOTES_MODEL,
+        messages=transcript_messages(await fit_transcript(transcript, patient_name, doctor_name),
+                                     patient_name, doctor_name),
+        response_format=response_format(NOTE_FIELDS),
+        max_completion_tokens=OPENAI_MAX_COMPLETION_TOKENS,
+        timeout=OPENAI_CHAT_TIMEOUT
+    )
+    async for text in stream:
+        yield text
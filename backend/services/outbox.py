@@ -0,0 +1,237 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional
+import httpx
+from postgrest.exceptions import APIError
+from services.database import DatabaseTimeoutError
+
+PENDING = "pending"
+FAILED = "failed"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def is_rejection(e: Exception) -> bool:
+    """True if the database refused the rows themselves, so resending can't help.
+
+    Integrity (23xxx) and data (22xxx) errors; anything else, including
+    timeouts, gateway errors and dropped connections, is worth retrying.
+    """
+    return isinstance(e, APIError) and str(e.code or "")[:2] in ("22", "23")
+
+
+class SQLiteOutbox:
+    """Rows waiting to be written upstream, keyed by their primary key.
+
+    A file path (WAL mode) survives restarts; ":memory:" is for tests.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL is still durable across process crashes, which is what this guards against
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                row TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+            return rows
+
+    def add(self, row: dict):
+        now = _now()
+        self._execute(
+            "INSERT INTO outbox (id, row, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (row["id"], json.dumps(row), PENDING, now, now),
+        )
+
+    def get(self, row_id: str) -> Optional[dict]:
+        rows = self._execute("SELECT row FROM outbox WHERE id = ? AND status = ?", (row_id, PENDING))
+        return json.loads(rows[0]["row"]) if rows else None
+
+    def matching(self, column: str, value: str) -> List[dict]:
+        """Pending rows whose `column` equals `value`."""
+        rows = self._execute(
+            "SELECT row FROM outbox WHERE status = ? AND json_extract(row, '$.' || ?) = ?",
+            (PENDING, column, value),
+        )
+        return [json.loads(r["row"]) for r in rows]
+
+    def oldest(self, limit: int) -> List[dict]:
+        rows = self._execute(
+            "SELECT row FROM outbox WHERE status = ? ORDER BY created_at LIMIT ?", (PENDING, limit)
+        )
+        return [json.loads(r["row"]) for r in rows]
+
+    def replace(self, row: dict) -> bool:
+        updated = self._execute(
+            "UPDATE outbox SET row = ?, updated_at = ? WHERE id = ? AND status = ? RETURNING id",
+            (json.dumps(row), _now(), row["id"], PENDING),
+        )
+        return bool(updated)
+
+    def remove(self, ids: List[str]) -> int:
+        placeholders = ",".join("?" * len(ids))
+        return len(self._execute(f"DELETE FROM outbox WHERE id IN ({placeholders}) RETURNING id", tuple(ids)))
+
+    def record_failure(self, ids: List[str], error: str, status: str = PENDING):
+        placeholders = ",".join("?" * len(ids))
+        self._execute(
+            f"UPDATE outbox SET attempts = attempts + 1, last_error = ?, status = ?, updated_at = ? "
+            f"WHERE id IN ({placeholders})",
+            (error[:500], status, _now(), *ids),
+        )
+
+    def counts(self) -> dict:
+        rows = self._execute("SELECT status, count(*) AS n, min(created_at) AS oldest FROM outbox GROUP BY status")
+        return {r["status"]: {"rows": r["n"], "oldest": r["oldest"]} for r in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+RowWriter = Callable[[List[dict]], Awaitable[None]]
+
+
+class WriteBehind:
+    """Commits rows locally, then a background task writes them upstream in batches.
+
+    `writer` must be idempotent (an upsert on the primary key): a batch that
+    timed out may have landed, and is sent again. Edits and deletes of a row
+    that is still pending go through `update`/`discard`, which wait for any
+    in-flight batch so a row can't be changed underneath a send.
+    """
+
+    def __init__(self, store: SQLiteOutbox, writer: RowWriter, batch_size: int = 50,
+                 interval: float = 1.0, max_backoff: float = 60.0):
+        self.store = store
+        self.writer = writer
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.last_error: Optional[str] = None
+        self._send_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        """Stop the flusher after one last attempt; whatever is left waits for the next start."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except Exception as e:
+            print(f"Outbox flush on shutdown failed: {e}")
+
+    async def add(self, row: dict) -> dict:
+        await asyncio.to_thread(self.store.add, row)
+        self._wake.set()
+        return row
+
+    async def get(self, row_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.store.get, row_id)
+
+    async def pending(self, column: str, value: str) -> List[dict]:
+        return await asyncio.to_thread(self.store.matching, column, value)
+
+    async def update(self, row_id: str, changes: dict) -> Optional[dict]:
+        """Apply `changes` to a pending row; None if it isn't pending (any more)."""
+        async with self._send_lock:
+            row = await self.get(row_id)
+            if row is None:
+                return None
+            row.update(changes)
+            return row if await asyncio.to_thread(self.store.replace, row) else None
+
+    async def discard(self, row_id: str) -> bool:
+        """Drop a pending row before it is written; False if it isn't pending."""
+        async with self._send_lock:
+            return bool(await asyncio.to_thread(self.store.remove, [row_id]))
+
+    async def _run(self):
+        backoff = self.interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                backoff = self.interval
+            except Exception as e:
+                print(f"Outbox flush failed, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def flush(self):
+        """Write pending rows until none are left; raises if the upstream is unavailable."""
+        while True:
+            async with self._send_lock:
+                rows = await asyncio.to_thread(self.store.oldest, self.batch_size)
+                if not rows:
+                    return
+                await self._send(rows)
+
+    async def _send(self, rows: List[dict]):
+        ids = [row["id"] for row in rows]
+        try:
+            await self.writer(rows)
+        except (APIError, DatabaseTimeoutError, httpx.HTTPError) as e:
+            if is_rejection(e):
+                await self._send_one_by_one(rows)
+                return
+            self.last_error = str(e)
+            await asyncio.to_thread(self.store.record_failure, ids, str(e))
+            raise
+        await asyncio.to_thread(self.store.remove, ids)
+        self.last_error = None
+
+    async def _send_one_by_one(self, rows: List[dict]):
+        """Find which rows in a rejected batch are bad; park those, write the rest."""
+        for row in rows:
+            try:
+                await self.writer([row])
+            except APIError as e:
+                if not is_rejection(e):
+                    raise
+                print(f"Outbox row {row['id']} rejected, keeping it for inspection: {e}")
+                self.last_error = str(e)
+                await asyncio.to_thread(self.store.record_failure, [row["id"]], str(e), FAILED)
+            else:
+                await asyncio.to_thread(self.store.remove, [row["id"]])
+
+    def report(self) -> dict:
+        counts = self.store.counts()
+        return {
+            "pending": counts.get(PENDING, {}).get("rows", 0),
+            "oldest_pending": counts.get(PENDING, {}).get("oldest"),
+            "failed": counts.get(FAILED, {}).get("rows", 0),
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,93 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timezone
+from typing import List, Optional
+from fastapi import Query, Response
+from config import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor can't be decoded."""
+
+
+def page_params(
+    cursor: Optional[str] = Query(None, description=f"Opaque cursor from the previous page's {NEXT_CURSOR_HEADER} header"),
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+) -> dict:
+    """Query parameters shared by every paginated list endpoint."""
+    return {"cursor": cursor, "limit": limit}
+
+
+def encode_cursor(row: dict, column: str) -> str:
+    payload = json.dumps([row[column], row["id"]], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise InvalidCursorError("Invalid pagination cursor")
+    return value, row_id
+
+
+def _quote(value) -> str:
+    """Quote a value for a PostgREST logic-tree filter (commas and parens are reserved)."""
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def keyset(query, column: str, cursor: Optional[str], limit: int, desc: bool = False):
+    """Order by (column, id) and start after the cursor's row.
+
+    Fetches one extra row so `page` can tell whether another page follows.
+    """
+    query = query.order(column, desc=desc).order("id", desc=desc)
+    if cursor:
+        value, row_id = decode_cursor(cursor)
+        op = "lt" if desc else "gt"
+        value, row_id = _quote(value), _quote(row_id)
+        query = query.or_(f"{column}.{op}.{value},and({column}.eq.{value},id.{op}.{row_id})")
+    return query.limit(limit + 1)
+
+
+def page(rows: List[dict], column: str, limit: int, response: Response) -> List[dict]:
+    """Trim the look-ahead row and advertise the next cursor in a response header."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1], column)
+    return rows
+
+
+def sort_value(value):
+    """Timestamps compare as instants, whatever offset format they were written in."""
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    return value
+
+
+def merge_rows(rows: List[dict], extra: List[dict], column: str, cursor: Optional[str], limit: int,
+               desc: bool = False) -> List[dict]:
+    """Merge rows held outside the database into a `keyset` result, keeping its order and page size.
+
+    Rows in both (an extra row that has just been written) appear once.
+    """
+    if not extra:
+        return rows
+    key = lambda row: (sort_value(row[column]), row["id"])
+    if cursor:
+        value, row_id = decode_cursor(cursor)
+        after = (sort_value(value), row_id)
+        extra = [row for row in extra if (key(row) < after if desc else key(row) > after)]
+    seen = {row["id"] for row in rows}
+    merged = rows + [row for row in extra if row["id"] not in seen]
+    merged.sort(key=key, reverse=desc)
+    return merged[:limit + 1]
@@ -0,0 +1,193 @@
+"""Prompt text and message builders for the notes models.
+
+Every request starts with the same bytes: the system prompt, then the fixed
+instruction at the top of the user message. Names, transcripts and audio come
+last, so the provider's prompt cache can reuse the prefix across requests.
+"""
+import json
+import math
+from functools import lru_cache
+from typing import List, Tuple
+from services.notes_schema import ALL_FIELDS, NOTE_FIELDS, prompt_format
+
+try:
+    import tiktoken
+except ImportError:  # optional: exact token counts; otherwise ~4 characters per token
+    tiktoken = None
+
+# Bump whenever the prompts below change; it is part of the AI result cache key
+PROMPT_VERSION = "3"
+
+CHARS_PER_TOKEN = 4
+# Per-message framing the API adds on top of the text
+MESSAGE_OVERHEAD_TOKENS = 8
+
+_SYSTEM_PROMPT = """You are a medical documentation assistant. Your task is to process audio recordings of doctor-patient consultations and generate professional medical notes.
+
+When processing the audio, you must:
+1. Transcribe the conversation accurately
+2. Generate structured medical notes in SOAP format (Subjective, Objective, Assessment, Plan)
+
+Respond in the following JSON format:
+{json_format}
+
+SOAP Notes Format:
+## Subjective
+- Chief Complaint
+- History of Present Illness
+- Review of Systems (if mentioned)
+
+## Objective
+- Vital Signs (if mentioned)
+- Physical Exam Findings (if mentioned)
+
+## Assessment
+- Diagnosis/Differential Diagnoses
+- Clinical Reasoning
+
+## Plan
+- Medications
+- Tests/Procedures
+- Patient Education
+- Follow-up
+
+Be concise but thorough. If information is not mentioned in the audio, note it as "Not discussed" rather than making assumptions."""
+
+# The JSON shape comes from ConsultationNotes, the same model the replies are validated against
+MEDICAL_SYSTEM_PROMPT = _SYSTEM_PROMPT.replace("{json_format}", prompt_format(ALL_FIELDS))
+# From a transcript the model only writes the notes; asking it to echo the transcript doubles the output
+NOTES_SYSTEM_PROMPT = _SYSTEM_PROMPT.replace("{json_format}", prompt_format(NOTE_FIELDS))
+
+REPAIR_SYSTEM_PROMPT = """You are a medical documentation assistant completing consultation notes. Some fields of the notes were lost or unusable. Using the transcript and the notes written so far, write only the requested fields, consistent with the rest of the notes. If information is not mentioned, write "Not discussed" rather than making assumptions."""
+
+SUMMARY_SYSTEM_PROMPT = """You are a medical documentation assistant. Condense this excerpt from the middle of a doctor-patient consultation transcript. Keep every symptom, finding, measurement, medication, dose, test and decision, and who said it. Drop small talk and repetition. Reply with the condensed excerpt only."""
+
+AUDIO_INSTRUCTION = "Process this medical consultation audio and generate comprehensive medical documentation."
+TRANSCRIPT_INSTRUCTION = "Process this medical consultation transcript and generate comprehensive medical documentation."
+
+
+def audio_messages(audio_base64: str, patient_name: str, doctor_name: str, audio_format: str) -> list:
+    return [
+        {"role": "system", "content": MEDICAL_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": f"{AUDIO_INSTRUCTION}\n\nPatient: {patient_name}\nDoctor: {doctor_name}"},
+                {
+                    "type": "input_audio",
+                    "input_audio": {
+                        "data": audio_base64,
+                        "format": audio_format
+                    }
+                }
+            ]
+        }
+    ]
+
+
+def _transcript_prompt(transcript: str, patient_name: str, doctor_name: str) -> str:
+    return f"{TRANSCRIPT_INSTRUCTION}\n\nPatient: {patient_name}\nDoctor: {doctor_name}\n\nTranscript:\n{transcript}"
+
+
+def transcript_messages(transcript: str, patient_name: str, doctor_name: str) -> list:
+    return [
+        {"role": "system", "content": NOTES_SYSTEM_PROMPT},
+        {"role": "user", "content": _transcript_prompt(transcript, patient_name, doctor_name)}
+    ]
+
+
+def repair_messages(notes: dict, missing: list, transcript: str, patient_name: str, doctor_name: str) -> list:
+    written = {name: value for name, value in notes.items() if name != "transcript"}
+    context_prompt = f"""Patient: {patient_name}
+Doctor: {doctor_name}
+
+Transcript:
+{transcript}
+
+Notes written so far:
+{json.dumps(written, indent=2)}
+
+Write these fields: {", ".join(missing)}"""
+
+    return [
+        {"role": "system", "content": REPAIR_SYSTEM_PROMPT},
+        {"role": "user", "content": context_prompt}
+    ]
+
+
+def summary_messages(excerpt: str) -> list:
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": excerpt}
+    ]
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")  # GPT-4o's tokenizer
+    except Exception as e:  # the encoding is downloaded on first use
+        print(f"tiktoken encoding unavailable, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def transcript_overhead_tokens(patient_name: str, doctor_name: str) -> int:
+    """Tokens of a transcript prompt other than the transcript itself."""
+    messages = transcript_messages("", patient_name, doctor_name)
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def _head(text: str, tokens: int) -> str:
+    """Roughly the first `tokens` tokens of `text`, ending at a word boundary."""
+    encoding = _encoding()
+    if encoding is None:
+        head = text[:tokens * CHARS_PER_TOKEN]
+    else:
+        head = encoding.decode(encoding.encode(text, disallowed_special=())[:tokens])
+    if len(head) < len(text) and " " in head:
+        head = head[:head.rindex(" ")]
+    return head
+
+
+def _tail(text: str, tokens: int) -> str:
+    """Roughly the last `tokens` tokens of `text`, starting at a word boundary."""
+    if tokens <= 0:
+        return ""
+    encoding = _encoding()
+    if encoding is None:
+        tail = text[-tokens * CHARS_PER_TOKEN:]
+    else:
+        tail = encoding.decode(encoding.encode(text, disallowed_special=())[-tokens:])
+    if len(tail) < len(text) and " " in tail:
+        tail = tail[tail.index(" ") + 1:]
+    return tail
+
+
+def split_to_fit(text: str, room: int, head_share: float = 0.4) -> Tuple[str, str, str]:
+    """Split `text` into (head, middle, tail) with head + tail within `room` tokens.
+
+    The tail gets the larger share: assessment and plan come at the end of a consultation.
+    """
+    head = _head(text, int(room * head_share))
+    rest = text[len(head):]
+    tail = _tail(rest, room - count_tokens(head))
+    return head, rest[:len(rest) - len(tail)], tail
+
+
+def split_tokens(text: str, size: int) -> List[str]:
+    """Cut `text` into consecutive pieces of at most about `size` tokens."""
+    pieces = []
+    while text:
+        piece = _head(text, size) or text[:size * CHARS_PER_TOKEN]
+        pieces.append(piece)
+        text = text[len(piece):]
+    return pieces
@@ -0,0 +1,153 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # optional: only needed for a shared cache (READ_CACHE_URL=redis://...)
+    redis = None
+
+
+class MemoryBackend:
+    """Per-process LRU with a TTL on every entry, evicted by total size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        # Namespace versions live outside the LRU: evicting one would resurrect stale entries
+        self._counters: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+    async def counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def report(self) -> dict:
+        return {"backend": "memory", "entries": len(self._entries), "bytes": self.size, "evictions": self.evictions}
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    """Cache shared by every worker; size bounds come from Redis' maxmemory policy."""
+
+    def __init__(self, url: str):
+        self._redis = redis.from_url(url, decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self._redis.set(key, value, px=int(ttl * 1000))
+
+    async def incr(self, key: str) -> int:
+        return await self._redis.incr(key)
+
+    async def counter(self, key: str) -> int:
+        return int(await self._redis.get(key) or 0)
+
+    def report(self) -> dict:
+        return {"backend": "redis"}
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+class ReadCache:
+    """Read-through cache for database reads, invalidated by namespace.
+
+    Every entry is keyed by the current version of each namespace it depends
+    on; a write bumps the version, so older entries are never read again and
+    simply age out. A read that races a write stores its result under the old
+    version, where nobody will find it.
+    """
+
+    def __init__(self, backend, ttl: float, prefix: str = "readcache"):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "errors": 0}
+
+    async def _versioned_key(self, namespaces: Iterable[str], key: str) -> str:
+        versions = [f"{ns}@{await self.backend.counter(f'{self.prefix}:v:{ns}')}" for ns in namespaces]
+        return f"{self.prefix}:{'|'.join(versions)}:{key}"
+
+    async def get_or_load(self, namespaces: Tuple[str, ...], key: str, load: Callable[[], Awaitable]):
+        """Return the cached value for `key`, or `await load()` and cache it.
+
+        Cache failures never fail the request; they fall through to the database.
+        """
+        try:
+            full_key = await self._versioned_key(namespaces, key)
+            value = await self.backend.get(full_key)
+        except Exception as e:
+            print(f"Read cache lookup failed: {e}")
+            self.stats["errors"] += 1
+            return await load()
+        if value is not None:
+            self.stats["hits"] += 1
+            return json.loads(value)
+
+        self.stats["misses"] += 1
+        result = await load()
+        try:
+            await self.backend.set(full_key, json.dumps(result), self.ttl)
+        except Exception as e:
+            print(f"Read cache write failed: {e}")
+            self.stats["errors"] += 1
+        return result
+
+    async def invalidate(self, *namespaces: str):
+        for ns in namespaces:
+            self.stats["invalidations"] += 1
+            try:
+                await self.backend.incr(f"{self.prefix}:v:{ns}")
+            except Exception as e:
+                # A missed invalidation is bounded by the TTL
+                print(f"Read cache invalidation of '{ns}' failed: {e}")
+                self.stats["errors"] += 1
+
+    def report(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "ttl_seconds": self.ttl,
+            **self.backend.report(),
+        }
+
+    async def close(self):
+        await self.backend.close()
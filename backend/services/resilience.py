@@ -0,0 +1,154 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, Tuple, Type
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency for `reset_timeout` seconds, then lets one probe through."""
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                print(f"Circuit '{self.name}' opened after {self.failures} failures")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def abandon(self):
+        """The call was cancelled before an outcome; let another probe through."""
+        self._probe_in_flight = False
+
+    def report(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+
+class LatencyTracker:
+    """Rolling window of successful call durations."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class RetryBudget:
+    """Token bucket capping retries to a fraction of normal traffic.
+
+    Every first attempt deposits `ratio` tokens and every retry spends one, so
+    during an outage retries add at most `ratio` extra load instead of
+    multiplying it.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def record_attempt(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def call_with_retries(call: Callable[[], Awaitable], budget: RetryBudget, retry_on: Tuple[Type[BaseException], ...],
+                            max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+    """Run `call`, retrying transient errors while the retry budget allows."""
+    budget.record_attempt()
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except retry_on as e:
+            attempt += 1
+            if attempt >= max_attempts or not budget.try_spend():
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            print(f"Retrying after {type(e).__name__} in {delay:.2f}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+
+
+async def hedged(primary: Callable[[], Awaitable], fallback: Callable[[], Awaitable],
+                 hedge_after: Optional[float]):
+    """Run `primary`; if it hasn't finished after `hedge_after` seconds (or fails), race `fallback`.
+
+    Returns (result, which) where which is "primary" or "fallback". The slower
+    call is cancelled. `hedge_after=None` only falls back on failure. If both
+    fail, the fallback's error is raised.
+    """
+    primary_task = asyncio.ensure_future(primary())
+    tasks = [primary_task]
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=hedge_after)
+        if done and not primary_task.exception():
+            return primary_task.result(), "primary"
+        if done:
+            print(f"Primary failed, starting fallback: {primary_task.exception()}")
+
+        fallback_task = asyncio.ensure_future(fallback())
+        tasks.append(fallback_task)
+        pending = {fallback_task} if done else {primary_task, fallback_task}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), "primary" if task is primary_task else "fallback"
+        # Whichever finished last; the fallback's error may carry partial work (a transcript)
+        raise fallback_task.exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+
+def cache_key(audio_bytes: bytes, *context: str) -> str:
+    """Content address for an AI result: the audio plus everything else that shapes the output."""
+    digest = hashlib.sha256(audio_bytes)
+    for part in context:
+        digest.update(b"\0")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class MemoryTier:
+    """LRU of serialized results, evicted by total size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str):
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteTier:
+    """Persistent results that survive restarts, expired after `ttl_seconds`."""
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ai_results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM ai_results WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ai_results (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            self._conn.execute(
+                "DELETE FROM ai_results WHERE created_at <= ?", (time.time() - self.ttl_seconds,)
+            )
+            self._conn.commit()
+
+
+class ResultCache:
+    """Two-tier AI result cache that also coalesces identical in-flight requests."""
+
+    def __init__(self, memory: MemoryTier, disk: Optional[SQLiteTier] = None):
+        self.memory = memory
+        self.disk = disk
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return json.loads(value)
+        if self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.stats["disk_hits"] += 1
+                self.memory.put(key, value)
+                return json.loads(value)
+        return None
+
+    async def put(self, key: str, result: dict):
+        value = json.dumps(result)
+        self.memory.put(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, key, value)
+
+    async def claim(self, key: str) -> Tuple[Optional[dict], Optional["Lead"]]:
+        """Look up `key` for a caller that computes the result itself (e.g. while streaming it).
+
+        Returns (result, None) for a cached result or one joined from an identical
+        call in flight; otherwise (None, lead), and the caller must settle the lead
+        with `finish` or `fail` so anyone who joined meanwhile gets the outcome.
+        """
+        while True:
+            cached = await self.get(key)
+            if cached is not None:
+                return cached, None
+            pending = self._in_flight.get(key)
+            if pending is None:
+                break
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending), None
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The leader went away (client disconnected); take over
+                self.stats["coalesced"] -= 1
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        return None, Lead(self, key, future)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+        """Return a cached result, join an identical call in flight, or run `compute` once."""
+        result, lead = await self.claim(key)
+        if lead is None:
+            return result
+        try:
+            result = await compute()
+        except BaseException as e:
+            lead.fail(e)
+            raise
+        await lead.finish(result)
+        return result
+
+    def report(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"] + self.stats["coalesced"]
+        saved = lookups - self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(saved / lookups, 3) if lookups else 0.0,
+            "in_flight": len(self._in_flight),
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size,
+            "memory_evictions": self.memory.evictions,
+        }
+
+
+class Lead:
+    """The caller computing a result for `ResultCache.claim`; identical calls wait on it."""
+
+    def __init__(self, cache: ResultCache, key: str, future: asyncio.Future):
+        self.cache = cache
+        self.key = key
+        self._future = future
+
+    async def finish(self, result: dict, store: bool = True):
+        """Hand `result` to everyone waiting and, if `store`, cache it."""
+        if self._future.done():
+            return
+        self._future.set_result(result)
+        del self.cache._in_flight[self.key]
+        if not store:
+            return
+        try:
+            await self.cache.put(self.key, result)
+        except Exception as e:
+            print(f"AI result cache write failed: {e}")
+
+    def fail(self, error: BaseException):
+        """Pass `error` to everyone waiting; a cancelled leader lets a waiter take over instead."""
+        if self._future.done():
+            return
+        if isinstance(error, Exception):
+            self.cache.stats["errors"] += 1
+            self._future.set_exception(error)
+            # Nobody may be waiting; mark the exception as retrieved
+            self._future.exception()
+        else:
+            self._future.cancel()
+        del self.cache._in_flight[self.key]
@@ -1,8 +0,0 @@
-from supabase import create_client, Client
-from config import SUPABASE_URL, SUPABASE_KEY
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-
-def get_supabase() -> Client:
-    return supabase
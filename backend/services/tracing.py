@@ -0,0 +1,125 @@
+import contextvars
+import json
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Clients can ask for a breakdown of one request regardless of sampling
+FORCE_HEADER = "x-debug-timing"
+
+
+class Trace:
+    """Stage durations for one request or job, summed by stage name.
+
+    Stages that run concurrently (chunk transcriptions, a hedged call) are
+    summed too, so a stage can add up to more than the wall time.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: Dict[str, list] = {}
+
+    def add(self, stage: str, seconds: float):
+        span = self.spans.get(stage)
+        if span is None:
+            self.spans[stage] = [seconds, 1]
+        else:
+            span[0] += seconds
+            span[1] += 1
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def report(self) -> dict:
+        """Milliseconds per stage (and call count when a stage ran more than once)."""
+        stages = {}
+        for stage, (seconds, count) in self.spans.items():
+            stages[stage] = {"ms": round(seconds * 1000, 1), "count": count} if count > 1 else round(seconds * 1000, 1)
+        return {"total_ms": self.elapsed_ms(), "stages": stages}
+
+    def server_timing(self) -> str:
+        """Server-Timing header value; `total` is the time until the header was sent."""
+        parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, (seconds, _) in self.spans.items()]
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(parts)
+
+    def log(self, **fields):
+        print(json.dumps({"event": "timing", "name": self.name, **fields, **self.report()}))
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(stage: str):
+    """Time a stage of the current trace; a no-op when this request isn't sampled."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def trace(name: str, enabled: bool = True):
+    """Start a trace for work outside a request (e.g. a queued job)."""
+    if not enabled:
+        yield None
+        return
+    new = Trace(name)
+    token = _current.set(new)
+    try:
+        yield new
+    finally:
+        _current.reset(token)
+
+
+class ServerTimingMiddleware:
+    """Traces a sample of requests: adds Server-Timing and logs one JSON line each.
+
+    Stages recorded after the headers went out (a streaming response's body)
+    only appear in the log line.
+    """
+
+    def __init__(self, app: ASGIApp, sample_rate: float = 0.1):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        forced = any(k == FORCE_HEADER.encode() and v != b"0" for k, v in scope["headers"])
+        if not forced and random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        request_trace = Trace(f"{scope['method']} {scope['path']}")
+        token = _current.set(request_trace)
+        status = 500
+
+        async def wrapped_send(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", request_trace.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, wrapped_send)
+        finally:
+            _current.reset(token)
+            request_trace.log(status=status)
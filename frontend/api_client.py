@@ -0,0 +1,309 @@
+"""Backend client for the Streamlit app.
+
+One pooled keep-alive session per process, memoized GETs (st.cache_data)
+that every mutation clears, conditional requests against a shared validator
+store, a background health probe, and per-rerun request timings.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+# Rows fetched per request from paginated list endpoints
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+# Responses remembered for conditional GETs (If-None-Match)
+VALIDATOR_STORE_SIZE = int(os.getenv("VALIDATOR_STORE_SIZE", "200"))
+# How long a GET result is reused without asking the backend at all
+GET_CACHE_TTL = float(os.getenv("GET_CACHE_TTL", "30"))
+# Seconds between background /health probes
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+# Default for the sidebar's timing breakdown toggle
+DEBUG_TIMINGS = os.getenv("DEBUG_TIMINGS", "false").lower() in ("1", "true", "yes")
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Keep-alive session shared by every user session in this process."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class ValidatorStore:
+    """LRU of (ETag, body, headers) by URL, for answering 304s."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url, etag, data, headers):
+        with self._lock:
+            self._entries[url] = {"etag": etag, "json": data, "headers": headers}
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@st.cache_resource
+def _validators() -> ValidatorStore:
+    return ValidatorStore(VALIDATOR_STORE_SIZE)
+
+
+def debug_enabled() -> bool:
+    return st.session_state.get("debug_timings", DEBUG_TIMINGS)
+
+
+def _debug_headers() -> dict:
+    """Ask the backend to trace this request (Server-Timing) while the debug panel is on."""
+    return {"X-Debug-Timing": "1"} if debug_enabled() else {}
+
+
+def parse_server_timing(value: str) -> dict:
+    """Server-Timing header -> {stage: milliseconds}."""
+    stages = {}
+    for metric in value.split(","):
+        name, *params = [part.strip() for part in metric.split(";")]
+        for param in params:
+            if param.startswith("dur="):
+                stages[name] = float(param[4:])
+        if name and name not in stages:
+            stages[name] = None
+    return stages
+
+
+def _record(method, endpoint, started, response=None):
+    """Add a request to this rerun's timings (see start_rerun/finish_rerun)."""
+    timings = st.session_state.get("request_timings")
+    if timings is not None:
+        timings.append((method, endpoint, (time.perf_counter() - started) * 1000))
+    server_timing = response.headers.get("Server-Timing") if response is not None else None
+    if server_timing and st.session_state.get("server_timings") is not None:
+        st.session_state.server_timings.append((method, endpoint, parse_server_timing(server_timing)))
+
+
+def conditional_get(endpoint, params=None):
+    """GET with If-None-Match; a 304 is answered from the validator store.
+
+    Returns (json, headers). Raises requests exceptions like requests.get.
+    """
+    url = requests.Request("GET", f"{BACKEND_URL}{endpoint}", params=params).prepare().url
+    stored = _validators().get(url)
+    headers = {"If-None-Match": stored["etag"]} if stored else {}
+    started = time.perf_counter()
+    response = None
+    try:
+        response = get_session().get(url, headers={**headers, **_debug_headers()}, timeout=REQUEST_TIMEOUT)
+    finally:
+        _record("GET", endpoint, started, response)
+    if response.status_code == 304 and stored:
+        return stored["json"], stored["headers"]
+    response.raise_for_status()
+    data = response.json()
+    headers = dict(response.headers.lower_items())
+    etag = headers.get("etag")
+    if etag:
+        _validators().put(url, etag, data, headers)
+    return data, headers
+
+
+@st.cache_data(ttl=GET_CACHE_TTL, max_entries=500, show_spinner=False)
+def _memoized_get(endpoint, params):
+    return conditional_get(endpoint, dict(params) if params else None)
+
+
+def cached_get(endpoint, params=None):
+    """conditional_get, reused for GET_CACHE_TTL seconds or until the next mutation."""
+    return _memoized_get(endpoint, tuple(sorted(params.items())) if params else None)
+
+
+def invalidate():
+    """Forget memoized GETs and loaded pages after a write."""
+    _memoized_get.clear()
+    st.session_state.pages = {}
+
+
+def api_get(endpoint):
+    try:
+        data, _ = cached_get(endpoint)
+        return data
+    except requests.exceptions.RequestException as e:
+        st.error(f"API Error: {e}")
+        return None
+
+
+def api_get_fresh(endpoint):
+    """GET that skips memoization, for state that changes on its own (job status)."""
+    try:
+        data, _ = conditional_get(endpoint)
+        return data
+    except requests.exceptions.RequestException as e:
+        st.error(f"API Error: {e}")
+        return None
+
+
+def api_post(endpoint, data=None, json_data=None, files=None):
+    started = time.perf_counter()
+    response = None
+    try:
+        response = get_session().post(f"{BACKEND_URL}{endpoint}", data=data, json=json_data, files=files,
+                                      headers=_debug_headers(), timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        invalidate()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        st.error(f"API Error: {e}")
+        return None
+    finally:
+        _record("POST", endpoint, started, response)
+
+
+def api_put(endpoint, json_data):
+    started = time.perf_counter()
+    response = None
+    try:
+        response = get_session().put(f"{BACKEND_URL}{endpoint}", json=json_data, headers=_debug_headers(),
+                                     timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        invalidate()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        st.error(f"API Error: {e}")
+        return None
+    finally:
+        _record("PUT", endpoint, started, response)
+
+
+def api_stream(endpoint, data=None, files=None):
+    """POST to a server-sent events endpoint and yield (event, data) pairs."""
+    started = time.perf_counter()
+    try:
+        # No read timeout: the stream stays open while the notes are generated
+        with get_session().post(f"{BACKEND_URL}{endpoint}", data=data, files=files, stream=True,
+                                headers=_debug_headers(), timeout=(REQUEST_TIMEOUT, None)) as response:
+            response.raise_for_status()
+            invalidate()
+            event, lines = "message", []
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    lines.append(line[5:].strip())
+                elif not line and lines:
+                    yield event, json.loads("\n".join(lines))
+                    event, lines = "message", []
+    except requests.exceptions.RequestException as e:
+        st.error(f"API Error: {e}")
+    finally:
+        _record("STREAM", endpoint, started)
+
+
+def api_get_page(endpoint, cursor=None, limit=PAGE_SIZE):
+    """Fetch one page of a list endpoint; returns (rows, next_cursor)."""
+    params = {"limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    try:
+        data, headers = cached_get(endpoint, params)
+        return data, headers.get("x-next-cursor")
+    except requests.exceptions.RequestException as e:
+        st.error(f"API Error: {e}")
+        return None, None
+
+
+def load_pages(endpoint, limit=PAGE_SIZE):
+    """Rows loaded so far for a list endpoint, kept across reruns until the next write."""
+    pages = st.session_state.setdefault("pages", {})
+    if endpoint not in pages:
+        rows, cursor = api_get_page(endpoint, limit=limit)
+        if rows is None:
+            return []
+        pages[endpoint] = {"rows": rows, "cursor": cursor}
+    return pages[endpoint]["rows"]
+
+
+def has_more(endpoint):
+    state = st.session_state.get("pages", {}).get(endpoint)
+    return bool(state and state["cursor"])
+
+
+def fetch_more(endpoint):
+    """Append the next page of `endpoint` to the loaded rows."""
+    state = st.session_state.pages[endpoint]
+    rows, cursor = api_get_page(endpoint, state["cursor"])
+    if rows is not None:
+        state["rows"].extend(rows)
+        state["cursor"] = cursor
+
+
+class HealthProbe:
+    """Polls /health on a background thread so reruns only read the last result."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.status = {"ok": None, "checked_at": None, "latency_ms": None, "error": None}
+        # Its own connection: cached resources need a script run context the thread doesn't have
+        self._session = requests.Session()
+        self._thread = threading.Thread(target=self._run, name="health-probe", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self._session.get(f"{BACKEND_URL}/health", timeout=5)
+                ok = response.ok and response.json().get("status") == "healthy"
+                error = None if ok else f"HTTP {response.status_code}"
+            except (requests.exceptions.RequestException, ValueError) as e:
+                ok, error = False, str(e)
+            self.status = {
+                "ok": ok,
+                "checked_at": time.time(),
+                "latency_ms": round((time.perf_counter() - started) * 1000),
+                "error": error,
+            }
+            time.sleep(self.interval)
+
+
+@st.cache_resource
+def health_probe() -> HealthProbe:
+    return HealthProbe(HEALTH_PROBE_INTERVAL)
+
+
+def start_rerun():
+    st.session_state.request_timings = []
+    st.session_state.server_timings = []
+    st.session_state.rerun_started = time.perf_counter()
+
+
+def finish_rerun() -> dict:
+    """Record how long this rerun took and how much of it was spent on backend calls."""
+    timings = st.session_state.get("request_timings", [])
+    rerun = {
+        "total_ms": round((time.perf_counter() - st.session_state.rerun_started) * 1000, 1),
+        "requests": len(timings),
+        "request_ms": round(sum(ms for _, _, ms in timings), 1),
+        "slowest": max(timings, key=lambda t: t[2])[:2] if timings else None,
+    }
+    if st.session_state.get("server_timings"):
+        rerun["server"] = st.session_state.server_timings
+    history = st.session_state.setdefault("rerun_history", [])
+    history.append(rerun)
+    del history[:-50]
+    return rerun
@@ -8,7 +8,32 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+from api_client import (  # noqa: E402  (reads BACKEND_URL etc. from the environment)
+    BACKEND_URL,
+    DEBUG_TIMINGS,
+    debug_enabled,
+    api_get_fresh,
+    api_post,
+    api_put,
+    api_stream,
+    load_pages,
+    has_more,
+    fetch_more,
+    health_probe,
+    start_rerun,
+    finish_rerun,
+)
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+# Stream notes as they are generated instead of polling a background job
+STREAM_NOTES = os.getenv("STREAM_NOTES", "true").lower() in ("1", "true", "yes")
+# Seconds of silence before the recorder stops on its own
+RECORDER_PAUSE_THRESHOLD = float(os.getenv("RECORDER_PAUSE_THRESHOLD", "300"))
+# Patient typeahead matches shown per search (max 50)
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", "10"))
+# Pause after the search box changes before querying, so rapid edits send one request
+SEARCH_DEBOUNCE_SECONDS = float(os.getenv("SEARCH_DEBOUNCE_SECONDS", "0.3"))
+SEARCH_MIN_CHARS = int(os.getenv("SEARCH_MIN_CHARS", "2"))
 
 st.set_page_config(
     page_title="Medical Consultation App",
@@ -37,9 +62,11 @@ def init_session_state():
         "audio_bytes": None,
         "recording_active": False,
         "consultation_result": None,
+        "processing_job_id": None,
         "current_view": "dashboard",
         "show_history": False,
         "edit_mode": False,
+        "pages": {},
     }
     for key, value in defaults.items():
         if key not in st.session_state:
@@ -49,35 +76,14 @@ def init_session_state():
 init_session_state()
 
 
-# API Helper functions
-def api_get(endpoint):
-    try:
-        response = requests.get(f"{BACKEND_URL}{endpoint}")
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"API Error: {e}")
-        return None
+# API helpers live in api_client.py
 
 
-def api_post(endpoint, data=None, json_data=None, files=None):
-    try:
-        response = requests.post(f"{BACKEND_URL}{endpoint}", data=data, json=json_data, files=files)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"API Error: {e}")
-        return None
-
-
-def api_put(endpoint, json_data):
-    try:
-        response = requests.put(f"{BACKEND_URL}{endpoint}", json=json_data)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"API Error: {e}")
-        return None
+def load_more_button(endpoint, label="Load more"):
+    """Fetch the next page of `endpoint` on click, if there is one."""
+    if has_more(endpoint) and st.button(label, key=f"more_{endpoint}", use_container_width=True):
+        fetch_more(endpoint)
+        st.rerun()
 
 
 # Component: Add Doctor Modal
@@ -148,7 +154,8 @@ def add_patient_form(doctor_id=None):
 # Component: Patient History
 def show_patient_history(patient_id, patient_name):
     st.subheader(f"📋 Consultation History - {patient_name}")
-    consultations = api_get(f"/api/consultations/patient/{patient_id}")
+    endpoint = f"/api/consultations/patient/{patient_id}"
+    consultations = load_pages(endpoint)
     
     if not consultations:
         st.info("No consultation history found for this patient.")
@@ -165,6 +172,8 @@ def show_patient_history(patient_id, patient_name):
             
             with st.expander("View Raw Transcript"):
                 st.text(consult.get("raw_transcript", "No transcript available"))
+    
+    load_more_button(endpoint, "Load older consultations")
 
 
 # Component: Consultation Result with Edit
@@ -216,13 +225,89 @@ def show_consultation_result(result, consultation_id):
         st.subheader("Medical Notes (SOAP Format)")
         st.markdown(ai_result.get("formatted_notes", "No notes generated"))
         
-        if st.button("✏️ Edit Notes"):
-            st.session_state.edit_mode = True
-            st.rerun()
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("✏️ Edit Notes", use_container_width=True):
+                st.session_state.edit_mode = True
+                st.rerun()
+        with col2:
+            # Rewrites the notes from the saved transcript; no re-recording or re-transcription
+            if st.button("🔁 Regenerate Notes", use_container_width=True):
+                with st.spinner("Regenerating notes from the transcript..."):
+                    regenerated = api_post(f"/api/consultations/{consultation_id}/regenerate")
+                if regenerated:
+                    for field in ("formatted_notes", "chief_complaint", "diagnosis", "treatment_plan"):
+                        ai_result[field] = regenerated[field]
+                    result["consultation"] = regenerated
+                    st.rerun()
     
     st.markdown("---")
     with st.expander("📝 View Raw Transcript"):
         st.text(ai_result.get("transcript", "No transcript available"))
+    
+    if debug_enabled() and result.get("timings"):
+        with st.expander("⏱ Processing time breakdown"):
+            show_timings(result["timings"])
+
+
+# Component: backend stage timings (debug panel)
+def show_timings(timings):
+    """Table of stage durations from a backend trace ({"total_ms", "stages"})."""
+    rows = []
+    for stage, value in timings.get("stages", {}).items():
+        ms, count = (value["ms"], value["count"]) if isinstance(value, dict) else (value, 1)
+        rows.append({"Stage": stage, "ms": ms, "Calls": count})
+    rows.sort(key=lambda row: -row["ms"])
+    st.caption(f"Total: {timings.get('total_ms', 0):.0f} ms")
+    if rows:
+        st.table(rows)
+
+
+# Component: Consultation Result while the notes stream in
+def show_streaming_consultation_result(events):
+    """Render notes field-by-field as they arrive; returns the final result."""
+    st.info("✨ Generating notes...")
+    
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        st.markdown(f"**Date:** {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+        complaint_slot = st.empty()
+    with col2:
+        diagnosis_slot = st.empty()
+        follow_up_slot = st.empty()
+    st.markdown("---")
+    st.subheader("Medical Notes (SOAP Format)")
+    notes_slot = st.empty()
+    
+    labels = {
+        "chief_complaint": (complaint_slot, "Chief Complaint"),
+        "diagnosis": (diagnosis_slot, "Diagnosis"),
+        "follow_up": (follow_up_slot, "Follow-up"),
+    }
+    values = {}
+    for event, data in events:
+        if event in ("partial", "field"):
+            key = data["field"]
+            if event == "partial":
+                values[key] = values.get(key, "") + data["value"]
+            else:
+                values[key] = data["value"]
+            if key in labels:
+                slot, label = labels[key]
+                slot.markdown(f"**{label}:** {values[key]}")
+            elif key == "formatted_notes":
+                notes_slot.markdown(values[key])
+        elif event == "reset":
+            values = {}
+            for slot, _ in labels.values():
+                slot.empty()
+            notes_slot.empty()
+        elif event == "done":
+            return data
+        elif event == "error":
+            st.error(f"Processing failed: {data.get('detail', 'Unknown error')}")
+            return None
+    return None
 
 
 # Main Dashboard
@@ -231,7 +316,7 @@ def dashboard():
     st.markdown('<p class="sub-header">Select a doctor to begin</p>', unsafe_allow_html=True)
     
     # Fetch doctors
-    doctors = api_get("/api/doctors") or []
+    doctors = load_pages("/api/doctors")
     
     col1, col2 = st.columns([3, 1])
     with col2:
@@ -257,6 +342,8 @@ def dashboard():
                 st.session_state.selected_doctor = doctor
                 st.session_state.current_view = "patients"
                 st.rerun()
+    
+    load_more_button("/api/doctors", "Load more doctors")
 
 
 # Patient Selection View
@@ -278,20 +365,45 @@ def patient_view():
     
     st.markdown("---")
     
-    # Search patients
-    search_query = st.text_input("🔍 Search patients", placeholder="Type patient name...")
-    
-    # Get doctor's patients
-    patients = api_get(f"/api/doctors/{doctor['id']}/patients") or []
+    with st.expander("🔎 Search consultation notes"):
+        notes_query = st.text_input("Search notes", placeholder="Diagnosis, medication, symptom...", key="notes_search")
+        if notes_query.strip():
+            notes_endpoint = (
+                f"/api/consultations/search?doctor_id={doctor['id']}&q={requests.utils.quote(notes_query.strip())}"
+            )
+            hits = load_pages(notes_endpoint)
+            if not hits:
+                st.info("No matching consultations.")
+            for hit in hits:
+                st.markdown(
+                    f"**{hit.get('patient_name') or 'Unknown patient'}** · {hit['consultation_date'][:10]}"
+                    f" · {hit.get('chief_complaint') or 'Consultation'}"
+                )
+                # Highlights come back as <mark> tags; render them as bold
+                st.caption(hit["snippet"].replace("<mark>", "**").replace("</mark>", "**"))
+            load_more_button(notes_endpoint, "More matches")
     
-    # Also search all patients if query provided
-    if search_query:
-        all_patients = api_get(f"/api/patients?search={search_query}") or []
-        existing_ids = {p["id"] for p in patients}
-        for p in all_patients:
-            if p["id"] not in existing_ids:
-                p["_not_linked"] = True
-                patients.append(p)
+    # Search patients
+    search_query = st.text_input(
+        "🔍 Search patients",
+        placeholder="Name, phone, email or date of birth...",
+        on_change=lambda: st.session_state.update(search_changed_at=time.monotonic()),
+    ).strip()
+    
+    linked_endpoint = f"/api/doctors/{doctor['id']}/worklist"
+    # One character matches nearly everyone; keep showing the worklist until there's more to go on
+    searching = len(search_query) >= SEARCH_MIN_CHARS
+    if searching:
+        # Debounce: a newer query submitted meanwhile interrupts this run before the request goes out
+        waited = time.monotonic() - st.session_state.get("search_changed_at", 0)
+        if waited < SEARCH_DEBOUNCE_SECONDS:
+            time.sleep(SEARCH_DEBOUNCE_SECONDS - waited)
+        search_endpoint = f"/api/doctors/{doctor['id']}/patients/search?q={requests.utils.quote(search_query)}"
+        # Matches across all patients, flagged by the backend with whether they're linked to this doctor
+        patients = [{**p, "_not_linked": not p["linked"]} for p in load_pages(search_endpoint, limit=SEARCH_RESULTS)]
+    else:
+        # Worklist: linked patients with their last visit summary, one request per page
+        patients = load_pages(linked_endpoint)
     
     if not patients:
         st.info("No patients found. Add a patient or search to link existing patients.")
@@ -311,6 +423,15 @@ def patient_view():
             st.markdown(f"**{patient['name']}**{age}")
             if patient.get("_not_linked"):
                 st.caption("Not linked to this doctor")
+            elif patient.get("last_visit"):
+                summary = f"Last visit {patient['last_visit'][:10]}"
+                if patient.get("last_diagnosis"):
+                    summary += f" · {patient['last_diagnosis']}"
+                if patient.get("next_follow_up"):
+                    summary += f" · Follow-up {patient['next_follow_up']}"
+                st.caption(f"{summary} · {patient['consultation_count']} visit(s)")
+            else:
+                st.caption("No visits yet")
         with col2:
             if patient.get("_not_linked"):
                 if st.button("Link", key=f"link_{patient['id']}", use_container_width=True):
@@ -326,6 +447,9 @@ def patient_view():
                 st.session_state.selected_patient = patient
                 st.session_state.current_view = "consultation"
                 st.rerun()
+    
+    if not searching:
+        load_more_button(linked_endpoint, "Load more patients")
 
 
 # Consultation Recording View
@@ -340,11 +464,29 @@ def consultation_view():
         st.session_state.selected_patient = None
         st.session_state.audio_bytes = None
         st.session_state.consultation_result = None
+        st.session_state.processing_job_id = None
         st.session_state.current_view = "patients"
         st.rerun()
     
     st.markdown("---")
     
+    # Poll the background job until the notes are ready
+    if st.session_state.processing_job_id:
+        job = api_get_fresh(f"/api/consultations/jobs/{st.session_state.processing_job_id}")
+        if not job:
+            st.session_state.processing_job_id = None
+        elif job["status"] == "succeeded":
+            st.session_state.processing_job_id = None
+            st.session_state.consultation_result = job["result"]
+            st.rerun()
+        elif job["status"] == "failed":
+            st.session_state.processing_job_id = None
+            st.error(f"Processing failed: {job.get('error', 'Unknown error')}")
+        else:
+            st.info(f"⏳ Processing audio with AI... ({job['status']})")
+            time.sleep(JOB_POLL_INTERVAL)
+            st.rerun()
+    
     # Show result if exists
     if st.session_state.consultation_result:
         consultation_id = st.session_state.consultation_result.get("consultation", {}).get("id")
@@ -358,8 +500,11 @@ def consultation_view():
         return
     
     # Audio recorder
-    st.markdown("### 🎤 Record Consultation (Max 30 seconds)")
-    st.info("Click the microphone to start recording. Recording will auto-stop at 30 seconds.")
+    st.markdown("### 🎤 Record Consultation")
+    st.info(
+        "Click the microphone to start recording and again to stop. Full-length consultations are supported; "
+        f"recording auto-stops after {int(RECORDER_PAUSE_THRESHOLD // 60)} minutes of silence."
+    )
     
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
@@ -368,7 +513,7 @@ def consultation_view():
             recording_color="#e74c3c",
             neutral_color="#1e3a5f",
             icon_size="3x",
-            pause_threshold=30.0,
+            pause_threshold=RECORDER_PAUSE_THRESHOLD,
             sample_rate=16000
         )
     
@@ -383,19 +528,29 @@ def consultation_view():
                 st.session_state.audio_bytes = None
                 st.rerun()
         with col2:
-            if st.button("✨ Process with AI", type="primary", use_container_width=True):
-                with st.spinner("Processing audio with AI..."):
-                    files = {"audio": ("recording.wav", audio_bytes, "audio/wav")}
-                    data = {
-                        "doctor_id": doctor["id"],
-                        "patient_id": patient["id"],
-                        "doctor_name": doctor["name"],
-                        "patient_name": patient["name"]
-                    }
-                    result = api_post("/api/consultations/process-audio", data=data, files=files)
-                    if result:
-                        st.session_state.consultation_result = result
-                        st.rerun()
+            process_clicked = st.button("✨ Process with AI", type="primary", use_container_width=True)
+        
+        if process_clicked:
+            files = {"audio": ("recording.wav", audio_bytes, "audio/wav")}
+            data = {
+                "doctor_id": doctor["id"],
+                "patient_id": patient["id"],
+                "doctor_name": doctor["name"],
+                "patient_name": patient["name"]
+            }
+            if STREAM_NOTES:
+                # Rendered full width, below the recorder controls
+                st.markdown("---")
+                events = api_stream("/api/consultations/process-audio/stream", data=data, files=files)
+                result = show_streaming_consultation_result(events)
+                if result:
+                    st.session_state.consultation_result = result
+                    st.rerun()
+            else:
+                job = api_post("/api/consultations/process-audio", data=data, files=files)
+                if job:
+                    st.session_state.processing_job_id = job["job_id"]
+                    st.rerun()
 
 
 # History View
@@ -432,6 +587,7 @@ def add_patient_view():
 
 # Main Router
 def main():
+    start_rerun()
     # Sidebar
     with st.sidebar:
         st.markdown("### 🏥 Medical App")
@@ -445,31 +601,53 @@ def main():
         st.markdown("---")
         st.caption(f"Backend: {BACKEND_URL}")
         
-        # Health check
-        try:
-            health = api_get("/health")
-            if health and health.get("status") == "healthy":
-                st.success("✓ API Connected")
-            else:
-                st.error("✗ API Error")
-        except:
-            st.error("✗ API Offline")
+        # Health check (probed in the background, not on every rerun)
+        health = health_probe().status
+        if health["ok"] is None:
+            st.info("… Checking API")
+        elif health["ok"]:
+            st.success(f"✓ API Connected ({health['latency_ms']} ms)")
+        else:
+            st.error(f"✗ API Offline: {health['error']}")
+        
+        history = st.session_state.get("rerun_history")
+        if history:
+            last = history[-1]
+            st.caption(
+                f"Last rerun: {last['total_ms']:.0f} ms, "
+                f"{last['requests']} request(s) taking {last['request_ms']:.0f} ms"
+            )
+        
+        # Debug panel: asks the backend for Server-Timing on every request while on
+        st.toggle("⏱ Timing breakdown", value=DEBUG_TIMINGS, key="debug_timings")
+        if debug_enabled() and history and history[-1].get("server"):
+            with st.expander("Backend stages, last rerun"):
+                for method, endpoint, stages in history[-1]["server"]:
+                    st.caption(f"{method} {endpoint}")
+                    st.text("\n".join(
+                        f"{stage:<28} {ms:>8.1f} ms" if ms is not None else stage
+                        for stage, ms in stages.items()
+                    ))
     
     # Route to appropriate view
     view = st.session_state.current_view
     
-    if view == "dashboard":
-        dashboard()
-    elif view == "patients":
-        patient_view()
-    elif view == "consultation":
-        consultation_view()
-    elif view == "history":
-        history_view()
-    elif view == "add_doctor":
-        add_doctor_view()
-    elif view == "add_patient":
-        add_patient_view()
+    try:
+        if view == "dashboard":
+            dashboard()
+        elif view == "patients":
+            patient_view()
+        elif view == "consultation":
+            consultation_view()
+        elif view == "history":
+            history_view()
+        elif view == "add_doctor":
+            add_doctor_view()
+        elif view == "add_patient":
+            add_patient_view()
+    finally:
+        # Also runs when a view calls st.rerun(), which raises
+        finish_rerun()
 
 
 if __name__ == "__main__":
@@ -4,6 +4,12 @@
 -- Enable UUID extension
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
+-- Trigram matching for patient search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Lets the consultation search index lead with doctor_id
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
 -- Doctors table
 CREATE TABLE IF NOT EXISTS doctors (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -65,6 +71,219 @@ CREATE INDEX IF NOT EXISTS idx_consultations_doctor ON consultations(doctor_id);
 CREATE INDEX IF NOT EXISTS idx_consultations_patient ON consultations(patient_id);
 CREATE INDEX IF NOT EXISTS idx_consultations_date ON consultations(consultation_date DESC);
 
+-- Keyset pagination: each list is read in (sort column, id) order
+CREATE INDEX IF NOT EXISTS idx_doctors_name_id ON doctors(name, id);
+CREATE INDEX IF NOT EXISTS idx_patients_name_id ON patients(name, id);
+CREATE INDEX IF NOT EXISTS idx_consultations_patient_date_id ON consultations(patient_id, consultation_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_consultations_doctor_date_id ON consultations(doctor_id, consultation_date DESC, id DESC);
+
+-- Patient search: trigram indexes serve ILIKE '%term%' and fuzzy (%) matches,
+-- the text_pattern_ops index serves 1-2 character prefixes trigrams can't
+CREATE INDEX IF NOT EXISTS idx_patients_name_trgm ON patients USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_email_trgm ON patients USING gin (email gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_phone_digits_trgm
+    ON patients USING gin ((regexp_replace(phone, '\D', '', 'g')) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_name_prefix ON patients (lower(name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_dob ON patients(date_of_birth);
+
+-- Ranked patient search: name prefix matches first, then by trigram similarity.
+-- Also matches phone digits, email and an exact date of birth (YYYY-MM-DD).
+CREATE OR REPLACE FUNCTION search_patients(q TEXT, max_results INT DEFAULT 20)
+RETURNS SETOF patients AS $$
+DECLARE
+    term TEXT := lower(trim(q));
+    -- term with LIKE wildcards escaped, so '%' or '_' in a query matches literally
+    pattern TEXT := replace(replace(replace(term, '\', '\\'), '%', '\%'), '_', '\_');
+    digits TEXT := regexp_replace(q, '\D', '', 'g');
+    dob DATE;
+BEGIN
+    IF term = '' THEN
+        RETURN;
+    END IF;
+    max_results := least(greatest(max_results, 1), 50);
+
+    IF length(term) < 3 THEN
+        -- Too short for trigrams: btree prefix scan on the name only
+        RETURN QUERY
+            SELECT p.* FROM patients p
+            WHERE lower(p.name) LIKE pattern || '%'
+            ORDER BY lower(p.name), p.id
+            LIMIT max_results;
+        RETURN;
+    END IF;
+
+    IF term ~ '^\d{4}-\d{2}-\d{2}$' THEN
+        BEGIN
+            dob := term::DATE;
+        EXCEPTION WHEN others THEN
+            dob := NULL;
+        END;
+    END IF;
+
+    RETURN QUERY
+        SELECT p.* FROM patients p
+        WHERE p.name ILIKE '%' || pattern || '%'
+           OR p.name % term
+           OR p.email ILIKE pattern || '%'
+           OR (length(digits) >= 3 AND regexp_replace(p.phone, '\D', '', 'g') LIKE '%' || digits || '%')
+           OR p.date_of_birth = dob
+        ORDER BY
+            (lower(p.name) LIKE pattern || '%') DESC,
+            similarity(p.name, term) DESC,
+            p.name,
+            p.id
+        LIMIT max_results;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Patient search from one doctor's point of view: the same ranked matches,
+-- each flagged with whether it is already linked to that doctor
+CREATE OR REPLACE FUNCTION search_doctor_patients(doctor UUID, q TEXT, max_results INT DEFAULT 20)
+RETURNS TABLE (
+    id UUID,
+    name VARCHAR,
+    date_of_birth DATE,
+    gender VARCHAR,
+    phone VARCHAR,
+    email VARCHAR,
+    allergies TEXT,
+    linked BOOLEAN
+) AS $$
+    SELECT s.id, s.name, s.date_of_birth, s.gender, s.phone, s.email, s.allergies, dp.id IS NOT NULL
+    FROM search_patients(q, max_results) WITH ORDINALITY AS s
+    LEFT JOIN doctor_patients dp ON dp.patient_id = s.id AND dp.doctor_id = doctor
+    ORDER BY s.ordinality;
+$$ LANGUAGE sql STABLE;
+
+-- Full-text search over consultation notes, weighted so complaint and diagnosis
+-- outrank the treatment plan, which outranks the free-form notes
+ALTER TABLE consultations ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+CREATE OR REPLACE FUNCTION consultation_search_vector(
+    chief_complaint TEXT, diagnosis TEXT, treatment_plan TEXT, formatted_notes TEXT
+)
+RETURNS TSVECTOR AS $$
+    SELECT setweight(to_tsvector('english', coalesce(chief_complaint, '')), 'A') ||
+           setweight(to_tsvector('english', coalesce(diagnosis, '')), 'A') ||
+           setweight(to_tsvector('english', coalesce(treatment_plan, '')), 'B') ||
+           setweight(to_tsvector('english', coalesce(formatted_notes, '')), 'C');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION update_consultation_search_vector()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector = consultation_search_vector(
+        NEW.chief_complaint, NEW.diagnosis, NEW.treatment_plan, NEW.formatted_notes
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_consultations_search_vector ON consultations;
+CREATE TRIGGER update_consultations_search_vector
+    BEFORE INSERT OR UPDATE OF chief_complaint, diagnosis, treatment_plan, formatted_notes ON consultations
+    FOR EACH ROW EXECUTE FUNCTION update_consultation_search_vector();
+
+-- Backfill rows written before the trigger existed
+UPDATE consultations
+SET search_vector = consultation_search_vector(chief_complaint, diagnosis, treatment_plan, formatted_notes)
+WHERE search_vector IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_consultations_search ON consultations USING gin (doctor_id, search_vector);
+
+-- Ranked search within one doctor's consultations. Pages with keyset on
+-- (rank, id); snippets are only built for the rows on the page.
+CREATE OR REPLACE FUNCTION search_consultations(
+    doctor UUID, q TEXT, max_results INT DEFAULT 20, after_rank REAL DEFAULT NULL, after_id UUID DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    patient_id UUID,
+    patient_name VARCHAR,
+    consultation_date TIMESTAMP WITH TIME ZONE,
+    chief_complaint VARCHAR,
+    diagnosis TEXT,
+    rank REAL,
+    snippet TEXT
+) AS $$
+    WITH query AS (
+        SELECT websearch_to_tsquery('english', q) AS tsq
+    ),
+    hits AS (
+        SELECT c.id, c.patient_id, c.consultation_date, c.chief_complaint, c.diagnosis,
+               c.treatment_plan, c.formatted_notes, ts_rank(c.search_vector, query.tsq) AS rank
+        FROM consultations c, query
+        WHERE c.doctor_id = doctor AND c.search_vector @@ query.tsq
+    ),
+    page AS (
+        SELECT * FROM hits
+        WHERE after_rank IS NULL OR (hits.rank, hits.id) < (after_rank, after_id)
+        ORDER BY hits.rank DESC, hits.id DESC
+        LIMIT max_results
+    )
+    SELECT page.id, page.patient_id, p.name, page.consultation_date, page.chief_complaint, page.diagnosis, page.rank,
+           ts_headline(
+               'english',
+               concat_ws(' ... ', page.chief_complaint, page.diagnosis, page.treatment_plan, page.formatted_notes),
+               query.tsq,
+               'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=25, MinWords=8'
+           )
+    FROM page
+    CROSS JOIN query
+    LEFT JOIN patients p ON p.id = page.patient_id
+    ORDER BY page.rank DESC, page.id DESC;
+$$ LANGUAGE sql STABLE;
+
+-- Doctor worklist: each linked patient with their latest consultation with this
+-- doctor, consultation count and next follow-up, in one query. Pages with keyset
+-- on (name, id); the lateral subqueries use idx_consultations_patient_date_id.
+CREATE OR REPLACE FUNCTION doctor_worklist(
+    doctor UUID, max_results INT DEFAULT 50, after_name TEXT DEFAULT NULL, after_id UUID DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    name VARCHAR,
+    date_of_birth DATE,
+    gender VARCHAR,
+    phone VARCHAR,
+    allergies TEXT,
+    last_consultation_id UUID,
+    last_visit TIMESTAMP WITH TIME ZONE,
+    last_chief_complaint VARCHAR,
+    last_diagnosis TEXT,
+    next_follow_up DATE,
+    consultation_count BIGINT
+) AS $$
+    SELECT p.id, p.name, p.date_of_birth, p.gender, p.phone, p.allergies,
+           latest.id, latest.consultation_date, latest.chief_complaint, latest.diagnosis,
+           totals.next_follow_up, coalesce(totals.consultation_count, 0)
+    FROM doctor_patients dp
+    JOIN patients p ON p.id = dp.patient_id
+    LEFT JOIN LATERAL (
+        SELECT c.id, c.consultation_date, c.chief_complaint, c.diagnosis
+        FROM consultations c
+        WHERE c.patient_id = p.id AND c.doctor_id = doctor
+        ORDER BY c.consultation_date DESC, c.id DESC
+        LIMIT 1
+    ) latest ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT count(*) AS consultation_count,
+               min(c.follow_up_date) FILTER (WHERE c.follow_up_date >= current_date) AS next_follow_up
+        FROM consultations c
+        WHERE c.patient_id = p.id AND c.doctor_id = doctor
+    ) totals ON TRUE
+    WHERE dp.doctor_id = doctor
+      AND (after_name IS NULL OR (p.name, p.id) > (after_name, after_id))
+    ORDER BY p.name, p.id
+    LIMIT max_results;
+$$ LANGUAGE sql STABLE;
+
+-- Model tokens each consultation cost (prompt_tokens includes cached_tokens);
+-- NULL for rows written before this was recorded
+ALTER TABLE consultations ADD COLUMN IF NOT EXISTS prompt_tokens INTEGER;
+ALTER TABLE consultations ADD COLUMN IF NOT EXISTS cached_tokens INTEGER;
+ALTER TABLE consultations ADD COLUMN IF NOT EXISTS completion_tokens INTEGER;
+
 -- Updated_at trigger function
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$